@@ -0,0 +1,104 @@
+DEVICE = "cuda"
+BATCH = 2
+HEIGHT = 1024
+WIDTH = 1024
+ITERS = 1000
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+import oneflow as flow  # usort: skip
+from onediff.infer_compiler.backends.oneflow.args_tree_util import (
+    input_output_processor,
+    process_input_with_args_tree,
+)
+from oneflow.framework.args_tree import ArgsTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro"))
+from fake_deployable_module import FakeDeployableModule  # usort: skip
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the host overhead of converting the inputs and outputs of one SDXL UNet step."
+    )
+    parser.add_argument("--device", type=str, default=DEVICE)
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--iters", type=int, default=ITERS)
+    return parser.parse_args()
+
+
+def sdxl_unet_inputs(batch, height, width, device):
+    dtype = torch.float16
+    sample = torch.randn(batch, 4, height // 8, width // 8, dtype=dtype, device=device)
+    timestep = torch.tensor(999, device=device)
+    encoder_hidden_states = torch.randn(batch, 77, 2048, dtype=dtype, device=device)
+    added_cond_kwargs = {
+        "text_embeds": torch.randn(batch, 1280, dtype=dtype, device=device),
+        "time_ids": torch.randn(batch, 6, dtype=dtype, device=device),
+    }
+    args = (sample, timestep)
+    kwargs = {
+        "encoder_hidden_states": encoder_hidden_states,
+        "added_cond_kwargs": added_cond_kwargs,
+        "return_dict": False,
+    }
+    return args, kwargs
+
+
+def identity(self, sample, *args, **kwargs):
+    # Mimic the (sample,) tuple returned by a UNet called with return_dict=False
+    return (sample,)
+
+
+def args_tree_processor(func):
+    # The conversion path used before call plans were cached, kept for comparison
+    def wrapper(self, *args, **kwargs):
+        mapped_args, mapped_kwargs, _ = process_input_with_args_tree(*args, **kwargs)
+        output = func(self, *mapped_args, **mapped_kwargs)
+
+        def output_fn(value):
+            if isinstance(value, flow.Tensor):
+                return flow.utils.tensor.to_torch(value)
+            return value
+
+        return ArgsTree((output, None), False).map_leaf(output_fn)[0]
+
+    return wrapper
+
+
+def measure(fn, module, args, kwargs, iters):
+    for _ in range(10):
+        fn(module, *args, **kwargs)
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn(module, *args, **kwargs)
+    return (time.perf_counter() - start) / iters * 1e6
+
+
+def main():
+    args = parse_args()
+    module = FakeDeployableModule()
+    call_args, call_kwargs = sdxl_unet_inputs(
+        args.batch, args.height, args.width, args.device
+    )
+
+    baseline = measure(
+        args_tree_processor(identity), module, call_args, call_kwargs, args.iters
+    )
+    call_plan = measure(
+        input_output_processor(identity), module, call_args, call_kwargs, args.iters
+    )
+    print(f"ArgsTree conversion: {baseline:.1f} us per UNet step")
+    print(f"Call plan conversion: {call_plan:.1f} us per UNet step")
+    print(f"Speedup: {baseline / call_plan:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
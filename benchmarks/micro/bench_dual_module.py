@@ -0,0 +1,29 @@
+"""Attribute access on a DualModule, which dispatches to the torch or the
+oneflow module depending on the exec mode."""
+from onediff.infer_compiler.backends.oneflow.dual_module import get_mixed_dual_module
+from onediff.infer_compiler.backends.oneflow.oneflow_exec_mode import oneflow_exec_mode
+from onediff.infer_compiler.backends.oneflow.transform.builtin_transform import (
+    torch2oflow,
+)
+
+
+def _dual_module(synthetic_unet):
+    oneflow_module = torch2oflow(synthetic_unet)
+    return get_mixed_dual_module(type(synthetic_unet))(synthetic_unet, oneflow_module)
+
+
+def bench_dual_module_getattr_submodule(benchmark, synthetic_unet):
+    dual_module = _dual_module(synthetic_unet)
+    benchmark(getattr, dual_module, "conv_in")
+
+
+def bench_dual_module_getattr_module_list(benchmark, synthetic_unet):
+    dual_module = _dual_module(synthetic_unet)
+    benchmark(getattr, dual_module, "down_blocks")
+
+
+def bench_dual_module_getattr_oneflow_mode(benchmark, synthetic_unet):
+    dual_module = _dual_module(synthetic_unet)
+    conv_in = dual_module.conv_in
+    with oneflow_exec_mode():
+        benchmark(getattr, conv_in, "padding")
@@ -0,0 +1,30 @@
+"""ModuleGraphCache lookups, done when the input structure of a call differs
+from the one of the graph in use."""
+from onediff.infer_compiler.backends.oneflow.graph_cache_manager import (
+    GraphCacheManager,
+    ModuleGraphCache,
+)
+
+KEYS = [f"input_structure_{i}" for i in range(9)]
+
+
+class FakeGraph:
+    device_bytes = 1 << 20
+    compile_seconds = 60.0
+
+
+def bench_module_graph_cache_get_hit(benchmark):
+    cache = ModuleGraphCache("UNet", len(KEYS), GraphCacheManager())
+    for key in KEYS:
+        cache.put(key, FakeGraph())
+    benchmark(cache.get, KEYS[0])
+
+
+def bench_module_graph_cache_put_evict(benchmark):
+    cache = ModuleGraphCache("UNet", len(KEYS) - 1, GraphCacheManager())
+
+    def run():
+        for key in KEYS:
+            cache.put(key, FakeGraph())
+
+    benchmark(run)
@@ -0,0 +1,13 @@
+"""The cache key of the graph file of a call, derived from the model structure
+and the input structure, computed on the first call of a module with a graph
+file."""
+from onediff.infer_compiler import oneflow_compile
+from onediff.infer_compiler.backends.oneflow.graph_management_utils import (
+    generate_graph_cache_key,
+)
+
+
+def bench_generate_graph_cache_key(benchmark, synthetic_unet, sdxl_unet_inputs):
+    deployable_module = oneflow_compile(synthetic_unet)
+    args, kwargs = sdxl_unet_inputs
+    benchmark(generate_graph_cache_key, "unet", deployable_module, args, kwargs)
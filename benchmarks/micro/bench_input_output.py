@@ -0,0 +1,51 @@
+"""The conversion of the inputs and outputs of a UNet step between torch and
+oneflow, done by input_output_processor on every call."""
+import torch
+import oneflow as flow  # usort: skip
+from fake_deployable_module import FakeDeployableModule
+from onediff.infer_compiler.backends.oneflow.args_tree_util import (
+    input_output_processor,
+    process_input_with_args_tree,
+    process_input_with_call_plan,
+    process_output,
+)
+from onediff.infer_compiler.backends.oneflow.utils.hash_utils import (
+    generate_input_structure_key,
+)
+from oneflow.framework.args_tree import ArgsTree
+
+
+def identity(self, sample, *args, **kwargs):
+    # Mimic the (sample,) tuple returned by a UNet called with return_dict=False
+    return (sample,)
+
+
+def bench_input_output_processor(benchmark, sdxl_unet_inputs):
+    args, kwargs = sdxl_unet_inputs
+    benchmark(input_output_processor(identity), FakeDeployableModule(), *args, **kwargs)
+
+
+def bench_process_input_with_call_plan(benchmark, sdxl_unet_inputs):
+    args, kwargs = sdxl_unet_inputs
+    benchmark(process_input_with_call_plan, *args, **kwargs)
+
+
+def bench_process_input_with_args_tree(benchmark, sdxl_unet_inputs):
+    args, kwargs = sdxl_unet_inputs
+    benchmark(process_input_with_args_tree, *args, **kwargs)
+
+
+def bench_process_output(benchmark, sdxl_unet_inputs):
+    args, _ = sdxl_unet_inputs
+    output = (flow.utils.tensor.from_torch(args[0]),)
+    benchmark(process_output, output)
+
+
+def bench_generate_input_structure_key(benchmark, sdxl_unet_inputs):
+    args, kwargs = sdxl_unet_inputs
+
+    def run():
+        args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
+        return generate_input_structure_key(args_tree)
+
+    benchmark(run)
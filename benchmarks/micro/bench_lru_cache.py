@@ -0,0 +1,30 @@
+"""LRUCache lookups, done for the call plan of every call.
+
+The graphs of a deployable module are cached by ModuleGraphCache instead, see
+bench_graph_cache.py.
+"""
+from onediff.utils.chache_utils import LRUCache
+
+KEYS = [f"input_structure_{i}" for i in range(9)]
+
+
+def bench_lru_cache_get_hit(benchmark):
+    cache = LRUCache(len(KEYS))
+    for key in KEYS:
+        cache.put(key, key)
+    benchmark(cache.get, KEYS[0])
+
+
+def bench_lru_cache_get_miss(benchmark):
+    cache = LRUCache(len(KEYS))
+    benchmark(cache.get, "missing", None)
+
+
+def bench_lru_cache_put_evict(benchmark):
+    cache = LRUCache(len(KEYS) - 1)
+
+    def run():
+        for key in KEYS:
+            cache.put(key, key)
+
+    benchmark(run)
@@ -0,0 +1,11 @@
+"""Conversion of a torch module to oneflow, done on every cold start and
+every recompile."""
+from onediff.infer_compiler.backends.oneflow.transform.builtin_transform import (
+    torch2oflow,
+)
+
+
+def bench_torch2oflow_synthetic_unet(benchmark, synthetic_unet):
+    # The first conversion also mocks the classes, which is measured apart
+    torch2oflow(synthetic_unet)
+    benchmark(torch2oflow, synthetic_unet)
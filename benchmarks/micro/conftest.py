@@ -0,0 +1,48 @@
+import importlib.util
+
+import pytest
+
+# The benchmarks need these, and are not collected without them
+REQUIRED_MODULES = ("pytest_benchmark", "torch", "oneflow")
+if any(importlib.util.find_spec(name) is None for name in REQUIRED_MODULES):
+    collect_ignore_glob = ["bench_*.py"]
+
+
+def pytest_configure(config):
+    # Keep every run in ./.benchmarks for --benchmark-compare
+    if config.pluginmanager.hasplugin("benchmark") and not config.option.benchmark_save:
+        config.option.benchmark_autosave = True
+
+
+BATCH = 2
+HEIGHT = 1024
+WIDTH = 1024
+
+
+@pytest.fixture
+def sdxl_unet_inputs():
+    """The inputs of one SDXL UNet step, on CPU."""
+    import torch
+
+    dtype = torch.float16
+    sample = torch.randn(BATCH, 4, HEIGHT // 8, WIDTH // 8, dtype=dtype)
+    timestep = torch.tensor(999)
+    encoder_hidden_states = torch.randn(BATCH, 77, 2048, dtype=dtype)
+    added_cond_kwargs = {
+        "text_embeds": torch.randn(BATCH, 1280, dtype=dtype),
+        "time_ids": torch.randn(BATCH, 6, dtype=dtype),
+    }
+    args = (sample, timestep)
+    kwargs = {
+        "encoder_hidden_states": encoder_hidden_states,
+        "added_cond_kwargs": added_cond_kwargs,
+        "return_dict": False,
+    }
+    return args, kwargs
+
+
+@pytest.fixture
+def synthetic_unet():
+    from synthetic_unet import SyntheticUNet
+
+    return SyntheticUNet().eval()
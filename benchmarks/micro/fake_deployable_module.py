@@ -0,0 +1,17 @@
+"""A stand-in for OneflowDeployableModule in the benchmarks of
+input_output_processor, shared with benchmarks/input_output_processor_overhead.py."""
+from onediff.infer_compiler import OneflowCompileOptions
+from onediff.infer_compiler.backends.call_metrics import CallMetrics
+
+
+class FakeDeployableModule:
+    """Holds the attributes read by input_output_processor, without any graph."""
+
+    _deployable_module_options = OneflowCompileOptions(use_graph=False)
+    _deployable_module_enable_dynamic = True
+    _deployable_module_dpl_graph = None
+    _deployable_module_input_structure_key = None
+    _deployable_module_shape_bucketer = None
+    _deployable_module_async_compiler = None
+    _deployable_module_run_eager = False
+    _deployable_module_metrics = CallMetrics("FakeDeployableModule")
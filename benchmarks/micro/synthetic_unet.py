@@ -0,0 +1,76 @@
+"""A UNet-shaped model to benchmark conversion without any weights to download."""
+import torch
+
+
+class Attention(torch.nn.Module):
+    def __init__(self, channels, context_channels, heads=4):
+        super().__init__()
+        self.heads = heads
+        self.to_q = torch.nn.Linear(channels, channels, bias=False)
+        self.to_k = torch.nn.Linear(context_channels, channels, bias=False)
+        self.to_v = torch.nn.Linear(context_channels, channels, bias=False)
+        self.to_out = torch.nn.ModuleList(
+            [torch.nn.Linear(channels, channels), torch.nn.Dropout(0.0)]
+        )
+
+    def forward(self, x, context):
+        q, k, v = self.to_q(x), self.to_k(context), self.to_v(context)
+        weights = torch.softmax(q @ k.transpose(-1, -2) / q.shape[-1] ** 0.5, dim=-1)
+        out = weights @ v
+        for layer in self.to_out:
+            out = layer(out)
+        return out
+
+
+class ResnetBlock(torch.nn.Module):
+    def __init__(self, in_channels, out_channels):
+        super().__init__()
+        self.norm1 = torch.nn.GroupNorm(8, in_channels)
+        self.conv1 = torch.nn.Conv2d(in_channels, out_channels, 3, padding=1)
+        self.norm2 = torch.nn.GroupNorm(8, out_channels)
+        self.conv2 = torch.nn.Conv2d(out_channels, out_channels, 3, padding=1)
+        self.nonlinearity = torch.nn.SiLU()
+        self.conv_shortcut = (
+            torch.nn.Conv2d(in_channels, out_channels, 1)
+            if in_channels != out_channels
+            else None
+        )
+
+    def forward(self, x):
+        h = self.conv1(self.nonlinearity(self.norm1(x)))
+        h = self.conv2(self.nonlinearity(self.norm2(h)))
+        if self.conv_shortcut is not None:
+            x = self.conv_shortcut(x)
+        return x + h
+
+
+class SyntheticUNet(torch.nn.Module):
+    """A UNet-shaped stack of resnet and attention blocks, small enough to
+    build on CPU, with a few hundred submodules like the real ones."""
+
+    def __init__(self, channels=(32, 64, 64, 128), context_channels=64):
+        super().__init__()
+        self.conv_in = torch.nn.Conv2d(4, channels[0], 3, padding=1)
+        self.down_blocks = torch.nn.ModuleList()
+        for in_channels, out_channels in zip(channels[:-1], channels[1:]):
+            self.down_blocks.append(
+                torch.nn.ModuleList(
+                    [
+                        ResnetBlock(in_channels, out_channels),
+                        ResnetBlock(out_channels, out_channels),
+                        Attention(out_channels, context_channels),
+                    ]
+                )
+            )
+        self.up_blocks = torch.nn.ModuleList(
+            [
+                torch.nn.ModuleList(
+                    [
+                        ResnetBlock(out_channels, in_channels),
+                        Attention(in_channels, context_channels),
+                    ]
+                )
+                for in_channels, out_channels in zip(channels[:-1], channels[1:])
+            ][::-1]
+        )
+        self.conv_out = torch.nn.Conv2d(channels[0], 4, 3, padding=1)
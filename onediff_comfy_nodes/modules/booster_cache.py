@@ -4,6 +4,7 @@ from functools import singledispatch
 import torch
 from comfy.model_patcher import ModelPatcher
 from comfy.sd import VAE
+from onediff.infer_compiler import DeployableModule
 from onediff.torch_utils.module_operations import get_sub_module
 from onediff.utils.import_utils import is_oneflow_available
 
@@ -19,9 +20,15 @@ def _(new_model: ModelPatcher, cached_model):
             f"Model type mismatch: expected {type(cached_model)}, got {type(new_model.model)}"
         )
 
-    cached_model.diffusion_model.load_state_dict(
-        new_model.model.diffusion_model.state_dict(), strict=True
-    )
+    if isinstance(cached_model.diffusion_model, DeployableModule):
+        # Copy into the compiled module in place, keeping its graphs valid
+        cached_model.diffusion_model.swap_weights(
+            new_model.model.diffusion_model.state_dict(), strict=True
+        )
+    else:
+        cached_model.diffusion_model.load_state_dict(
+            new_model.model.diffusion_model.state_dict(), strict=True
+        )
     new_model.model.diffusion_model = cached_model.diffusion_model
     new_model.weight_inplace_update = True
     return new_model
@@ -6,12 +6,14 @@ from .compilers.diffusion_pipeline_compiler import (
     load_pipe,
     quantize_pipe,
     save_pipe,
+    warmup_pipe,
 )
 
 __all__ = [
     "compile_pipe",
     "save_pipe",
     "load_pipe",
+    "warmup_pipe",
     "OneflowCompileOptions",
     "quantize_pipe",
 ]
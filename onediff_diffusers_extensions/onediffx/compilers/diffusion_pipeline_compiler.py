@@ -1,6 +1,9 @@
 import functools
+import inspect
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 from onediff.infer_compiler import compile, DeployableModule
@@ -169,15 +172,50 @@ def load_pipe(
     dir="cached_pipe",
     *,
     ignores=(),
+    max_workers=None,
 ):
+    """Loads the graphs saved by `save_pipe` into the compiled parts of `pipe`.
+
+    The parts are independent of each other and are loaded concurrently.
+    `max_workers` bounds the number of parts loaded at the same time, it
+    defaults to the number of parts to load and 1 loads them one by one.
+
+    Only reading the graph files and their states runs concurrently. The
+    oneflow modules and graphs of all parts are created first on the calling
+    thread, as the torch to oneflow conversion patches imports and fills
+    process-wide caches, and is not thread-safe.
+    """
     if not os.path.exists(dir):
         return
     filtered_parts = _filter_parts(ignores=ignores)
+    parts_to_load = []
     for part in filtered_parts:
         obj = _recursive_getattr(pipe, part, None)
         if obj is not None and os.path.exists(os.path.join(dir, part)):
-            logger.info(f"Loading {part}")
-            obj.load_graph(os.path.join(dir, part))
+            parts_to_load.append((part, obj))
+
+    def load_part(part, obj):
+        logger.info(f"Loading {part}")
+        start = time.perf_counter()
+        obj.load_graph(os.path.join(dir, part))
+        logger.info(f"Loaded {part} in {time.perf_counter() - start:.2f}s")
+
+    if max_workers is None:
+        max_workers = len(parts_to_load)
+    if max_workers <= 1 or len(parts_to_load) <= 1:
+        for part, obj in parts_to_load:
+            load_part(part, obj)
+    else:
+        # Converts the oneflow module of each part, before any worker does
+        for _, obj in parts_to_load:
+            if isinstance(obj, DeployableModule):
+                obj.get_graph()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(load_part, part, obj) for part, obj in parts_to_load
+            ]
+            for future in futures:
+                future.result()
 
     if "image_processor" not in ignores:
         logger.info("Patching image_processor")
@@ -189,6 +227,110 @@ def load_pipe(
         patch_image_prcessor_(pipe.image_processor)
 
 
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _get_num_inference_steps(steps, strength):
+    # img2img and inpaint pipelines run int(num_inference_steps * strength)
+    # steps, which is 0 for one inference step and the default strength
+    if not isinstance(strength, (int, float)) or strength <= 0:
+        return steps
+    num_inference_steps = steps
+    while int(num_inference_steps * strength) < steps:
+        num_inference_steps += 1
+    return num_inference_steps
+
+
+def warmup_pipe(
+    pipe,
+    shapes=((1024, 1024),),
+    batch_sizes=(1,),
+    steps=1,
+    *,
+    save_dir=None,
+    ignores=(),
+    **pipe_kwargs,
+):
+    """Warms up the compiled parts of `pipe` on synthetic inputs.
+
+    The pipeline runs once for every (shape, batch size) pair, so the graphs of
+    all compiled parts are built before serving real requests.
+
+    Args:
+        pipe: The pipeline compiled with `compile_pipe`.
+        shapes: The (height, width) image sizes to warm up.
+        batch_sizes: The batch sizes to warm up for each shape, passed as the
+            number of images per prompt if the pipeline takes it.
+        steps: The number of denoising steps run by each call. Pipelines with
+            a `strength` get enough inference steps for it.
+        save_dir: If set, the graphs are saved with `save_pipe` after warmup.
+        ignores: The parts passed to `save_pipe` to be ignored.
+        pipe_kwargs: Extra arguments passed to each pipeline call.
+
+    Returns:
+        A list of dicts with the height, width, batch size and elapsed seconds
+        of each warmup run.
+    """
+    from PIL import Image
+
+    call_params = inspect.signature(pipe.__call__).parameters
+    report = []
+    for height, width in shapes:
+        for batch_size in batch_sizes:
+            kwargs = dict(pipe_kwargs)
+            per_prompt_names = [
+                name
+                for name in ("num_images_per_prompt", "num_videos_per_prompt")
+                if name in call_params
+            ]
+            if len(per_prompt_names) > 0:
+                kwargs.setdefault(per_prompt_names[0], batch_size)
+                if "prompt" in call_params:
+                    kwargs.setdefault("prompt", "warmup")
+            elif "prompt" in call_params:
+                prompt = kwargs.get("prompt", "warmup")
+                if isinstance(prompt, str):
+                    kwargs["prompt"] = [prompt] * batch_size
+            # img2img, controlnet and image-to-video pipelines need an input image
+            for name in ("image", "control_image"):
+                if name in call_params and name not in kwargs:
+                    kwargs[name] = Image.new("RGB", (width, height))
+            strength = kwargs.get("strength")
+            if strength is None and "strength" in call_params:
+                strength = call_params["strength"].default
+            for name, value in (
+                ("height", height),
+                ("width", width),
+                ("num_inference_steps", _get_num_inference_steps(steps, strength)),
+            ):
+                if name in call_params:
+                    kwargs.setdefault(name, value)
+
+            _synchronize()
+            start = time.perf_counter()
+            pipe(**kwargs)
+            _synchronize()
+            elapsed = time.perf_counter() - start
+
+            logger.info(
+                f"Warmup {height}x{width} with batch size {batch_size} took {elapsed:.3f} seconds"
+            )
+            report.append(
+                {
+                    "height": height,
+                    "width": width,
+                    "batch_size": batch_size,
+                    "seconds": elapsed,
+                }
+            )
+
+    if save_dir is not None:
+        save_pipe(pipe, save_dir, ignores=ignores)
+    return report
+
+
 def quantize_pipe(
     pipe, quant_submodules_config_path=None, top_percentage=90, *, ignores=(), **kwargs
 ):
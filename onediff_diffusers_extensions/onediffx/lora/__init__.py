@@ -6,6 +6,15 @@ from .lora import (
     delete_adapters,
     get_active_adapters,
     load_and_fuse_lora,
+    prefetch_loras,
     set_and_fuse_adapters,
     unfuse_lora,
 )
+from .preconverted import convert_lora, load_preconverted_lora
+from .snapshot import disable_lora_snapshots, enable_lora_snapshots
+from .unfused import (
+    disable_unfused_lora,
+    enable_unfused_lora,
+    is_unfused_lora_enabled,
+    set_unfused_adapters,
+)
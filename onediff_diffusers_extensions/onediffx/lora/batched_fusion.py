@@ -0,0 +1,256 @@
+"""Fuses and unfuses the LoRA weights of many layers at once.
+
+Instead of a GEMM, a float copy and a dtype conversion per layer and adapter,
+the layers are grouped by weight shape, dtype and device. The deltas of a
+group are computed with one batched GEMM per adapter and rank, summed in
+float, and added to the weights with one dtype conversion for the group.
+Fusing and unfusing the same adapter cancel out before any GEMM, so adapters
+kept across a switch cost nothing. Layers with a snapshot of their base
+weight, see `onediffx.lora.snapshot`, are restored from it instead of
+unfusing.
+"""
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import torch
+from onediff.utils import logger
+
+from .snapshot import get_lora_snapshot_store
+from .utils import is_peft_available, PatchedLoraProjection, update_graph_related_tensor
+
+if is_peft_available():
+    import peft
+
+# The float deltas of a batch of layers are held at once
+_FUSION_BATCH_BYTES = 256 << 20
+
+# A LoRA term: (layer, adapter name, signed scaling of the adapter)
+LoRATerm = Tuple[torch.nn.Module, str, float]
+
+
+def get_lora_layer(module: torch.nn.Module) -> Optional[torch.nn.Module]:
+    """Returns the Linear or Conv2d holding the LoRA infos of `module`, or None."""
+    if is_peft_available() and isinstance(
+        module, (peft.tuners.lora.layer.Linear, peft.tuners.lora.layer.Conv2d)
+    ):
+        module = module.base_layer
+    if isinstance(module, PatchedLoraProjection):
+        module = module.regular_linear_layer
+    if not isinstance(module, (torch.nn.Linear, torch.nn.Conv2d)):
+        return None
+    if not hasattr(module, "adapter_names"):
+        return None
+    return module
+
+
+def collect_lora_layers(pipeline) -> List[torch.nn.Module]:
+    """Returns the layers of the pipeline that have LoRA weights loaded."""
+    layers, seen = [], set()
+    for name in ("unet", "text_encoder", "text_encoder_2"):
+        component = getattr(pipeline, name, None)
+        if component is None:
+            continue
+        for module in component.modules():
+            layer = get_lora_layer(module)
+            if layer is not None and id(layer) not in seen:
+                seen.add(id(layer))
+                layers.append(layer)
+    return layers
+
+
+class _AdapterTimer:
+    """Accumulates the time spent per adapter, read back once at the end."""
+
+    def __init__(self):
+        self._seconds = defaultdict(float)
+        self._events = defaultdict(list)
+
+    @contextmanager
+    def time(self, name: str, device: torch.device):
+        if device.type == "cuda":
+            start = torch.cuda.Event(enable_timing=True)
+            end = torch.cuda.Event(enable_timing=True)
+            start.record()
+            yield
+            end.record()
+            self._events[name].append((start, end))
+        else:
+            start_time = time.perf_counter()
+            yield
+            self._seconds[name] += time.perf_counter() - start_time
+
+    def result(self) -> Dict[str, float]:
+        seconds = dict(self._seconds)
+        for name, events in self._events.items():
+            for start, end in events:
+                end.synchronize()
+                seconds[name] = seconds.get(name, 0.0) + start.elapsed_time(end) / 1000
+        return seconds
+
+
+def fuse_lora_terms(terms: Iterable[LoRATerm]) -> Dict[str, float]:
+    """Adds `scaling * lora_B @ lora_A` of each term to the weight of its layer.
+
+    Terms with a negative scaling unfuse. Terms of the same layer and adapter
+    are summed first, and skipped if they cancel out.
+
+    Returns the seconds spent per adapter, and on writing the weights back
+    under "write_back".
+    """
+    scalings = {}
+    for layer, adapter, scaling in terms:
+        key = (id(layer), adapter)
+        if key in scalings:
+            scalings[key][2] += scaling
+        else:
+            scalings[key] = [layer, adapter, scaling]
+
+    layer_terms = {}
+    for layer, adapter, scaling in scalings.values():
+        if scaling == 0:
+            continue
+        layer_terms.setdefault(id(layer), (layer, []))[1].append((adapter, scaling))
+
+    groups = defaultdict(list)
+    for layer, adapters in layer_terms.values():
+        weight = layer.weight.data
+        groups[(tuple(weight.shape), weight.dtype, weight.device)].append(
+            (layer, adapters)
+        )
+
+    timer = _AdapterTimer()
+    for (shape, dtype, device), entries in groups.items():
+        delta_bytes = math.prod(shape) * 4
+        batch_size = max(_FUSION_BATCH_BYTES // delta_bytes, 1)
+        for i in range(0, len(entries), batch_size):
+            _fuse_batch(entries[i : i + batch_size], shape, dtype, device, timer)
+    return timer.result()
+
+
+def _fuse_batch(entries, shape, dtype, device, timer: _AdapterTimer) -> None:
+    flat_shape = (len(entries), shape[0], math.prod(shape[1:]))
+    deltas = torch.zeros(flat_shape, dtype=torch.float32, device=device)
+
+    # Linear and Conv2d weights both fuse as [out, r] @ [r, in * kh * kw]
+    batches = defaultdict(list)
+    for index, (layer, adapters) in enumerate(entries):
+        for adapter, scaling in adapters:
+            w_down, w_up = layer.lora_A[adapter], layer.lora_B[adapter]
+            key = (adapter, w_down.shape[0], w_down.device)
+            batches[key].append((index, w_down, w_up, scaling))
+
+    for (adapter, _, _), items in batches.items():
+        with timer.time(adapter, device):
+            indices = torch.tensor([item[0] for item in items], device=device)
+            w_down = torch.stack([item[1].flatten(start_dim=1) for item in items])
+            w_up = torch.stack([item[2].flatten(start_dim=1) for item in items])
+            scaling = torch.tensor([item[3] for item in items], dtype=torch.float32)
+            w_down = w_down.to(device=device, dtype=torch.float32, non_blocking=True)
+            w_up = w_up.to(device=device, dtype=torch.float32, non_blocking=True)
+            w_up *= scaling.to(device)[:, None, None]
+            deltas.index_add_(0, indices, torch.bmm(w_up, w_down))
+
+    with timer.time("write_back", device):
+        weights = [layer.weight.data for layer, _ in entries]
+        deltas += torch.stack(weights).reshape(flat_shape)
+        fused = deltas.to(dtype).reshape(len(entries), *shape).unbind(0)
+        if hasattr(torch, "_foreach_copy_"):
+            torch._foreach_copy_(weights, list(fused))
+        else:
+            for weight, src in zip(weights, fused):
+                weight.copy_(src)
+    for layer, _ in entries:
+        update_graph_related_tensor(layer)
+
+
+def _scalings(layer: torch.nn.Module) -> Dict[str, float]:
+    return {name: layer.scaling[name] for name in layer.active_adapter_names}
+
+
+def _update_adapters(changes) -> Dict[str, float]:
+    """Moves layers from their old to their new adapter scalings.
+
+    Layers losing an adapter are restored from their snapshot if there is
+    one, else the adapter is unfused by subtraction.
+    """
+    store = get_lora_snapshot_store()
+    terms, restored = [], []
+    for layer, old, new in changes:
+        removed = {name: s for name, s in old.items() if new.get(name) != s}
+        added = {name: s for name, s in new.items() if old.get(name) != s}
+        if not removed and not added:
+            continue
+        if store is not None and not old:
+            store.save(layer)
+        if removed and store is not None and layer in store:
+            restored.append(layer)
+            terms.extend((layer, name, s) for name, s in new.items())
+        else:
+            terms.extend((layer, name, -s) for name, s in removed.items())
+            terms.extend((layer, name, s) for name, s in added.items())
+
+    timer = _AdapterTimer()
+    by_device = defaultdict(list)
+    for layer in restored:
+        by_device[layer.weight.device].append(layer)
+    for device, device_layers in by_device.items():
+        with timer.time("restore", device):
+            store.restore(device_layers)
+    timings = timer.result()
+    for name, seconds in fuse_lora_terms(terms).items():
+        timings[name] = timings.get(name, 0.0) + seconds
+    for layer in restored:
+        update_graph_related_tensor(layer)
+        if not layer.active_adapter_names:
+            store.drop(layer)
+    return timings
+
+
+def set_adapters_batched(
+    layers: List[torch.nn.Module],
+    adapter_names: List[str],
+    adapter_weights: List[float],
+) -> Dict[str, float]:
+    """Replaces the fused adapters of `layers`, as `_set_adapter` does per layer."""
+    changes = []
+    for layer in layers:
+        old = _scalings(layer)
+        layer.active_adapter_names.clear()
+        for adapter, weight in zip(adapter_names, adapter_weights):
+            if adapter not in layer.adapter_names:
+                continue
+            layer.active_adapter_names[adapter] = weight
+            layer.scaling[adapter] = (
+                weight * layer.lora_alpha[adapter] / layer.r[adapter]
+            )
+        changes.append((layer, old, _scalings(layer)))
+    return _update_adapters(changes)
+
+
+def unfuse_adapters_batched(layers: List[torch.nn.Module]) -> Dict[str, float]:
+    """Unfuses all the active adapters of `layers`, as `_unfuse_lora` does."""
+    changes = []
+    for layer in layers:
+        changes.append((layer, _scalings(layer), {}))
+        layer.active_adapter_names.clear()
+    return _update_adapters(changes)
+
+
+def fuse_loaded_adapter(
+    layers: List[torch.nn.Module], adapter_name: str
+) -> Dict[str, float]:
+    """Fuses `adapter_name`, loaded into `layers` with `fuse_lora(fuse=False)`."""
+    changes = []
+    for layer in layers:
+        new = _scalings(layer)
+        old = {name: s for name, s in new.items() if name != adapter_name}
+        changes.append((layer, old, new))
+    return _update_adapters(changes)
+
+
+def log_fusion_timings(action: str, timings: Dict[str, float]) -> None:
+    summary = ", ".join(f"{name}: {seconds:.4f}s" for name, seconds in timings.items())
+    logger.debug(f"[OneDiffX LoRA] {action} took {summary or 'nothing'}")
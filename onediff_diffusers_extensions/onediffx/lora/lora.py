@@ -1,4 +1,6 @@
-from collections import defaultdict, OrderedDict
+import os
+import threading
+from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
 
@@ -7,7 +9,6 @@ import diffusers
 import torch
 from diffusers.loaders import LoraLoaderMixin
 
-from onediff.utils import logger
 from packaging import version
 
 if version.parse(diffusers.__version__) >= version.parse("0.21.0"):
@@ -16,13 +17,20 @@ else:
     from diffusers.loaders import PatchedLoraProjection
 
 
+from .batched_fusion import (
+    collect_lora_layers,
+    log_fusion_timings,
+    set_adapters_batched,
+    unfuse_adapters_batched,
+)
+from .lora_cache import LoRACache
+from .preconverted import is_preconverted_lora, load_preconverted_lora
 from .text_encoder import load_lora_into_text_encoder
 from .unet import load_lora_into_unet
+from .unfused import is_unfused_lora_enabled, set_unfused_adapters
 from .utils import (
     _delete_adapter,
     _maybe_map_sgm_blocks_to_diffusers,
-    _set_adapter,
-    _unfuse_lora,
     is_peft_available,
 )
 
@@ -44,6 +52,7 @@ def load_and_fuse_lora(
     lora_scale: float = 1.0,
     offload_device="cuda",
     use_cache=False,
+    fuse: bool = True,
     **kwargs,
 ) -> None:
     if not is_onediffx_lora_available:
@@ -51,10 +60,36 @@ def load_and_fuse_lora(
             "onediffx.lora only supports diffusers of at least version 0.19.3"
         )
 
+    if is_unfused_lora_enabled(pipeline):
+        raise RuntimeError(
+            "[OneDiffX load_and_fuse_lora] Unfused LoRA mode is enabled, call disable_unfused_lora first"
+        )
+
+    preconverted_path = None
+    if isinstance(pretrained_model_name_or_path_or_dict, (str, Path)):
+        path = Path(pretrained_model_name_or_path_or_dict)
+        if kwargs.get("weight_name", None) is not None:
+            path = path / kwargs["weight_name"]
+        if is_preconverted_lora(path):
+            preconverted_path = path
+            if adapter_name is None:
+                adapter_name = path.stem
+
     _init_adapters_info(pipeline)
     pipeline._adapter_names.add(adapter_name)
     pipeline._active_adapter_names[adapter_name] = 1.0
 
+    if preconverted_path is not None:
+        load_preconverted_lora(
+            pipeline,
+            preconverted_path,
+            adapter_name,
+            lora_scale=lora_scale,
+            offload_device=offload_device,
+            fuse=fuse,
+        )
+        return
+
     self = pipeline
 
     if use_cache:
@@ -64,19 +99,11 @@ def load_and_fuse_lora(
             **kwargs,
         )
     else:
-        # for diffusers <= 0.20
-        if hasattr(LoraLoaderMixin, "_map_sgm_blocks_to_diffusers"):
-            orig_func = getattr(LoraLoaderMixin, "_map_sgm_blocks_to_diffusers")
-            LoraLoaderMixin._map_sgm_blocks_to_diffusers = (
-                _maybe_map_sgm_blocks_to_diffusers
-            )
-        state_dict, network_alphas = LoraLoaderMixin.lora_state_dict(
+        state_dict, network_alphas = _lora_state_dict(
             pretrained_model_name_or_path_or_dict,
             unet_config=self.unet.config,
             **kwargs,
         )
-        if hasattr(LoraLoaderMixin, "_map_sgm_blocks_to_diffusers"):
-            LoraLoaderMixin._map_sgm_blocks_to_diffusers = orig_func
 
     is_correct_format = all("lora" in key for key in state_dict.keys())
     if not is_correct_format:
@@ -92,6 +119,7 @@ def load_and_fuse_lora(
         lora_scale=lora_scale,
         offload_device=offload_device,
         use_cache=use_cache,
+        fuse=fuse,
     )
 
     # load lora weights into text encoder
@@ -108,6 +136,7 @@ def load_and_fuse_lora(
             lora_scale=lora_scale,
             adapter_name=adapter_name,
             _pipeline=self,
+            fuse=fuse,
         )
 
     text_encoder_2_state_dict = {
@@ -123,34 +152,42 @@ def load_and_fuse_lora(
             lora_scale=lora_scale,
             adapter_name=adapter_name,
             _pipeline=self,
+            fuse=fuse,
         )
 
 
-def unfuse_lora(pipeline: LoraLoaderMixin):
-    def _unfuse_lora_apply(m: torch.nn.Module):
-        if isinstance(m, (torch.nn.Linear, PatchedLoraProjection, torch.nn.Conv2d)):
-            _unfuse_lora(m)
-        elif is_peft_available() and isinstance(
-            m,
-            (peft.tuners.lora.layer.Linear, peft.tuners.lora.layer.Conv2d),
-        ):
-            _unfuse_lora(m.base_layer)
+def unfuse_lora(pipeline: LoraLoaderMixin) -> Dict[str, float]:
+    """Unfuses all the active adapters of the pipeline.
+
+    In unfused mode, deactivates them instead.
+
+    Returns the seconds spent per adapter, see `set_and_fuse_adapters`.
+    """
+    if is_unfused_lora_enabled(pipeline):
+        set_unfused_adapters(pipeline, [])
+        return {}
 
     pipeline._adapter_names.clear()
     pipeline._active_adapter_names.clear()
 
-    pipeline.unet.apply(_unfuse_lora_apply)
-    if hasattr(pipeline, "text_encoder"):
-        pipeline.text_encoder.apply(_unfuse_lora_apply)
-    if hasattr(pipeline, "text_encoder_2"):
-        pipeline.text_encoder_2.apply(_unfuse_lora_apply)
+    timings = unfuse_adapters_batched(collect_lora_layers(pipeline))
+    log_fusion_timings("unfuse_lora", timings)
+    return timings
 
 
 def set_and_fuse_adapters(
     pipeline: LoraLoaderMixin,
     adapter_names: Union[List[str], str],
     adapter_weights: Optional[List[float]] = None,
-):
+) -> Dict[str, float]:
+    """Fuses `adapter_names` with `adapter_weights` in place of the active ones.
+
+    The layers of all the pipeline components are fused together in batches.
+    Adapters that stay active with the same weight are left untouched.
+
+    Returns the seconds spent per adapter, and on writing the weights back
+    under "write_back".
+    """
     if isinstance(adapter_names, str):
         adapter_names = [adapter_names]
 
@@ -163,29 +200,29 @@ def set_and_fuse_adapters(
             adapter_weights,
         ] * len(adapter_names)
 
+    if is_unfused_lora_enabled(pipeline):
+        raise RuntimeError(
+            "[OneDiffX set_and_fuse_adapters] Unfused LoRA mode is enabled, call disable_unfused_lora first"
+        )
+
     _init_adapters_info(pipeline)
     pipeline._adapter_names |= set(adapter_names)
     pipeline._active_adapter_names = {
         k: v for k, v in zip(adapter_names, adapter_weights)
     }
 
-    def set_adapters_apply(m):
-        if isinstance(m, (torch.nn.Linear, torch.nn.Conv2d, PatchedLoraProjection)):
-            _set_adapter(m, adapter_names, adapter_weights)
-        elif is_peft_available() and isinstance(
-            m,
-            (peft.tuners.lora.layer.Linear, peft.tuners.lora.layer.Conv2d),
-        ):
-            _set_adapter(m.base_layer, adapter_names, adapter_weights)
-
-    pipeline.unet.apply(set_adapters_apply)
-    if hasattr(pipeline, "text_encoder"):
-        pipeline.text_encoder.apply(set_adapters_apply)
-    if hasattr(pipeline, "text_encoder_2"):
-        pipeline.text_encoder_2.apply(set_adapters_apply)
+    timings = set_adapters_batched(
+        collect_lora_layers(pipeline), adapter_names, adapter_weights
+    )
+    log_fusion_timings("set_and_fuse_adapters", timings)
+    return timings
 
 
 def delete_adapters(self, adapter_names: Union[List[str], str] = None):
+    if is_unfused_lora_enabled(self):
+        raise RuntimeError(
+            "[OneDiffX delete_adapters] Unfused LoRA mode is enabled, call disable_unfused_lora first"
+        )
     if adapter_names is None:
         adapter_names = list(self._adapter_names)
     elif isinstance(adapter_names, str):
@@ -224,21 +261,25 @@ def _init_adapters_info(self: torch.nn.Module):
         setattr(self, "_active_adapter_names", {})
 
 
-class LRUCacheDict(OrderedDict):
-    def __init__(self, capacity):
-        super().__init__()
-        self.capacity = capacity
+_lora_state_dict_lock = threading.Lock()
 
-    def __getitem__(self, key):
-        value = super().__getitem__(key)
-        self.move_to_end(key)
-        return value
 
-    def __setitem__(self, key, value):
-        if len(self) >= self.capacity:
-            oldest_key = next(iter(self))
-            del self[oldest_key]
-        super().__setitem__(key, value)
+def _lora_state_dict(
+    lora: Union[str, Path, Dict[str, torch.Tensor]], **kwargs
+) -> Tuple[Dict, Dict]:
+    # for diffusers <= 0.20
+    if not hasattr(LoraLoaderMixin, "_map_sgm_blocks_to_diffusers"):
+        return LoraLoaderMixin.lora_state_dict(lora, **kwargs)
+    # The patch is shared with the thread prefetching LoRAs
+    with _lora_state_dict_lock:
+        orig_func = getattr(LoraLoaderMixin, "_map_sgm_blocks_to_diffusers")
+        LoraLoaderMixin._map_sgm_blocks_to_diffusers = (
+            _maybe_map_sgm_blocks_to_diffusers
+        )
+        try:
+            return LoraLoaderMixin.lora_state_dict(lora, **kwargs)
+        finally:
+            LoraLoaderMixin._map_sgm_blocks_to_diffusers = orig_func
 
 
 def load_state_dict_cached(
@@ -249,24 +290,27 @@ def load_state_dict_cached(
     if isinstance(lora, dict):
         state_dict, network_alphas = LoraLoaderMixin.lora_state_dict(lora, **kwargs)
         return state_dict, network_alphas
+    return lora_cache.get(lora, **kwargs)
 
-    global CachedLoRAs
-    weight_name = kwargs.get("weight_name", None)
 
-    lora_name = str(lora) + (f"/{weight_name}" if weight_name else "")
-    if lora_name in CachedLoRAs:
-        logger.debug(
-            f"[OneDiffX Cached LoRA] get cached lora of name: {str(lora_name)}"
-        )
-        return CachedLoRAs[lora_name]
-
-    state_dict, network_alphas = LoraLoaderMixin.lora_state_dict(
-        lora,
-        **kwargs,
-    )
-    CachedLoRAs[lora_name] = (state_dict, network_alphas)
-    logger.debug(f"[OneDiffX Cached LoRA] create cached lora of name: {str(lora_name)}")
-    return state_dict, network_alphas
-
-
-CachedLoRAs = LRUCacheDict(100)
+def prefetch_loras(
+    pipeline: LoraLoaderMixin, loras: List[Union[str, Path]], **kwargs
+) -> None:
+    """Loads `loras` into the LoRA cache on a background thread.
+
+    Later calls of `load_and_fuse_lora` with `use_cache=True` and the same
+    `kwargs` get them from the cache, or wait for them if still loading.
+    """
+    lora_cache.prefetch(loras, unet_config=pipeline.unet.config, **kwargs)
+
+
+lora_cache = LoRACache(
+    _lora_state_dict,
+    max_bytes=int(os.getenv("ONEDIFFX_LORA_CACHE_BYTES", 4 << 30)),
+    disk_dir=os.getenv("ONEDIFFX_LORA_CACHE_DIR", None),
+    disk_max_bytes=(
+        int(os.environ["ONEDIFFX_LORA_CACHE_DISK_BYTES"])
+        if "ONEDIFFX_LORA_CACHE_DISK_BYTES" in os.environ
+        else None
+    ),
+)
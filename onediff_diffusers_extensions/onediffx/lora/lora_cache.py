@@ -0,0 +1,286 @@
+"""A cache of LoRA state dicts, already converted to the diffusers format.
+
+Local LoRA files are keyed by the sha256 of their content, memoized by path,
+size and mtime, so a file reached by different paths is loaded once. LoRAs
+given by hub id, or by a directory without `weight_name`, are keyed by name.
+
+The cache has two tiers:
+
+- host memory, pinned when CUDA is available, bounded by `max_bytes`, least
+  recently used first out. Each LoRA is held in one buffer, and counted with
+  the rounding of the pinned memory allocator;
+- optionally `disk_dir`, where converted state dicts are saved as
+  safetensors, bounded by `disk_max_bytes`. They load without reading the
+  original file nor converting keys.
+
+`prefetch` loads upcoming LoRAs on a background thread, and `get` waits for
+a LoRA being prefetched instead of loading it twice.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+import torch
+from onediff.utils import logger
+
+LoRA = Union[str, Path]
+StateDicts = Tuple[Dict[str, torch.Tensor], Optional[Dict[str, float]]]
+
+
+class LoRACache:
+    """Loads LoRAs with `loader`, and keeps them within a byte budget.
+
+    Args:
+        loader: Returns the state dict and network alphas of a LoRA, like
+            `LoraLoaderMixin.lora_state_dict`.
+        max_bytes (int): The size of the host memory tier.
+        disk_dir (str, optional): The directory of the disk tier.
+        disk_max_bytes (int, optional): The size of the disk tier.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[..., StateDicts],
+        max_bytes: int,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: Optional[int] = None,
+    ):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._digests = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _file_digest(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        stamp = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(stamp)
+        if digest is None:
+            hasher = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 24), b""):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+            self._digests[stamp] = digest
+        return digest
+
+    def get_key(self, lora: LoRA, **kwargs) -> str:
+        weight_name = kwargs.get("weight_name", None)
+        path = Path(lora) / weight_name if weight_name else Path(lora)
+        if path.is_file():
+            key = f"sha256:{self._file_digest(str(path))}"
+        else:
+            key = f"name:{_get_name(lora, weight_name)}"
+        # Converting SGM keys depends on the layout of the UNet
+        unet_config = kwargs.get("unet_config", None)
+        layers_per_block = getattr(unet_config, "layers_per_block", None)
+        if layers_per_block is not None:
+            key += f":{layers_per_block}"
+        return key
+
+    def get(self, lora: LoRA, **kwargs) -> StateDicts:
+        """Returns the state dict and network alphas of `lora`.
+
+        The dicts are copies, which callers are free to pop from.
+        """
+        with self._lock:
+            future = self._pending.get(_get_name(lora, kwargs.get("weight_name")))
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass  # Loaded again below, to raise in the caller
+        state_dict, network_alphas = self._get(lora, kwargs)
+        if network_alphas is not None:
+            network_alphas = dict(network_alphas)
+        return dict(state_dict), network_alphas
+
+    def _get(self, lora: LoRA, kwargs) -> StateDicts:
+        key = self.get_key(lora, **kwargs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                logger.debug(f"[OneDiffX LoRA cache] hit {lora} ({key})")
+                return entry[:2]
+
+        entry = self._load_from_disk(key)
+        if entry is not None:
+            self.stats["disk_hits"] += 1
+            logger.debug(f"[OneDiffX LoRA cache] disk hit {lora} ({key})")
+        else:
+            self.stats["misses"] += 1
+            logger.debug(f"[OneDiffX LoRA cache] miss {lora} ({key})")
+            state_dict, network_alphas = self.loader(lora, **kwargs)
+            # Saved before packing, safetensors refuses tensors sharing memory
+            self._save_to_disk(key, (state_dict, network_alphas))
+            state_dict, nbytes = _to_host(state_dict)
+            entry = (state_dict, network_alphas, nbytes)
+        self._insert(key, entry)
+        return entry[:2]
+
+    def _insert(self, key: str, entry) -> None:
+        nbytes = entry[2]
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            while self._entries and self._bytes + nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.stats["evictions"] += 1
+            self._entries[key] = entry
+            self._bytes += nbytes
+
+    def _disk_path(self, key: str) -> str:
+        file_name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.disk_dir, f"{file_name}.safetensors")
+
+    def _load_from_disk(self, key: str):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        if not os.path.isfile(path):
+            return None
+        from safetensors import safe_open
+
+        try:
+            state_dict = {}
+            with safe_open(path, framework="pt") as f:
+                metadata = f.metadata() or {}
+                for name in f.keys():
+                    state_dict[name] = f.get_tensor(name)
+            network_alphas = json.loads(metadata.get("network_alphas", "null"))
+            os.utime(path)
+        except Exception as e:
+            logger.warning(f"[OneDiffX LoRA cache] Ignoring {path}: {e}")
+            return None
+        state_dict, nbytes = _to_host(state_dict)
+        return state_dict, network_alphas, nbytes
+
+    def _save_to_disk(self, key: str, entry: StateDicts) -> None:
+        if self.disk_dir is None:
+            return
+        from safetensors.torch import save_file
+
+        state_dict, network_alphas = entry
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            save_file(
+                {k: v.contiguous() for k, v in state_dict.items()},
+                tmp_path,
+                metadata={"network_alphas": json.dumps(network_alphas, default=float)},
+            )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"[OneDiffX LoRA cache] Failed to save {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        if self.disk_max_bytes is None:
+            return
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".safetensors"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def prefetch(self, loras: Iterable[LoRA], **kwargs) -> None:
+        """Loads `loras` into the cache on a background thread, in order."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="onediffx_lora_prefetch"
+                )
+            for lora in loras:
+                name = _get_name(lora, kwargs.get("weight_name"))
+                if name in self._pending:
+                    continue
+                future = self._executor.submit(self._prefetch, name, lora, kwargs)
+                self._pending[name] = future
+
+    def _prefetch(self, name: str, lora: LoRA, kwargs) -> None:
+        try:
+            self._get(lora, kwargs)
+        except Exception as e:
+            logger.warning(f"[OneDiffX LoRA cache] Failed to prefetch {lora}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def _get_name(lora: LoRA, weight_name: Optional[str]) -> str:
+    return str(lora) + (f"/{weight_name}" if weight_name else "")
+
+
+# Offsets of tensors in a host buffer are aligned for any dtype
+_ALIGNMENT = 64
+
+
+def _to_host(state_dict: Dict[str, torch.Tensor]):
+    """Copies `state_dict` into one host buffer, and returns it with the bytes
+    it holds.
+
+    Pinned memory makes the copies to the GPU asynchronous and faster. The
+    pinned memory allocator rounds blocks up to a power of two, so tensors
+    share one block per LoRA, and the rounded size is counted.
+    """
+    pin_memory = torch.cuda.is_available()
+    offsets, nbytes = {}, 0
+    for name, tensor in state_dict.items():
+        nbytes = -(-nbytes // _ALIGNMENT) * _ALIGNMENT
+        offsets[name] = nbytes
+        nbytes += tensor.nelement() * tensor.element_size()
+    buffer = torch.empty(max(nbytes, 1), dtype=torch.uint8, pin_memory=pin_memory)
+
+    result = {}
+    for name, tensor in state_dict.items():
+        offset = offsets[name]
+        size = tensor.nelement() * tensor.element_size()
+        host_tensor = buffer[offset : offset + size].view(tensor.dtype)
+        host_tensor = host_tensor.view(tensor.shape)
+        host_tensor.copy_(tensor.detach())
+        result[name] = host_tensor
+    if pin_memory:
+        nbytes = 1 << (buffer.nelement() - 1).bit_length()
+    return result, max(nbytes, 1)
@@ -0,0 +1,180 @@
+"""LoRAs preconverted to the layers of a pipeline, to load without conversion.
+
+`convert_lora` loads a LoRA into a pipeline once, offline, and saves the
+weights of each layer it touches under the path of the layer, with its rank
+and `alpha / r` scaling:
+
+- tensors `{component}/{layer path}/down` and `{component}/{layer path}/up`;
+- metadata `onediffx_lora` with the format version, the diffusers version and
+  `{"layers": {"{component}/{layer path}": {"rank": r, "scale": alpha / r}}}`.
+
+`load_and_fuse_lora` recognizes these files, and loads them with
+`load_preconverted_lora`: tensors are read straight to the layers, with no
+key remapping nor splitting per component.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import diffusers
+import torch
+from onediff.utils import logger
+
+from .batched_fusion import fuse_loaded_adapter, log_fusion_timings
+from .utils import fuse_lora
+
+PRECONVERTED_LORA_VERSION = 1
+_METADATA_KEY = "onediffx_lora"
+_COMPONENT_NAMES = ("unet", "text_encoder", "text_encoder_2")
+
+
+def _get_torch_module(component: torch.nn.Module) -> torch.nn.Module:
+    return getattr(component, "_torch_module", component)
+
+
+def _iter_adapter_layers(pipeline, adapter_name: str):
+    for component_name in _COMPONENT_NAMES:
+        component = getattr(pipeline, component_name, None)
+        if component is None:
+            continue
+        component = _get_torch_module(component)
+        for path, layer in component.named_modules():
+            if adapter_name in getattr(layer, "adapter_names", ()):
+                yield f"{component_name}/{path}", layer
+
+
+def is_preconverted_lora(path: Union[str, Path]) -> bool:
+    """Returns whether `path` is a LoRA file saved by `convert_lora`."""
+    path = Path(path)
+    if path.suffix != ".safetensors" or not path.is_file():
+        return False
+    from safetensors import safe_open
+
+    with safe_open(str(path), framework="pt") as f:
+        return _METADATA_KEY in (f.metadata() or {})
+
+
+def convert_lora(
+    pipeline,
+    pretrained_model_name_or_path_or_dict: Union[str, Path, Dict[str, torch.Tensor]],
+    output_path: Union[str, Path],
+    **kwargs,
+) -> Dict[str, int]:
+    """Saves a LoRA preconverted to the layers of `pipeline` at `output_path`.
+
+    The LoRA is loaded into the pipeline without being fused, and deleted from
+    it afterwards, so the weights of the pipeline are left untouched. The
+    pipeline should have the layout of the ones that load the file, and may
+    be on CPU. `kwargs` are the ones of `load_and_fuse_lora`.
+
+    Returns the number of layers of each component.
+    """
+    from safetensors.torch import save_file
+
+    from .lora import delete_adapters, load_and_fuse_lora
+
+    adapter_name = "__onediffx_preconvert__"
+    load_and_fuse_lora(
+        pipeline,
+        pretrained_model_name_or_path_or_dict,
+        adapter_name=adapter_name,
+        offload_device="cpu",
+        fuse=False,
+        **kwargs,
+    )
+    try:
+        tensors, layers, counts = {}, {}, {}
+        for key, layer in _iter_adapter_layers(pipeline, adapter_name):
+            tensors[f"{key}/down"] = layer.lora_A[adapter_name].contiguous()
+            tensors[f"{key}/up"] = layer.lora_B[adapter_name].contiguous()
+            rank = int(layer.r[adapter_name])
+            layers[key] = {
+                "rank": rank,
+                "scale": float(layer.lora_alpha[adapter_name]) / rank,
+            }
+            component_name = key.split("/", 1)[0]
+            counts[component_name] = counts.get(component_name, 0) + 1
+    finally:
+        # The adapter was never fused, so deleting it must not unfuse it
+        for _, layer in _iter_adapter_layers(pipeline, adapter_name):
+            layer.active_adapter_names.pop(adapter_name, None)
+        delete_adapters(pipeline, adapter_name)
+
+    metadata = {
+        "version": PRECONVERTED_LORA_VERSION,
+        "diffusers_version": diffusers.__version__,
+        "layers": layers,
+    }
+    save_file(
+        {k: v.cpu() for k, v in tensors.items()},
+        str(output_path),
+        metadata={_METADATA_KEY: json.dumps(metadata)},
+    )
+    logger.info(f"[OneDiffX convert_lora] Saved {counts} layers to {output_path}")
+    return counts
+
+
+def load_preconverted_lora(
+    pipeline,
+    path: Union[str, Path],
+    adapter_name: Optional[str] = None,
+    *,
+    lora_scale: float = 1.0,
+    offload_device="cuda",
+    fuse: bool = True,
+) -> Dict[str, float]:
+    """Loads and fuses a LoRA saved by `convert_lora`.
+
+    With `fuse=False`, the weights are only loaded into the layers.
+
+    Returns the seconds spent per adapter, see `set_and_fuse_adapters`.
+    """
+    from safetensors import safe_open
+
+    if adapter_name is None:
+        adapter_name = Path(path).stem
+
+    with safe_open(str(path), framework="pt") as f:
+        metadata = json.loads(f.metadata()[_METADATA_KEY])
+        if metadata["version"] != PRECONVERTED_LORA_VERSION:
+            raise ValueError(
+                f"[OneDiffX load_preconverted_lora] Unsupported version {metadata['version']} of {path}"
+            )
+        if metadata["diffusers_version"] != diffusers.__version__:
+            logger.warning(
+                f"[OneDiffX load_preconverted_lora] {path} was converted with diffusers "
+                f"{metadata['diffusers_version']}, layer paths may have changed"
+            )
+
+        components = {}
+        lora_layers = []
+        for key, info in metadata["layers"].items():
+            component_name, layer_path = key.split("/", 1)
+            if component_name not in components:
+                components[component_name] = _get_torch_module(
+                    getattr(pipeline, component_name)
+                )
+            layer = components[component_name].get_submodule(layer_path)
+            rank = info["rank"]
+            state_dict = {
+                "lora.down.weight": f.get_tensor(f"{key}/down"),
+                "lora.up.weight": f.get_tensor(f"{key}/up"),
+            }
+            lora_layers.append(
+                fuse_lora(
+                    layer,
+                    state_dict,
+                    lora_scale,
+                    info["scale"] * rank,
+                    rank,
+                    adapter_name=adapter_name,
+                    offload_device=offload_device,
+                    fuse=False,
+                )
+            )
+
+    if not fuse:
+        return {}
+    timings = fuse_loaded_adapter(lora_layers, adapter_name)
+    log_fusion_timings(f"Fusing preconverted LoRA {adapter_name}", timings)
+    return timings
@@ -0,0 +1,134 @@
+"""Snapshots of the base weights of LoRA layers, for exact unfusing.
+
+Unfusing by subtracting the deltas costs the GEMMs of fusing again, and
+leaves rounding errors in the weights that add up over switches. With
+`enable_lora_snapshots`, the weight of a layer is copied to pinned host
+memory before its first adapter is fused. Unfusing copies it back
+asynchronously, and switching adapters restores it and fuses only the new
+ones. Unfusing is exact, and the fused weights don't drift however many
+switches there are.
+
+Snapshots are limited to `max_bytes` of host memory. Layers past the limit
+unfuse by subtraction. A snapshot is dropped once its layer has no active
+adapter, and its memory is kept for the next one of the same size.
+
+Snapshots go stale if the base weights are changed while adapters are
+fused, so disable them before swapping base weights with fused adapters.
+"""
+import weakref
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import torch
+from onediff.utils import logger
+
+__all__ = [
+    "WeightSnapshotStore",
+    "enable_lora_snapshots",
+    "disable_lora_snapshots",
+    "get_lora_snapshot_store",
+]
+
+
+class WeightSnapshotStore:
+    """Holds the base weights of layers in host memory, within `max_bytes`."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.allocated_bytes = 0
+        # id(layer) -> (weak reference to layer, host buffer)
+        self._snapshots = {}
+        # Host buffers of dropped snapshots, by (numel, dtype, pinned)
+        self._free_buffers = defaultdict(list)
+
+    def __contains__(self, layer: torch.nn.Module) -> bool:
+        return id(layer) in self._snapshots
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    def _allocate(self, numel: int, dtype: torch.dtype, pinned: bool):
+        free_buffers = self._free_buffers.get((numel, dtype, pinned))
+        if free_buffers:
+            return free_buffers.pop()
+        nbytes = numel * torch.empty((), dtype=dtype).element_size()
+        # Make room from free buffers of other sizes
+        while self.allocated_bytes + nbytes > self.max_bytes:
+            key = next((k for k, v in self._free_buffers.items() if v), None)
+            if key is None:
+                return None
+            buffer = self._free_buffers[key].pop()
+            self.allocated_bytes -= buffer.nelement() * buffer.element_size()
+        self.allocated_bytes += nbytes
+        return torch.empty(numel, dtype=dtype, pin_memory=pinned)
+
+    def save(self, layer: torch.nn.Module) -> bool:
+        """Snapshots the weight of `layer`, which must have no adapter fused.
+
+        Returns False if the snapshot doesn't fit in `max_bytes`.
+        """
+        if id(layer) in self._snapshots:
+            return True
+        weight = layer.weight.data
+        buffer = self._allocate(weight.nelement(), weight.dtype, weight.is_cuda)
+        if buffer is None:
+            logger.debug(
+                f"[OneDiffX LoRA snapshots] No room for a snapshot of {tuple(weight.shape)}"
+            )
+            return False
+        buffer.copy_(weight.flatten(), non_blocking=True)
+        key = id(layer)
+        layer_ref = weakref.ref(layer, lambda _: self._release(key))
+        self._snapshots[key] = (layer_ref, buffer)
+        return True
+
+    def restore(self, layers: Iterable[torch.nn.Module]) -> None:
+        """Copies the snapshots of `layers` back into their weights.
+
+        The copies are asynchronous on the current stream, which orders them
+        before any fusion that follows.
+        """
+        for layer in layers:
+            weight = layer.weight.data
+            buffer = self._snapshots[id(layer)][1]
+            weight.copy_(buffer.view(weight.shape), non_blocking=True)
+
+    def _release(self, key: int) -> None:
+        entry = self._snapshots.pop(key, None)
+        if entry is not None:
+            buffer = entry[1]
+            free_key = (buffer.nelement(), buffer.dtype, buffer.is_pinned())
+            self._free_buffers[free_key].append(buffer)
+
+    def drop(self, layer: torch.nn.Module) -> None:
+        self._release(id(layer))
+
+    def clear(self) -> None:
+        self._snapshots.clear()
+        self._free_buffers.clear()
+        self.allocated_bytes = 0
+
+
+_SNAPSHOT_STORE: Optional[WeightSnapshotStore] = None
+
+
+def enable_lora_snapshots(max_bytes: int = 8 << 30) -> None:
+    """Snapshots base weights before fusing LoRAs, within `max_bytes`.
+
+    Only layers fused after this call are snapshotted.
+    """
+    global _SNAPSHOT_STORE
+    if _SNAPSHOT_STORE is not None:
+        _SNAPSHOT_STORE.clear()
+    _SNAPSHOT_STORE = WeightSnapshotStore(max_bytes)
+
+
+def disable_lora_snapshots() -> None:
+    global _SNAPSHOT_STORE
+    if _SNAPSHOT_STORE is not None:
+        _SNAPSHOT_STORE.clear()
+    _SNAPSHOT_STORE = None
+
+
+def get_lora_snapshot_store() -> Optional[WeightSnapshotStore]:
+    return _SNAPSHOT_STORE
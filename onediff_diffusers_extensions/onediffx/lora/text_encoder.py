@@ -39,6 +39,7 @@ def load_lora_into_text_encoder(
     low_cpu_mem_usage=None,
     adapter_name=None,
     _pipeline=None,
+    fuse=True,
 ):
     """
     This will load and fuse the LoRA layers specified in `state_dict` into `text_encoder`
@@ -66,6 +67,8 @@ def load_lora_into_text_encoder(
         adapter_name (`str`, *optional*):
             Adapter name to be used for referencing the loaded adapter model. If not specified, it will use
             `default_{i}` where i is the total number of adapters being loaded.
+        fuse (`bool`, *optional*, defaults to `True`):
+            Whether to fuse the LoRA layers into the weights, or only load them.
     """
     low_cpu_mem_usage = (
         low_cpu_mem_usage
@@ -242,6 +245,7 @@ def load_lora_into_text_encoder(
                         current_rank,
                         adapter_name=adapter_name,
                         prefix="lora_linear_layer",
+                        fuse=fuse,
                     )
                     fuse_lora(
                         attn_module.k_proj,
@@ -251,6 +255,7 @@ def load_lora_into_text_encoder(
                         current_rank,
                         adapter_name=adapter_name,
                         prefix="lora_linear_layer",
+                        fuse=fuse,
                     )
                     fuse_lora(
                         attn_module.v_proj,
@@ -260,6 +265,7 @@ def load_lora_into_text_encoder(
                         current_rank,
                         adapter_name=adapter_name,
                         prefix="lora_linear_layer",
+                        fuse=fuse,
                     )
                     fuse_lora(
                         attn_module.out_proj,
@@ -269,6 +275,7 @@ def load_lora_into_text_encoder(
                         current_rank,
                         adapter_name=adapter_name,
                         prefix="lora_linear_layer",
+                        fuse=fuse,
                     )
 
                 if patch_mlp:
@@ -295,6 +302,7 @@ def load_lora_into_text_encoder(
                             current_rank_fc1,
                             adapter_name=adapter_name,
                             prefix="lora_linear_layer",
+                            fuse=fuse,
                         )
                         fuse_lora(
                             mlp_module.fc2,
@@ -304,6 +312,7 @@ def load_lora_into_text_encoder(
                             current_rank_fc2,
                             adapter_name=adapter_name,
                             prefix="lora_linear_layer",
+                            fuse=fuse,
                         )
 
                 if is_network_alphas_populated and len(network_alphas) > 0:
@@ -8,6 +8,7 @@ from onediff.infer_compiler import DeployableModule
 from onediff.utils import logger
 from packaging import version
 
+from .batched_fusion import fuse_loaded_adapter, log_fusion_timings
 from .utils import fuse_lora, get_adapter_names, is_peft_available
 
 if is_peft_available():
@@ -30,6 +31,7 @@ def load_lora_into_unet(
     lora_scale: float = 1.0,
     offload_device="cpu",
     use_cache=False,
+    fuse: bool = True,
 ):
     if adapter_name is None:
         adapter_name = get_adapter_names(unet)
@@ -90,6 +92,7 @@ def load_lora_into_unet(
         lora_scale=lora_scale,
         offload_device=offload_device,
         use_cache=use_cache,
+        fuse=fuse,
     )
 
 
@@ -144,6 +147,7 @@ def _load_attn_procs(
     lora_scale = kwargs.pop("lora_scale", 1.0)
     offload_device = kwargs.pop("offload_device", "cpu")
     use_cache = kwargs.pop("use_cache", False)
+    fuse = kwargs.pop("fuse", True)
     _pipeline = kwargs.pop("_pipeline", None)
     network_alphas = kwargs.pop("network_alphas", None)
     adapter_name = kwargs.pop("adapter_name", None)
@@ -203,6 +207,8 @@ def _load_attn_procs(
                 f"[OneDiffX _load_attn_procs] The `state_dict` has to be empty at this point but has the following keys \n\n {', '.join(state_dict.keys())}"
             )
 
+        # The layers are fused together once all the weights are loaded
+        lora_layers = []
         for key, value_dict in lora_grouped_dict.items():
             if isinstance(self, DeployableModule):
                 attn_processor = self._torch_module
@@ -224,32 +230,42 @@ def _load_attn_procs(
                     torch.nn.Linear,
                 ),
             ):
-                fuse_lora(
-                    attn_processor,
-                    value_dict,
-                    lora_scale,
-                    mapped_network_alphas.get(key),
-                    rank,
-                    offload_device=offload_device,
-                    adapter_name=adapter_name,
+                lora_layers.append(
+                    fuse_lora(
+                        attn_processor,
+                        value_dict,
+                        lora_scale,
+                        mapped_network_alphas.get(key),
+                        rank,
+                        offload_device=offload_device,
+                        adapter_name=adapter_name,
+                        fuse=False,
+                    )
                 )
             elif is_peft_available() and isinstance(
                 attn_processor,
                 (peft.tuners.lora.layer.Linear, peft.tuners.lora.layer.Conv2d),
             ):
-                fuse_lora(
-                    attn_processor.base_layer,
-                    value_dict,
-                    lora_scale,
-                    mapped_network_alphas.get(key),
-                    rank,
-                    offload_device=offload_device,
-                    adapter_name=adapter_name,
+                lora_layers.append(
+                    fuse_lora(
+                        attn_processor.base_layer,
+                        value_dict,
+                        lora_scale,
+                        mapped_network_alphas.get(key),
+                        rank,
+                        offload_device=offload_device,
+                        adapter_name=adapter_name,
+                        fuse=False,
+                    )
                 )
             else:
                 raise ValueError(
                     f"[OneDiffX _load_attn_procs] Module {key} is not a Conv2d or Linear module, got type {type(attn_processor)}"
                 )
+
+        if fuse:
+            timings = fuse_loaded_adapter(lora_layers, adapter_name)
+            log_fusion_timings(f"Fusing LoRA {adapter_name} into UNet", timings)
     else:
         raise ValueError(
             f"[OneDiffX _load_attn_procs] {pretrained_model_name_or_path_or_dict} does not seem to be in the correct format expected by LoRA training."
@@ -0,0 +1,193 @@
+"""Runs LoRA adapters as low-rank side branches instead of fusing them.
+
+Once `enable_unfused_lora` is called, every layer with LoRA weights is
+wrapped by a `LoRASideBranch`, which adds the output of its adapters to the
+one of the layer. The adapter weights are a buffer of the compiled graph,
+updated in place by `set_unfused_adapters`: switching between the loaded
+adapters rewrites no weight and recompiles no graph.
+
+Wrapping or unwrapping layers changes the module structure, so it clears the
+compiled graph of the component. Load new adapters after
+`disable_unfused_lora`, then enable the mode again.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Union
+
+import torch
+import torch.nn.functional as F
+
+from .batched_fusion import (
+    collect_lora_layers,
+    log_fusion_timings,
+    set_adapters_batched,
+    unfuse_adapters_batched,
+)
+
+_COMPONENT_NAMES = ("unet", "text_encoder", "text_encoder_2")
+
+
+class LoRASideBranch(torch.nn.Module):
+    """A Linear or Conv2d with its LoRA adapters run as side branches.
+
+    The down and up weights of all the adapters are concatenated, so they run
+    as two GEMMs or convolutions whatever their number. The output of each
+    rank is scaled by `lora_scales`, which holds `weight * alpha / r` of its
+    adapter, or 0 for inactive adapters.
+    """
+
+    def __init__(self, base_layer: Union[torch.nn.Linear, torch.nn.Conv2d]):
+        super().__init__()
+        self.base_layer = base_layer
+        self.is_conv = isinstance(base_layer, torch.nn.Conv2d)
+        self.adapter_ranks = {}
+
+        weight = base_layer.weight
+        downs, ups = [], []
+        for name in sorted(base_layer.adapter_names):
+            downs.append(base_layer.lora_A[name])
+            ups.append(base_layer.lora_B[name])
+            self.adapter_ranks[name] = base_layer.lora_A[name].shape[0]
+        to_weight = dict(device=weight.device, dtype=weight.dtype)
+        self.register_buffer("lora_down", torch.cat(downs, dim=0).to(**to_weight))
+        self.register_buffer("lora_up", torch.cat(ups, dim=1).to(**to_weight))
+        self.register_buffer(
+            "lora_scales", torch.zeros(self.lora_down.shape[0], **to_weight)
+        )
+
+    def get_scales(self, adapter_weights: Dict[str, float]) -> torch.Tensor:
+        """Returns the float `lora_scales` of `adapter_weights`, on host."""
+        scales = []
+        for name, rank in self.adapter_ranks.items():
+            weight = adapter_weights.get(name, 0.0)
+            scale = weight * self.base_layer.lora_alpha[name] / self.base_layer.r[name]
+            scales.append(torch.full((rank,), scale, dtype=torch.float32))
+        return torch.cat(scales)
+
+    def forward(self, x):
+        out = self.base_layer(x)
+        if self.is_conv:
+            base = self.base_layer
+            hidden = F.conv2d(
+                x, self.lora_down, None, base.stride, base.padding, base.dilation
+            )
+            # Scale channels last, with `lora_scales` used as is. An op on the
+            # buffer alone would be constant folded by the compiler, and the
+            # graph would miss the updates of `set_unfused_adapters`
+            hidden = hidden.permute(0, 2, 3, 1) * self.lora_scales
+            return out + F.conv2d(hidden.permute(0, 3, 1, 2), self.lora_up)
+        hidden = F.linear(x, self.lora_down) * self.lora_scales
+        return out + F.linear(hidden, self.lora_up)
+
+
+def is_unfused_lora_enabled(pipeline) -> bool:
+    return getattr(pipeline, "_lora_unfused", False)
+
+
+def _clear_compiled_graph(component: torch.nn.Module) -> None:
+    if hasattr(component, "_clear_old_graph"):
+        component._clear_old_graph()
+
+
+def enable_unfused_lora(pipeline) -> None:
+    """Unfuses the adapters of the pipeline, and runs them as side branches.
+
+    The active adapters stay active with the same weights. The adapter scales
+    are shared by the whole pipeline call, so requests with different LoRA
+    mixes can't be batched together; the mix only switches between calls,
+    with `set_unfused_adapters`, without rebuilding the compiled graph.
+    """
+    if is_unfused_lora_enabled(pipeline):
+        disable_unfused_lora(pipeline, fuse=False)
+    active_adapters = dict(getattr(pipeline, "_active_adapter_names", {}))
+    log_fusion_timings(
+        "enable_unfused_lora",
+        unfuse_adapters_batched(collect_lora_layers(pipeline)),
+    )
+
+    side_branches = []
+    for component_name in _COMPONENT_NAMES:
+        component = getattr(pipeline, component_name, None)
+        if component is None:
+            continue
+        wrapped = False
+        for parent in list(component.modules()):
+            for name, child in list(parent._modules.items()):
+                if not isinstance(child, (torch.nn.Linear, torch.nn.Conv2d)):
+                    continue
+                if not getattr(child, "adapter_names", None):
+                    continue
+                side_branch = LoRASideBranch(child)
+                parent._modules[name] = side_branch
+                side_branches.append((parent, name, side_branch))
+                wrapped = True
+        if wrapped:
+            _clear_compiled_graph(component)
+    pipeline._lora_side_branches = side_branches
+    pipeline._lora_unfused = True
+
+    set_unfused_adapters(
+        pipeline, list(active_adapters.keys()), list(active_adapters.values())
+    )
+
+
+def disable_unfused_lora(pipeline, *, fuse: bool = True) -> None:
+    """Restores the layers wrapped by `enable_unfused_lora`.
+
+    With `fuse`, the active adapters are fused into the weights again.
+    """
+    for parent, name, side_branch in getattr(pipeline, "_lora_side_branches", []):
+        parent._modules[name] = side_branch.base_layer
+    pipeline._lora_side_branches = []
+    pipeline._lora_unfused = False
+    for component_name in _COMPONENT_NAMES:
+        component = getattr(pipeline, component_name, None)
+        if component is not None:
+            _clear_compiled_graph(component)
+
+    active_adapters = getattr(pipeline, "_active_adapter_names", {})
+    if fuse and active_adapters:
+        timings = set_adapters_batched(
+            collect_lora_layers(pipeline),
+            list(active_adapters.keys()),
+            list(active_adapters.values()),
+        )
+        log_fusion_timings("disable_unfused_lora", timings)
+
+
+def set_unfused_adapters(
+    pipeline,
+    adapter_names: Union[List[str], str],
+    adapter_weights: Optional[Union[List[float], float]] = None,
+) -> None:
+    """Sets the active adapters and their weights, in unfused mode.
+
+    The scales of all the layers are computed on host, and copied to each
+    device and dtype at once.
+    """
+    if not is_unfused_lora_enabled(pipeline):
+        raise RuntimeError(
+            "[OneDiffX set_unfused_adapters] Call enable_unfused_lora first"
+        )
+    if isinstance(adapter_names, str):
+        adapter_names = [adapter_names]
+    if adapter_weights is None:
+        adapter_weights = 1.0
+    if isinstance(adapter_weights, (int, float)):
+        adapter_weights = [float(adapter_weights)] * len(adapter_names)
+    weights = dict(zip(adapter_names, adapter_weights))
+    pipeline._active_adapter_names = weights
+
+    groups = defaultdict(list)
+    for _, _, side_branch in pipeline._lora_side_branches:
+        scales = side_branch.lora_scales
+        groups[(scales.device, scales.dtype)].append(side_branch)
+    for (device, dtype), side_branches in groups.items():
+        scales = torch.cat([m.get_scales(weights) for m in side_branches])
+        scales = scales.to(device=device, dtype=dtype, non_blocking=True)
+        targets = [m.lora_scales for m in side_branches]
+        sources = list(scales.split([t.shape[0] for t in targets]))
+        if hasattr(torch, "_foreach_copy_"):
+            torch._foreach_copy_(targets, sources)
+        else:
+            for target, source in zip(targets, sources):
+                target.copy_(source)
@@ -25,6 +25,8 @@ else:
     from diffusers.models.lora import PatchedLoraProjection
 from onediff.infer_compiler.backends.oneflow.dual_module import DualModule
 
+from .snapshot import get_lora_snapshot_store
+
 if version.parse(diffusers.__version__) <= version.parse("0.20.0"):
     from diffusers.loaders import PatchedLoraProjection
 else:
@@ -125,6 +127,9 @@ def _set_adapter(self, adapter_names, adapter_weights):
             adapter_weights,
         ] * len(adapter_names)
     _unfuse_lora(self)
+    store = get_lora_snapshot_store()
+    if store is not None and any(name in self.adapter_names for name in adapter_names):
+        store.save(self)
 
     dtype, device = self.weight.data.dtype, self.weight.data.device
 
@@ -172,7 +177,7 @@ def fuse_lora(
     fuse=True,
     prefix="lora",
     offload_device="cpu",
-) -> None:
+) -> torch.nn.Module:
     r"""
     This will fuse the LoRA weights in `state_dict` into Linear or Conv2d module.
 
@@ -191,6 +196,10 @@ def fuse_lora(
             Prefix for up and down weight keys in the LoRA weight dictionary. Default is "lora".
         offload_device (str, optional):
             Offload Device for backuping weight, can be "cpu" or "cuda". Default is "cpu".
+
+    Returns:
+        The Linear or Conv2d layer holding the LoRA weights, to fuse them later
+        with `fuse=False`.
     """
     if not isinstance(self, (torch.nn.Linear, PatchedLoraProjection, torch.nn.Conv2d)):
         if is_peft_available() and isinstance(
@@ -228,13 +237,18 @@ def fuse_lora(
     self.lora_A[adapter_name] = offload_tensor(w_down, offload_device)
     self.lora_B[adapter_name] = offload_tensor(w_up, offload_device)
     self.adapter_names.add(adapter_name)
+    has_fused_adapters = len(self.active_adapter_names) > 0
     self.active_adapter_names[adapter_name] = lora_scale
 
     if fuse:
+        store = get_lora_snapshot_store()
+        if store is not None and not has_fused_adapters:
+            store.save(self)
         lora_weight = get_delta_weight(self, w_up, w_down, self.scaling[adapter_name])
         fused_weight = self.weight.data.float() + lora_weight
         self.weight.data.copy_(fused_weight.to(device=device, dtype=dtype))
         update_graph_related_tensor(self)
+    return self
 
 
 def _unfuse_lora(
@@ -256,6 +270,15 @@ def _unfuse_lora(
     if adapter_names is None:
         adapter_names = self.active_adapter_names.copy()
 
+    store = get_lora_snapshot_store()
+    if store is not None and self in store:
+        if all(name in adapter_names for name in self.active_adapter_names):
+            store.restore([self])
+            store.drop(self)
+            self.active_adapter_names.clear()
+            update_graph_related_tensor(self)
+            return
+
     for name in adapter_names:
         if name not in self.active_adapter_names:
             continue
@@ -0,0 +1,134 @@
+"""The `onediff-cache` command, which builds, verifies and imports bundles of
+compiled graph files.
+
+Examples:
+    onediff-cache build stabilityai/stable-diffusion-xl-base-1.0 \\
+        --shapes 1024x1024 768x1344 --batch-sizes 1 2 -o sdxl.tar
+    onediff-cache pack ComfyUI/input/graphs -o comfy.tar
+    onediff-cache verify sdxl.tar
+    onediff-cache import sdxl.tar --target dir --dest cached_pipe
+"""
+import argparse
+import json
+import sys
+
+from onediffx.utils.graph_bundle import (
+    build_bundle,
+    import_bundle,
+    pack_bundle,
+    read_manifest,
+    TARGETS,
+    verify_bundle,
+)
+
+
+def _parse_shape(value):
+    try:
+        height, width = value.lower().split("x")
+        return int(height), int(width)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Invalid shape {value}, expected HEIGHTxWIDTH"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="onediff-cache",
+        description="Build, verify and import bundles of onediff compiled graphs.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser(
+        "build", help="Build the graphs of a diffusers pipeline into a bundle."
+    )
+    build.add_argument("model", type=str, help="Model id or path of the pipeline.")
+    build.add_argument("-o", "--output", type=str, required=True)
+    build.add_argument("--shapes", type=_parse_shape, nargs="+", default=[(1024, 1024)])
+    build.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    build.add_argument("--steps", type=int, default=1)
+    build.add_argument("--device", type=str, default="cuda")
+    build.add_argument(
+        "--dtype", type=str, default="float16", choices=["float16", "bfloat16"]
+    )
+    build.add_argument("--ignores", type=str, nargs="*", default=[])
+
+    pack = subparsers.add_parser(
+        "pack", help="Bundle graph files already saved in a directory."
+    )
+    pack.add_argument("graph_dir", type=str)
+    pack.add_argument("-o", "--output", type=str, required=True)
+
+    verify = subparsers.add_parser(
+        "verify", help="Check a bundle against its manifest and this environment."
+    )
+    verify.add_argument("bundle", type=str)
+    verify.add_argument(
+        "--skip-environment",
+        action="store_true",
+        help="Only check the files, not the versions and device.",
+    )
+
+    import_ = subparsers.add_parser("import", help="Extract a bundle for a target.")
+    import_.add_argument("bundle", type=str)
+    import_.add_argument("--target", type=str, choices=TARGETS, default="dir")
+    import_.add_argument(
+        "--dest",
+        type=str,
+        required=True,
+        help="The pipeline cache dir, the ComfyUI root or the WebUI onediff_compiler_caches_path.",
+    )
+    import_.add_argument("--overwrite", action="store_true")
+    import_.add_argument(
+        "--skip-environment",
+        action="store_true",
+        help="Import without checking the versions and device of the bundle.",
+    )
+
+    show = subparsers.add_parser("show", help="Print the manifest of a bundle.")
+    show.add_argument("bundle", type=str)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "build":
+        import torch
+
+        build_bundle(
+            args.model,
+            args.output,
+            args.shapes,
+            args.batch_sizes,
+            steps=args.steps,
+            device=args.device,
+            torch_dtype=getattr(torch, args.dtype),
+            ignores=args.ignores,
+        )
+    elif args.command == "pack":
+        pack_bundle(args.graph_dir, args.output)
+    elif args.command == "verify":
+        problems = verify_bundle(
+            args.bundle, check_environment=not args.skip_environment
+        )
+        for problem in problems:
+            print(problem)
+        if len(problems) > 0:
+            return 1
+        print(f"{args.bundle} is valid")
+    elif args.command == "import":
+        for path in import_bundle(
+            args.bundle,
+            args.target,
+            args.dest,
+            check_environment=not args.skip_environment,
+            overwrite=args.overwrite,
+        ):
+            print(path)
+    elif args.command == "show":
+        print(json.dumps(read_manifest(args.bundle), indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
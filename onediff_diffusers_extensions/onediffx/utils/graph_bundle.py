@@ -0,0 +1,293 @@
+"""Package compiled graph files into a single bundle with a manifest.
+
+A bundle is a tar file with the graph files and a `manifest.json` recording
+the versions, device, shapes and model fingerprints they were built with, and
+the sha256 of every file so a bundle can be verified before it is imported.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from typing import Dict, List
+
+from onediff.utils import logger
+
+MANIFEST_NAME = "manifest.json"
+BUNDLE_FORMAT_VERSION = 1
+
+# Where the graph files of a bundle go for each import target
+TARGET_DIR = "dir"
+TARGET_COMFYUI = "comfyui"
+TARGET_WEBUI = "webui"
+TARGETS = (TARGET_DIR, TARGET_COMFYUI, TARGET_WEBUI)
+
+
+def _file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _iter_files(root: str):
+    for dirpath, _, files in os.walk(root):
+        for f in sorted(files):
+            path = os.path.join(dirpath, f)
+            yield os.path.relpath(path, root).replace(os.sep, "/"), path
+
+
+def get_environment() -> Dict[str, str]:
+    import oneflow as flow  # usort: skip
+    import onediff
+    import torch
+    from onediff.infer_compiler.backends.oneflow.graph_cache_store import (
+        get_device_signature,
+    )
+
+    from onediffx import __version__ as onediffx_version
+
+    return {
+        "onediff_version": onediff.__version__,
+        "onediffx_version": onediffx_version,
+        "oneflow_version": flow.__version__,
+        "torch_version": torch.__version__,
+        "device": get_device_signature(),
+    }
+
+
+def make_manifest(graph_dir: str, source: str, **extra) -> Dict:
+    files = {
+        name: {"sha256": _file_sha256(path), "bytes": os.path.getsize(path)}
+        for name, path in _iter_files(graph_dir)
+    }
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "source": source,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": files,
+    }
+    manifest.update(get_environment())
+    manifest.update(extra)
+    return manifest
+
+
+def write_bundle(graph_dir: str, bundle_path: str, manifest: Dict) -> str:
+    """Writes the files of `graph_dir` and `manifest` into the tar `bundle_path`."""
+    os.makedirs(os.path.dirname(os.path.abspath(bundle_path)), exist_ok=True)
+    with tarfile.open(bundle_path, "w") as tar:
+        data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+        for name, path in _iter_files(graph_dir):
+            tar.add(path, arcname=f"graphs/{name}")
+    logger.info(f"Wrote {len(manifest['files'])} graph files to {bundle_path}")
+    return bundle_path
+
+
+def read_manifest(bundle_path: str) -> Dict:
+    with tarfile.open(bundle_path, "r") as tar:
+        return json.load(tar.extractfile(MANIFEST_NAME))
+
+
+def build_bundle(
+    model_path: str,
+    bundle_path: str,
+    shapes=((1024, 1024),),
+    batch_sizes=(1,),
+    *,
+    steps=1,
+    device="cuda",
+    torch_dtype=None,
+    ignores=(),
+    **pipe_kwargs,
+) -> Dict:
+    """Builds the graphs of every part of a diffusers pipeline into a bundle.
+
+    The pipeline is compiled with `compile_pipe` and warmed up on the shape
+    matrix with `warmup_pipe`, then the saved graphs are bundled.
+
+    Returns the manifest of the bundle.
+    """
+    import torch
+    from diffusers import DiffusionPipeline
+    from onediff.infer_compiler.backends.oneflow.utils.hash_utils import (
+        generate_model_fingerprint,
+    )
+
+    from onediffx import compile_pipe, warmup_pipe
+    from onediffx.compilers.diffusion_pipeline_compiler import (
+        _filter_parts,
+        _recursive_getattr,
+    )
+
+    torch_dtype = torch_dtype or torch.float16
+    pipe = DiffusionPipeline.from_pretrained(model_path, torch_dtype=torch_dtype)
+    pipe.to(device)
+    pipe = compile_pipe(pipe, ignores=ignores)
+
+    with tempfile.TemporaryDirectory() as graph_dir:
+        results = warmup_pipe(
+            pipe,
+            shapes,
+            batch_sizes,
+            steps,
+            save_dir=graph_dir,
+            ignores=ignores,
+            **pipe_kwargs,
+        )
+        fingerprints = {}
+        for part in _filter_parts(ignores=ignores):
+            obj = _recursive_getattr(pipe, part, None)
+            if obj is not None and os.path.exists(os.path.join(graph_dir, part)):
+                torch_module = obj._deployable_module_model._torch_module
+                fingerprints[part] = generate_model_fingerprint(torch_module)
+        manifest = make_manifest(
+            graph_dir,
+            "diffusers",
+            model=model_path,
+            pipeline=type(pipe).__name__,
+            torch_dtype=str(torch_dtype),
+            shapes=[list(shape) for shape in shapes],
+            batch_sizes=list(batch_sizes),
+            model_fingerprints=fingerprints,
+            warmup_seconds=sum(result["seconds"] for result in results),
+        )
+        write_bundle(graph_dir, bundle_path, manifest)
+    return manifest
+
+
+def pack_bundle(graph_dir: str, bundle_path: str, **extra) -> Dict:
+    """Bundles graph files already saved in `graph_dir`, e.g. by ComfyUI nodes
+    or the WebUI extension.
+
+    Returns the manifest of the bundle.
+    """
+    manifest = make_manifest(graph_dir, "files", **extra)
+    write_bundle(graph_dir, bundle_path, manifest)
+    return manifest
+
+
+def verify_bundle(bundle_path: str, check_environment=True) -> List[str]:
+    """Checks the files of a bundle against its manifest.
+
+    With `check_environment`, the versions and device of the manifest are
+    also checked against the current environment.
+
+    Returns the list of problems found, empty if the bundle is valid.
+    """
+    problems = []
+    with tarfile.open(bundle_path, "r") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+            problems.append(
+                f"Unsupported bundle format version {manifest.get('format_version')}"
+            )
+            return problems
+        members = {
+            member.name[len("graphs/") :]: member
+            for member in tar.getmembers()
+            if member.isfile() and member.name.startswith("graphs/")
+        }
+        for name, entry in manifest["files"].items():
+            member = members.get(name)
+            if member is None:
+                problems.append(f"Missing file {name}")
+                continue
+            hasher = hashlib.sha256()
+            f = tar.extractfile(member)
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+            if hasher.hexdigest() != entry["sha256"]:
+                problems.append(f"Checksum mismatch of file {name}")
+        for name in members.keys() - manifest["files"].keys():
+            problems.append(f"Unexpected file {name}")
+
+    if check_environment:
+        environment = get_environment()
+        for key in ("onediff_version", "oneflow_version", "device"):
+            if manifest.get(key) != environment[key]:
+                problems.append(
+                    f"Bundle {key} {manifest.get(key)} does not match {environment[key]}"
+                )
+    return problems
+
+
+def _target_dir(target: str, dest: str) -> str:
+    if target == TARGET_COMFYUI:
+        # The nodes of onediff_comfy_nodes save and load graph files in the
+        # graphs directory of COMFYUI_ONEDIFF_SAVE_GRAPH_DIR, or of the ComfyUI
+        # input directory
+        input_dir = os.getenv("COMFYUI_ONEDIFF_SAVE_GRAPH_DIR")
+        if input_dir is None:
+            if os.path.isdir(os.path.join(dest, "custom_nodes")):
+                input_dir = os.path.join(dest, "input")
+            else:
+                input_dir = dest
+        return os.path.join(input_dir, "graphs")
+    return dest
+
+
+def import_bundle(
+    bundle_path: str,
+    target: str,
+    dest: str,
+    *,
+    verify=True,
+    check_environment=True,
+    overwrite=False,
+) -> List[str]:
+    """Extracts the graph files of a bundle for `target`.
+
+    - "dir" keeps the layout of the bundle in `dest`, e.g. for `load_pipe`.
+    - "comfyui" puts the files in the `graphs` directory read by
+      onediff_comfy_nodes, under `COMFYUI_ONEDIFF_SAVE_GRAPH_DIR` if set,
+      otherwise under the ComfyUI input directory. `dest` is the ComfyUI root
+      or its input directory.
+    - "webui" puts the files flat in `dest`, the `onediff_compiler_caches_path`
+      of the WebUI extension.
+
+    With `verify`, the bundle is checked first, and with `check_environment`
+    also against the versions and device of this environment.
+
+    Returns the paths of the imported files.
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Unknown import target {target}, expected one of {TARGETS}")
+    if verify:
+        problems = verify_bundle(bundle_path, check_environment=check_environment)
+        if len(problems) > 0:
+            raise RuntimeError(f"Invalid bundle {bundle_path}: {'; '.join(problems)}")
+
+    manifest = read_manifest(bundle_path)
+    if target != TARGET_DIR and manifest.get("source") == "diffusers":
+        logger.warning(
+            f"Bundle {bundle_path} was built from a diffusers pipeline, its graphs may not match the models of {target}"
+        )
+
+    out_dir = _target_dir(target, dest)
+    imported = []
+    with tarfile.open(bundle_path, "r") as tar:
+        for name in manifest["files"]:
+            parts = name.split("/")
+            if name.startswith("/") or ".." in parts:
+                raise RuntimeError(f"Invalid file name {name} in {bundle_path}")
+            if target == TARGET_WEBUI:
+                out_path = os.path.join(out_dir, name.replace("/", "_"))
+            else:
+                out_path = os.path.join(out_dir, *parts)
+            if os.path.exists(out_path) and not overwrite:
+                logger.info(f"Skip existing file {out_path}")
+                continue
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with tar.extractfile(f"graphs/{name}") as src, open(out_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            imported.append(out_path)
+    logger.info(f"Imported {len(imported)} graph files to {out_dir}")
+    return imported
@@ -19,6 +19,9 @@ setup(
     license="Apache-2.0",
     author_email="contact@siliconflow.com",
     packages=find_packages(),
+    entry_points={
+        "console_scripts": ["onediff-cache=onediffx.onediff_cache:main"],
+    },
     python_requires=">=3.7.0",
     install_requires=[
         "transformers>=4.27.1",
@@ -0,0 +1,70 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from onediffx.utils.graph_bundle import import_bundle, pack_bundle, verify_bundle
+
+GRAPH_FILES = {
+    "unet/graph": b"unet graph",
+    "vae/decoder/graph": b"vae decoder graph",
+}
+
+
+@pytest.fixture
+def bundle_path(tmp_path):
+    graph_dir = tmp_path / "graphs"
+    for name, data in GRAPH_FILES.items():
+        path = graph_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    bundle_path = tmp_path / "bundle.tar"
+    pack_bundle(str(graph_dir), str(bundle_path))
+    return bundle_path
+
+
+def _tamper(bundle_path, tampered_path, name):
+    with tarfile.open(bundle_path, "r") as src, tarfile.open(tampered_path, "w") as dst:
+        for member in src.getmembers():
+            data = src.extractfile(member).read()
+            if member.name == f"graphs/{name}":
+                data = b"tampered " + data
+                member.size = len(data)
+            dst.addfile(member, io.BytesIO(data))
+
+
+def test_bundle_round_trip(tmp_path, bundle_path):
+    assert verify_bundle(str(bundle_path)) == []
+
+    out_dir = tmp_path / "out"
+    imported = import_bundle(str(bundle_path), "dir", str(out_dir))
+    assert sorted(imported) == sorted(
+        os.path.join(out_dir, *name.split("/")) for name in GRAPH_FILES
+    )
+    for name, data in GRAPH_FILES.items():
+        assert (out_dir / name).read_bytes() == data
+
+
+def test_tampered_bundle_is_not_imported(tmp_path, bundle_path):
+    tampered_path = tmp_path / "tampered.tar"
+    _tamper(bundle_path, tampered_path, "unet/graph")
+    assert verify_bundle(str(tampered_path)) == ["Checksum mismatch of file unet/graph"]
+
+    out_dir = tmp_path / "out"
+    with pytest.raises(RuntimeError, match="Checksum mismatch of file unet/graph"):
+        import_bundle(str(tampered_path), "dir", str(out_dir))
+    assert not out_dir.exists()
+
+
+def test_import_to_comfyui_graphs_dir(tmp_path, bundle_path, monkeypatch):
+    monkeypatch.delenv("COMFYUI_ONEDIFF_SAVE_GRAPH_DIR", raising=False)
+    comfy_root = tmp_path / "ComfyUI"
+    (comfy_root / "custom_nodes").mkdir(parents=True)
+    import_bundle(str(bundle_path), "comfyui", str(comfy_root))
+    assert (comfy_root / "input" / "graphs" / "unet" / "graph").exists()
+
+    save_dir = tmp_path / "save_dir"
+    monkeypatch.setenv("COMFYUI_ONEDIFF_SAVE_GRAPH_DIR", str(save_dir))
+    import_bundle(str(bundle_path), "comfyui", str(comfy_root))
+    assert (save_dir / "graphs" / "unet" / "graph").exists()
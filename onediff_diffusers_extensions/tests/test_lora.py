@@ -3,6 +3,8 @@ from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List, Tuple
 
+import diffusers
+
 import numpy as np
 import pytest
 import safetensors.torch
@@ -243,3 +245,277 @@ def test_delete_adapters(pipe, get_multi_loras):
             f"current adapters: {active_adapters}, target adapters: {list(set(names) - set(names_to_delete))}"
         )
         assert set(active_adapters) == set(names) - set(names_to_delete)
+
+
+def _make_lora_layers():
+    torch.manual_seed(0)
+    layers = [torch.nn.Linear(64, 32) for _ in range(3)]
+    layers += [torch.nn.Conv2d(8, 16, 3) for _ in range(2)]
+    return [layer.to("cuda", torch.float16) for layer in layers]
+
+
+def _load_lora_adapters(layers):
+    from onediffx.lora.utils import fuse_lora
+
+    generator = torch.Generator().manual_seed(0)
+    for adapter, rank in (("a", 4), ("b", 8)):
+        for layer in layers:
+            if isinstance(layer, torch.nn.Linear):
+                down_shape = (rank, layer.in_features)
+                up_shape = (layer.out_features, rank)
+            else:
+                down_shape = (rank, layer.in_channels, *layer.kernel_size)
+                up_shape = (layer.out_channels, rank, 1, 1)
+            state_dict = {
+                "lora.down.weight": torch.randn(down_shape, generator=generator),
+                "lora.up.weight": torch.randn(up_shape, generator=generator),
+            }
+            fuse_lora(layer, state_dict, 1.0, rank, rank, adapter_name=adapter)
+
+
+def test_batched_fusion_matches_per_layer():
+    from onediffx.lora.batched_fusion import set_adapters_batched
+    from onediffx.lora.utils import _set_adapter
+
+    expected, batched = _make_lora_layers(), _make_lora_layers()
+    _load_lora_adapters(expected)
+    _load_lora_adapters(batched)
+    for names, weights in ((["a", "b"], [0.5, 0.8]), (["b"], [0.3])):
+        for layer in expected:
+            _set_adapter(layer, names, weights)
+        timings = set_adapters_batched(batched, names, weights)
+        assert set(names) <= set(timings)
+        for expected_layer, batched_layer in zip(expected, batched):
+            assert batched_layer.active_adapter_names == dict(zip(names, weights))
+            assert torch.allclose(
+                expected_layer.weight, batched_layer.weight, atol=1e-2, rtol=1e-2
+            )
+
+
+def test_unfused_side_branch_matches_fused():
+    from onediffx.lora.batched_fusion import set_adapters_batched
+    from onediffx.lora.unfused import LoRASideBranch
+
+    fused, unfused = _make_lora_layers(), _make_lora_layers()
+    _load_lora_adapters(fused)
+    _load_lora_adapters(unfused)
+    set_adapters_batched(unfused, [], [])
+    side_branches = [LoRASideBranch(layer) for layer in unfused]
+    for names, weights in ((["a", "b"], [0.5, 0.8]), (["b"], [0.3])):
+        set_adapters_batched(fused, names, weights)
+        for fused_layer, side_branch in zip(fused, side_branches):
+            scales = side_branch.get_scales(dict(zip(names, weights)))
+            side_branch.lora_scales.copy_(scales)
+            if isinstance(fused_layer, torch.nn.Linear):
+                x = torch.randn(2, 64, device="cuda", dtype=torch.float16)
+            else:
+                x = torch.randn(2, 8, 16, 16, device="cuda", dtype=torch.float16)
+            assert torch.allclose(fused_layer(x), side_branch(x), atol=5e-2, rtol=1e-2)
+
+
+def test_unfused_lora_in_compiled_unet():
+    import copy
+    from types import SimpleNamespace
+
+    from diffusers import UNet2DConditionModel
+    from onediffx.lora import enable_unfused_lora, set_unfused_adapters
+    from onediffx.lora.batched_fusion import set_adapters_batched
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=16,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=32,
+    ).to("cuda", torch.float16)
+    attention = unet.down_blocks[0].attentions[0].transformer_blocks[0].attn1
+    layers = [unet.conv_in, unet.down_blocks[0].resnets[0].conv1, attention.to_q]
+    _load_lora_adapters(layers)
+    reference = copy.deepcopy(unet)
+    reference_layers = [
+        reference.conv_in,
+        reference.down_blocks[0].resnets[0].conv1,
+        reference.down_blocks[0].attentions[0].transformer_blocks[0].attn1.to_q,
+    ]
+
+    pipe = SimpleNamespace(unet=oneflow_compile(unet))
+    enable_unfused_lora(pipe)
+    sample = torch.randn(2, 4, 16, 16, device="cuda", dtype=torch.float16)
+    encoder_hidden_states = torch.randn(2, 4, 32, device="cuda", dtype=torch.float16)
+    graph = None
+    for names, weights in ((["a"], [1.0]), (["a", "b"], [0.5, 0.8]), (["b"], [0.3])):
+        set_unfused_adapters(pipe, names, weights)
+        set_adapters_batched(reference_layers, names, weights)
+        with torch.no_grad():
+            output = pipe.unet(sample, 10, encoder_hidden_states).sample
+            expected = reference(sample, 10, encoder_hidden_states).sample
+        if graph is None:
+            graph = pipe.unet._deployable_module_dpl_graph
+        # Switching adapters runs the same graph, with the new scales
+        assert pipe.unet._deployable_module_dpl_graph is graph
+        assert torch.allclose(output, expected, atol=5e-2, rtol=1e-2)
+
+
+def test_snapshots_unfuse_exactly():
+    from onediffx.lora import disable_lora_snapshots, enable_lora_snapshots
+    from onediffx.lora.batched_fusion import (
+        set_adapters_batched,
+        unfuse_adapters_batched,
+    )
+
+    layers = _make_lora_layers()
+    base_weights = [layer.weight.detach().clone() for layer in layers]
+    enable_lora_snapshots()
+    try:
+        _load_lora_adapters(layers)
+        for i in range(1000):
+            names = ["a", "b"] if i % 2 == 0 else ["b"]
+            set_adapters_batched(layers, names, [0.1 + i % 7 * 0.1] * len(names))
+        unfuse_adapters_batched(layers)
+    finally:
+        disable_lora_snapshots()
+    for layer, base_weight in zip(layers, base_weights):
+        assert torch.equal(layer.weight, base_weight)
+
+
+def test_lora_cache_is_content_addressed(tmp_path):
+    from onediffx.lora.lora_cache import LoRACache
+
+    state_dict = {"unet.lora.down.weight": torch.randn(4, 8)}
+    safetensors.torch.save_file(state_dict, str(tmp_path / "a.safetensors"))
+    safetensors.torch.save_file(state_dict, str(tmp_path / "b.safetensors"))
+
+    loaded = []
+
+    def loader(lora, **kwargs):
+        loaded.append(lora)
+        return safetensors.torch.load_file(lora), {"unet.lora.alpha": 4.0}
+
+    cache = LoRACache(loader, max_bytes=1 << 20, disk_dir=str(tmp_path / "disk"))
+    cache.prefetch([str(tmp_path / "a.safetensors")])
+    first, alphas = cache.get(str(tmp_path / "a.safetensors"))
+    first.pop("unet.lora.down.weight")
+    alphas.clear()
+    second, alphas = cache.get(str(tmp_path / "b.safetensors"))
+    assert len(loaded) == 1
+    assert torch.equal(
+        second["unet.lora.down.weight"], state_dict["unet.lora.down.weight"]
+    )
+    assert alphas == {"unet.lora.alpha": 4.0}
+
+    cache.clear()
+    cache.get(str(tmp_path / "b.safetensors"))
+    assert len(loaded) == 1 and cache.stats["disk_hits"] == 1
+
+
+def test_lora_cache_counts_host_buffer():
+    from onediffx.lora.lora_cache import LoRACache
+
+    state_dict = {
+        "unet.lora.down.weight": torch.randn(4, 9, dtype=torch.float16),
+        "unet.lora.up.weight": torch.randn(9, 4),
+    }
+    cache = LoRACache(lambda lora, **kwargs: (state_dict, None), max_bytes=1 << 20)
+    cached, _ = cache.get("lora")
+    for name, tensor in state_dict.items():
+        assert torch.equal(cached[name], tensor)
+        assert cached[name].is_pinned()
+    # Both tensors are in one pinned block, rounded up to a power of two
+    assert cache.nbytes == 512
+
+
+def test_load_preconverted_lora(tmp_path):
+    import json
+    from types import SimpleNamespace
+
+    from onediffx.lora import load_preconverted_lora
+
+    layers = _make_lora_layers()
+    pipe = SimpleNamespace(unet=torch.nn.Sequential(*layers))
+    base_weights = [layer.weight.detach().float().clone() for layer in layers]
+
+    tensors, metadata = {}, {}
+    for i, layer in enumerate(layers):
+        if isinstance(layer, torch.nn.Linear):
+            down, up = torch.randn(4, layer.in_features), torch.randn(
+                layer.out_features, 4
+            )
+        else:
+            down = torch.randn(4, layer.in_channels, *layer.kernel_size)
+            up = torch.randn(layer.out_channels, 4, 1, 1)
+        tensors[f"unet/{i}/down"], tensors[f"unet/{i}/up"] = down, up
+        metadata[f"unet/{i}"] = {"rank": 4, "scale": 0.25}
+    path = tmp_path / "lora.safetensors"
+    safetensors.torch.save_file(
+        tensors,
+        str(path),
+        metadata={
+            "onediffx_lora": json.dumps(
+                {
+                    "version": 1,
+                    "diffusers_version": diffusers.__version__,
+                    "layers": metadata,
+                }
+            )
+        },
+    )
+
+    load_preconverted_lora(pipe, path, "a", lora_scale=0.5)
+    for i, (layer, base_weight) in enumerate(zip(layers, base_weights)):
+        down = tensors[f"unet/{i}/down"].flatten(1)
+        up = tensors[f"unet/{i}/up"].flatten(1)
+        delta = (0.5 * 0.25 * up @ down).reshape(layer.weight.shape).cuda()
+        assert layer.active_adapter_names == {"a": 0.5}
+        assert torch.allclose(
+            layer.weight.float(), base_weight + delta, atol=1e-2, rtol=1e-2
+        )
+
+
+def _pipeline_weights(pipe):
+    weights = {}
+    for component_name in ("unet", "text_encoder", "text_encoder_2"):
+        component = getattr(pipe, component_name, None)
+        if component is None:
+            continue
+        for name, param in component.named_parameters():
+            weights[f"{component_name}.{name}"] = param.detach().cpu()
+    return weights
+
+
+def _restore_pipeline_weights(pipe, weights):
+    for component_name in ("unet", "text_encoder", "text_encoder_2"):
+        component = getattr(pipe, component_name, None)
+        if component is None:
+            continue
+        for name, param in component.named_parameters():
+            param.data.copy_(weights[f"{component_name}.{name}"])
+
+
+def test_convert_lora_round_trip(pipe, get_loras, tmp_path):
+    from onediffx.lora import convert_lora
+
+    name, lora = next(iter(get_loras().items()))
+    path = tmp_path / f"{Path(name).stem}.safetensors"
+    base_weights = _pipeline_weights(pipe)
+    convert_lora(pipe, lora.copy(), path)
+    for key, weight in _pipeline_weights(pipe).items():
+        assert torch.equal(weight, base_weights[key]), f"{key} changed"
+
+    load_and_fuse_lora(pipe, str(path), adapter_name="a", lora_scale=LORA_SCALE)
+    preconverted_weights = _pipeline_weights(pipe)
+    delete_adapters(pipe, "a")
+    _restore_pipeline_weights(pipe, base_weights)
+
+    load_and_fuse_lora(pipe, lora.copy(), adapter_name="a", lora_scale=LORA_SCALE)
+    fused_weights = _pipeline_weights(pipe)
+    delete_adapters(pipe, "a")
+    _restore_pipeline_weights(pipe, base_weights)
+
+    for key, weight in fused_weights.items():
+        assert torch.allclose(
+            preconverted_weights[key].float(), weight.float(), atol=1e-3, rtol=1e-3
+        ), f"{key} differs from the normal load"
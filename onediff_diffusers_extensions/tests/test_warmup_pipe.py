@@ -0,0 +1,93 @@
+from typing import List, Optional, Union
+
+from onediffx import warmup_pipe
+
+
+class FakeText2ImgPipe:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(
+        self,
+        prompt: Union[str, List[str]] = None,
+        height: Optional[int] = None,
+        width: Optional[int] = None,
+        num_inference_steps: int = 50,
+        num_images_per_prompt: int = 1,
+    ):
+        self.calls.append(
+            {
+                "batch_size": num_images_per_prompt
+                * (1 if isinstance(prompt, str) else len(prompt)),
+                "shape": (height, width),
+                "steps": num_inference_steps,
+            }
+        )
+
+
+class FakeImg2ImgPipe:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(
+        self,
+        prompt: Union[str, List[str]] = None,
+        image=None,
+        strength: float = 0.8,
+        num_inference_steps: int = 50,
+        num_images_per_prompt: int = 1,
+    ):
+        self.calls.append(
+            {
+                "batch_size": num_images_per_prompt
+                * (1 if isinstance(prompt, str) else len(prompt)),
+                "shape": (image.height, image.width),
+                "steps": int(num_inference_steps * strength),
+            }
+        )
+
+
+class FakePromptListPipe:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, prompt=None, height=None, width=None):
+        self.calls.append({"batch_size": len(prompt), "shape": (height, width)})
+
+
+def test_warmup_pipe_shapes_and_batch_sizes():
+    pipe = FakeText2ImgPipe()
+    report = warmup_pipe(
+        pipe, shapes=[(512, 512), (768, 1024)], batch_sizes=[1, 4], prompt="a cat"
+    )
+    assert pipe.calls == [
+        {"batch_size": 1, "shape": (512, 512), "steps": 1},
+        {"batch_size": 4, "shape": (512, 512), "steps": 1},
+        {"batch_size": 1, "shape": (768, 1024), "steps": 1},
+        {"batch_size": 4, "shape": (768, 1024), "steps": 1},
+    ]
+    assert [(r["height"], r["width"], r["batch_size"]) for r in report] == [
+        (512, 512, 1),
+        (512, 512, 4),
+        (768, 1024, 1),
+        (768, 1024, 4),
+    ]
+
+
+def test_warmup_pipe_runs_img2img_steps():
+    pipe = FakeImg2ImgPipe()
+    warmup_pipe(pipe, shapes=[(512, 768)], batch_sizes=[2])
+    assert pipe.calls == [{"batch_size": 2, "shape": (512, 768), "steps": 1}]
+
+    pipe = FakeImg2ImgPipe()
+    warmup_pipe(pipe, shapes=[(512, 512)], steps=3, strength=0.3)
+    assert pipe.calls == [{"batch_size": 1, "shape": (512, 512), "steps": 3}]
+
+
+def test_warmup_pipe_repeats_prompt_without_images_per_prompt():
+    pipe = FakePromptListPipe()
+    warmup_pipe(pipe, shapes=[(512, 512)], batch_sizes=[1, 3], prompt="a cat")
+    assert pipe.calls == [
+        {"batch_size": 1, "shape": (512, 512)},
+        {"batch_size": 3, "shape": (512, 512)},
+    ]
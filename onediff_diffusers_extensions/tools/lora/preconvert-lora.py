@@ -0,0 +1,30 @@
+import argparse
+from pathlib import Path
+
+import torch
+from diffusers import DiffusionPipeline
+
+from onediffx.lora import convert_lora
+
+parser = argparse.ArgumentParser(
+    description="Preconvert LoRAs to the layers of a pipeline, for fast loading with onediffx.lora.load_and_fuse_lora."
+)
+parser.add_argument(
+    "--model", type=str, default="stabilityai/stable-diffusion-xl-base-1.0"
+)
+parser.add_argument("--variant", type=str, default=None)
+parser.add_argument("--loras", type=str, nargs="+", required=True)
+parser.add_argument("--output_dir", type=str, required=True)
+args = parser.parse_args()
+
+# The pipeline only provides the layer paths, so it stays on CPU
+pipe = DiffusionPipeline.from_pretrained(
+    args.model, variant=args.variant, torch_dtype=torch.float32
+)
+
+output_dir = Path(args.output_dir)
+output_dir.mkdir(parents=True, exist_ok=True)
+for lora in args.loras:
+    output_path = output_dir / f"{Path(lora).stem}.safetensors"
+    counts = convert_lora(pipe, lora, output_path)
+    print(f"Converted {lora} to {output_path}: {counts}")
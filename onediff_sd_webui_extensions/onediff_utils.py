@@ -45,6 +45,10 @@ hints_message = dedent(
 
 all_compiler_caches = []
 
+# Graph files are saved with a header file next to them, see
+# onediff.infer_compiler.backends.oneflow.graph_header_utils
+GRAPH_HEADER_SUFFIX = ".header.json"
+
 
 def all_compiler_caches_path():
     import modules.shared as shared
@@ -73,7 +77,11 @@ def refresh_all_compiler_caches(path: Path = None):
     if path is None:
         return
 
-    all_compiler_caches = [f.stem for f in Path(path).iterdir() if f.is_file()]
+    all_compiler_caches = [
+        f.stem
+        for f in Path(path).iterdir()
+        if f.is_file() and not f.name.endswith(GRAPH_HEADER_SUFFIX)
+    ]
 
 
 def check_structure_change(current_type: dict[str, bool], model):
@@ -94,6 +102,16 @@ def load_graph(compiled_unet: DeployableModule, compiler_cache: str):
         raise FileNotFoundError(
             f"Cannot find cache {compiler_cache_path}, please make sure it exists"
         )
+    if is_oneflow_backend():
+        from onediff.infer_compiler.backends.oneflow.graph_header_utils import (
+            inspect_graph,
+        )
+
+        result = inspect_graph(compiler_cache_path, compiled_unet)
+        if not result["compatible"]:
+            raise RuntimeError(
+                f"Cache {compiler_cache} is not compatible with the current checkpoint or environment: {'; '.join(result['problems'])}. Please select another cache or recompile"
+            )
     try:
         compiled_unet.load_graph(compiler_cache_path, run_warmup=True)
     except BadZipFile:
@@ -1,5 +1,24 @@
-import os
+"""The compilers of onediff, loaded on first use.
 
-import torch
+`import onediff.infer_compiler` doesn't import torch or any backend, so config
+types such as `OneflowCompileOptions` are cheap to import.
+"""
+import importlib
 
-from .backends import *
+__all__ = ["compile", "oneflow_compile", "DeployableModule", "OneflowCompileOptions"]
+
+
+def __getattr__(name):
+    if name == "backends":
+        return importlib.import_module(".backends", __name__)
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from . import backends
+
+    value = getattr(backends, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
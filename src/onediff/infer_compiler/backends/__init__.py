@@ -1,3 +1,24 @@
-from .compiler import compile, oneflow_compile
-from .deployable_module import DeployableModule
-from .env_var import OneflowCompileOptions
+import importlib
+
+__all__ = ["compile", "oneflow_compile", "DeployableModule", "OneflowCompileOptions"]
+
+# Public names by the module defining them, imported on first access
+_LAZY_ATTRS = {
+    "compile": ".compiler",
+    "oneflow_compile": ".compiler",
+    "DeployableModule": ".deployable_module",
+    "OneflowCompileOptions": ".env_var",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
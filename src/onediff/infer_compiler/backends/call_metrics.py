@@ -0,0 +1,146 @@
+"""Always-on, low-overhead metrics of the calls of a deployable module.
+
+Each call records its wall time split into phases, with counters of the graph
+cache and the compile time of each input structure. Times are host wall time
+without device synchronization, so the execution phase of an asynchronous
+launch covers the launch, not the kernels.
+
+The graph cache counts a hit for each call run by a graph compiled before the
+call, and a miss for each compile. Calls run eagerly count neither.
+"""
+import threading
+from typing import Dict, Optional
+
+__all__ = ["CallMetrics", "PHASES", "COUNTERS"]
+
+INPUT_CONVERSION = "input_conversion"
+GRAPH_LOOKUP = "graph_lookup"
+EXECUTION = "execution"
+OUTPUT_CONVERSION = "output_conversion"
+TOTAL = "total"
+PHASES = (INPUT_CONVERSION, GRAPH_LOOKUP, EXECUTION, OUTPUT_CONVERSION, TOTAL)
+
+GRAPH_CACHE_HITS = "graph_cache_hits"
+GRAPH_CACHE_MISSES = "graph_cache_misses"
+GRAPH_CACHE_EVICTIONS = "graph_cache_evictions"
+COUNTERS = (GRAPH_CACHE_HITS, GRAPH_CACHE_MISSES, GRAPH_CACHE_EVICTIONS)
+
+
+class _PhaseStats:
+    __slots__ = ["count", "seconds", "max_seconds"]
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+
+class CallMetrics:
+    """Phase timings, graph cache counters and compile times of one module.
+
+    Args:
+        name (str): The name of the module, used as a label on export.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self._phases = {phase: _PhaseStats() for phase in PHASES}
+        self._counters = {counter: 0 for counter in COUNTERS}
+        self._compiles: Dict[str, _PhaseStats] = {}
+
+    def record_call(
+        self,
+        input_conversion: float,
+        graph_lookup: float,
+        execution: float,
+        output_conversion: float,
+    ) -> None:
+        with self._lock:
+            self._phases[INPUT_CONVERSION].add(input_conversion)
+            self._phases[GRAPH_LOOKUP].add(graph_lookup)
+            self._phases[EXECUTION].add(execution)
+            self._phases[OUTPUT_CONVERSION].add(output_conversion)
+            self._phases[TOTAL].add(
+                input_conversion + graph_lookup + execution + output_conversion
+            )
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self._counters[counter] += n
+
+    def set_counter(self, counter: str, value: int) -> None:
+        # For counters kept elsewhere, e.g. evictions by the graph cache manager
+        self._counters[counter] = value
+
+    def record_compile(self, input_structure_key: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._compiles.get(input_structure_key)
+            if stats is None:
+                stats = _PhaseStats()
+                self._compiles[input_structure_key] = stats
+            stats.add(seconds)
+
+    def as_dict(self) -> Dict:
+        """Returns the count, total, mean and max seconds of each phase, the
+        graph cache counters, and the compile count and seconds of each input
+        structure key."""
+        with self._lock:
+            phases = {}
+            for phase, stats in self._phases.items():
+                phases[phase] = {
+                    "count": stats.count,
+                    "seconds": stats.seconds,
+                    "mean_seconds": stats.seconds / stats.count if stats.count else 0.0,
+                    "max_seconds": stats.max_seconds,
+                }
+            compiles = {
+                key: {"count": stats.count, "seconds": stats.seconds}
+                for key, stats in self._compiles.items()
+            }
+            return {
+                "name": self.name,
+                "phases": phases,
+                "counters": dict(self._counters),
+                "compiles": compiles,
+            }
+
+    def to_prometheus(self, prefix: str = "onediff", labels: Optional[Dict] = None):
+        """Returns the metrics in the Prometheus text exposition format."""
+        labels = dict(labels or {})
+        labels.setdefault("module", self.name)
+
+        def fmt(extra=None):
+            items = dict(labels, **(extra or {}))
+            body = ",".join(f'{k}="{str(v)}"' for k, v in sorted(items.items()))
+            return "{" + body + "}"
+
+        metrics = self.as_dict()
+        lines = [
+            f"# HELP {prefix}_call_phase_seconds Host wall time of deployable module calls by phase.",
+            f"# TYPE {prefix}_call_phase_seconds summary",
+        ]
+        for phase, stats in metrics["phases"].items():
+            lines.append(
+                f"{prefix}_call_phase_seconds_sum{fmt({'phase': phase})} {stats['seconds']}"
+            )
+            lines.append(
+                f"{prefix}_call_phase_seconds_count{fmt({'phase': phase})} {stats['count']}"
+            )
+        for counter, value in metrics["counters"].items():
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            lines.append(f"{prefix}_{counter}_total{fmt()} {value}")
+        lines.append(f"# TYPE {prefix}_compile_seconds summary")
+        for key, stats in metrics["compiles"].items():
+            extra = {"input_structure": key}
+            lines.append(f"{prefix}_compile_seconds_sum{fmt(extra)} {stats['seconds']}")
+            lines.append(f"{prefix}_compile_seconds_count{fmt(extra)} {stats['count']}")
+        return "\n".join(lines) + "\n"
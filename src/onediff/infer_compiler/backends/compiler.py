@@ -1,15 +1,16 @@
-from typing import Callable, Optional
+from typing import Callable, Optional, TYPE_CHECKING
 
-import torch
+if TYPE_CHECKING:
+    import torch
 
-from .deployable_module import DeployableModule
+    from .deployable_module import DeployableModule
 
 _DEFAULT_BACKEND = "oneflow"
 
 
 def compile(
     torch_module: Optional[Callable] = None, *, backend=_DEFAULT_BACKEND, options=None
-) -> DeployableModule:
+) -> "DeployableModule":
     from .registry import lookup_backend
 
     backend = lookup_backend(backend)
@@ -17,5 +18,7 @@ def compile(
     return model
 
 
-def oneflow_compile(torch_module: torch.nn.Module, *, options=None) -> DeployableModule:
+def oneflow_compile(
+    torch_module: "torch.nn.Module", *, options=None
+) -> "DeployableModule":
     return compile(torch_module, backend="oneflow", options=options)
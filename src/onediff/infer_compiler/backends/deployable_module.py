@@ -9,3 +9,43 @@ class DeployableModule(torch.nn.Module):
 
     def forward(self, *args, **kwargs) -> Any:
         raise NotImplementedError()
+
+    def get_metrics(self, format="dict"):
+        """Returns the metrics of the calls of this module.
+
+        The wall time of each call is split into input conversion, graph
+        lookup, execution and output conversion, with the graph cache hits,
+        misses and evictions, and the compile time of each input structure.
+
+        Args:
+            format (str): "dict", or "prometheus" for the Prometheus text
+                exposition format.
+        """
+        metrics = self._deployable_module_metrics
+        if format == "prometheus":
+            return metrics.to_prometheus()
+        if format == "dict":
+            return metrics.as_dict()
+        raise ValueError(f"Unknown metrics format {format!r}")
+
+    def reset_metrics(self):
+        self._deployable_module_metrics.reset()
+
+    def swap_weights(self, weights, *, strict=True, prefix=""):
+        """Swaps in the weights of another checkpoint of the same architecture,
+        without recompiling.
+
+        Args:
+            weights: A state dict, or the path of a safetensors file, which is
+                read one tensor at a time.
+            strict (bool): Whether the names of `weights` must match exactly.
+            prefix (str): A prefix of the names of `weights` to strip.
+
+        Returns:
+            A dict with the number of `tensors` and `bytes` copied, and `seconds`.
+        """
+        from onediff.torch_utils.weight_swap import swap_module_weights
+
+        return swap_module_weights(
+            self._torch_module, weights, strict=strict, prefix=prefix
+        )
@@ -1,11 +1,12 @@
 import dataclasses
 import os
-from typing import Optional
-
-import torch
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 from onediff.utils import set_boolean_env_var, set_integer_env_var
 
+if TYPE_CHECKING:
+    import torch
+
 
 @dataclasses.dataclass
 class OneflowCompileOptions:
@@ -13,8 +14,25 @@ class OneflowCompileOptions:
     use_graph: bool = True
     debug_level: int = -1
     max_cached_graph_size: int = 9
+    # Byte budget of the graphs cached by all deployable modules of the process
+    graph_cache_max_bytes: int = None
     graph_file: str = None
-    graph_file_device: torch.device = None
+    graph_file_device: "torch.device" = None
+    graph_file_cache_max_bytes: int = None
+    # Store weights apart from graph files, shared by content digest
+    graph_file_shared_weights: bool = False
+    # Share equal state tensors between the graphs loaded for one module
+    share_graph_states: bool = False
+    # (height, width, batch) buckets of the latent input, inputs are padded to
+    # the nearest bucket and outputs are cropped back
+    shape_buckets: List[Tuple[int, int, int]] = None
+    # Names of the arguments padded on the batch, defaults to the ones of
+    # diffusers UNets, ControlNets and VAEs
+    shape_bucket_batch_inputs: List[str] = None
+    # Build graphs of new input structures in background, calls run eagerly
+    # until the graph is ready
+    async_compile: bool = False
+    max_async_compile_workers: int = 1
     # Optimization related environment variables
     run_graph_by_vm: bool = None
     graph_delay_variable_op_execution: bool = None
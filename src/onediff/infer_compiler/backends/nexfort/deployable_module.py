@@ -1,12 +1,49 @@
+import time
 from types import FunctionType
 from typing import Type, Union
 
 import torch
 from torch import nn
 
+from onediff.utils import trace_span
+
+from ..call_metrics import CallMetrics, GRAPH_CACHE_HITS, GRAPH_CACHE_MISSES
 from ..deployable_module import DeployableModule
 
 
+def _input_structure_key(args, kwargs) -> str:
+    def describe(value):
+        if isinstance(value, torch.Tensor):
+            return f"{str(value.dtype)[6:]}{list(value.shape)}"
+        return type(value).__name__
+
+    described = [describe(value) for value in args]
+    described.extend(f"{key}={describe(value)}" for key, value in kwargs.items())
+    return ",".join(described)
+
+
+def _call_with_metrics(metrics, compiled_model, args, kwargs):
+    # Dynamo compiles a new graph whenever the guards of the cached ones fail
+    unique_graphs = torch._dynamo.utils.counters["stats"]["unique_graphs"]
+    start_time = time.perf_counter()
+    with trace_span(f"{metrics.name}.forward", "step"), (
+        torch._dynamo.utils.disable_cache_limit()
+    ):
+        output = compiled_model(*args, **kwargs)
+    execution_time = time.perf_counter() - start_time
+    # As on oneflow, a hit is a call run by graphs compiled before it and a
+    # miss is a compile. Dynamo compiles one graph per graph break.
+    new_graphs = torch._dynamo.utils.counters["stats"]["unique_graphs"] - unique_graphs
+    if new_graphs > 0:
+        metrics.count(GRAPH_CACHE_MISSES, new_graphs)
+        metrics.record_compile(_input_structure_key(args, kwargs), execution_time)
+    else:
+        metrics.count(GRAPH_CACHE_HITS)
+    # Inputs and outputs are torch tensors, there is no conversion
+    metrics.record_call(0.0, 0.0, execution_time, 0.0)
+    return output
+
+
 class NexfortDeployableModule(DeployableModule):
     def __init__(self, compiled_module, torch_module):
         torch.nn.Module.__init__(self)
@@ -21,10 +58,14 @@ class NexfortDeployableModule(DeployableModule):
                 self, "_parameters", compiled_module._orig_mod._parameters
             )
             object.__setattr__(self, "_buffers", compiled_module._orig_mod._buffers)
+        object.__setattr__(
+            self, "_deployable_module_metrics", CallMetrics(type(torch_module).__name__)
+        )
 
     def forward(self, *args, **kwargs):
-        with torch._dynamo.utils.disable_cache_limit():
-            return self._deployable_module_model(*args, **kwargs)
+        return _call_with_metrics(
+            self._deployable_module_metrics, self._deployable_module_model, args, kwargs
+        )
 
     def __getattr__(self, name):
         return getattr(self._deployable_module_model, name)
@@ -33,10 +74,14 @@ class NexfortDeployableModule(DeployableModule):
 def _create_deployable_function(
     compiled_model, torch_module: FunctionType = None
 ) -> FunctionType:
+    metrics = CallMetrics(getattr(torch_module, "__name__", "function"))
+
     def deploy_function(*args, **kwargs):
-        with torch._dynamo.utils.disable_cache_limit():
-            return compiled_model(*args, **kwargs)
+        return _call_with_metrics(metrics, compiled_model, args, kwargs)
 
+    deploy_function.get_metrics = lambda format="dict": (
+        metrics.to_prometheus() if format == "prometheus" else metrics.as_dict()
+    )
     return deploy_function
 
 
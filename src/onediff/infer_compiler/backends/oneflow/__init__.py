@@ -1,3 +1,4 @@
 from ..env_var import OneflowCompileOptions
 from . import oneflow as _oneflow_backend
 from .deployable_module import OneflowDeployableModule
+from .graph_header_utils import GraphIncompatibleError, inspect_graph
@@ -1,70 +1,315 @@
+import time
+
 import torch
 import oneflow as flow  # usort: skip
 from oneflow.framework.args_tree import ArgsTree
 
-from onediff.utils import logger
+from onediff.utils import logger, trace_span
+from onediff.utils.chache_utils import LRUCache
 
+from ..call_metrics import GRAPH_CACHE_HITS, GRAPH_CACHE_MISSES
+from .param_utils import flush_graph_related_tensors, has_pending_graph_related_tensors
 from .utils.hash_utils import generate_input_structure_key
 
+# Non-tensor leaves that are passed to the graph unchanged
+_LEAF_TYPES = frozenset((int, float, bool, str, type(None)))
+_FLAT_CONTAINER_TYPES = frozenset((list, tuple, dict))
+_UNSUPPORTED = object()
 
-def input_output_processor(func):
-    def process_input(*args, **kwargs):
-        def input_fn(value):
-            if isinstance(value, torch.Tensor):
-                # TODO: https://github.com/siliconflow/sd-team/issues/109
-                return flow.utils.tensor.from_torch(value.contiguous())
-            else:
-                return value
-
-        args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
-
-        input_structure_key = generate_input_structure_key(args_tree)
-        out = args_tree.map_leaf(input_fn)
-        mapped_args = out[0]
-        mapped_kwargs = out[1]
-        return mapped_args, mapped_kwargs, input_structure_key
-
-    def process_output(output):
-        def output_fn(value):
-            if isinstance(value, flow.Tensor):
-                return flow.utils.tensor.to_torch(value)
-            else:
-                return value
-
-        out_tree = ArgsTree((output, None), False)
-        out = out_tree.map_leaf(output_fn)
-        return out[0]
 
-    def wrapper(self: "OneflowDeployableModule", *args, **kwargs):
-        mapped_args, mapped_kwargs, input_structure_key = process_input(*args, **kwargs)
-        if (
-            self._deployable_module_options.use_graph
-            and self._deployable_module_enable_dynamic
-            and self._deployable_module_dpl_graph is not None
-            and self._deployable_module_input_structure_key != input_structure_key
-        ):
-            # Retrieve the deployable module graph from cache using the input structure key
-            dpl_graph = self._deployable_module_graph_cache.get(
-                input_structure_key, None
-            )
-            self._deployable_module_graph_cache.put(
-                self._deployable_module_input_structure_key,
-                self._deployable_module_dpl_graph,
-            )
+class _CallPlan:
+    """Positions of the tensors in a call whose inputs are tensors, plain leaves
+    or flat containers of them, with the input structure key computed once.
 
-            # If a cached graph is found, update the deployable module graph and input structure key
-            if dpl_graph is not None:
-                self._deployable_module_dpl_graph = dpl_graph
-                self._deployable_module_input_structure_key = input_structure_key
-            else:
-                logger.warning(
-                    f"Input structure key {self._deployable_module_input_structure_key} to {input_structure_key} has changed. Resetting the deployable module graph. This may slow down the process."
-                )
-                self._deployable_module_dpl_graph = None
-                self._deployable_module_input_structure_key = None
-                self._load_graph_first_run = True
+    Slots are `(position, inner)` pairs where `inner` is None for a tensor, or
+    the indices/keys of the tensors inside a flat container.
+    """
+
+    __slots__ = ["input_structure_key", "arg_slots", "kwarg_slots"]
+
+    def __init__(self, input_structure_key, arg_slots, kwarg_slots):
+        self.input_structure_key = input_structure_key
+        self.arg_slots = arg_slots
+        self.kwarg_slots = kwarg_slots
+
+
+_CALL_PLAN_CACHE = LRUCache(256)
+
+
+def _value_signature(value):
+    value_type = type(value)
+    if isinstance(value, torch.Tensor) or value_type in _LEAF_TYPES:
+        return value_type
+    if value_type in _FLAT_CONTAINER_TYPES:
+        items = value.items() if value_type is dict else enumerate(value)
+        inner = []
+        for k, v in items:
+            if not isinstance(v, torch.Tensor) and type(v) not in _LEAF_TYPES:
+                return _UNSUPPORTED
+            inner.append((k, type(v)))
+        return (value_type, tuple(inner))
+    return _UNSUPPORTED
+
+
+def _call_signature(args, kwargs):
+    signature = []
+    for value in args:
+        value_signature = _value_signature(value)
+        if value_signature is _UNSUPPORTED:
+            return None
+        signature.append(value_signature)
+    for key, value in kwargs.items():
+        value_signature = _value_signature(value)
+        if value_signature is _UNSUPPORTED:
+            return None
+        signature.append((key, value_signature))
+    return tuple(signature)
+
+
+def _is_tensor_type(value_type):
+    return isinstance(value_type, type) and issubclass(value_type, torch.Tensor)
+
+
+def _get_slot(value_signature):
+    if _is_tensor_type(value_signature):
+        return None
+    if isinstance(value_signature, tuple):
+        inner = tuple(k for k, t in value_signature[1] if _is_tensor_type(t))
+        return inner if len(inner) > 0 else _UNSUPPORTED
+    return _UNSUPPORTED
+
+
+def _make_call_plan(args, kwargs, signature):
+    args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
+    arg_slots = []
+    for i, value_signature in enumerate(signature[: len(args)]):
+        slot = _get_slot(value_signature)
+        if slot is not _UNSUPPORTED:
+            arg_slots.append((i, slot))
+    kwarg_slots = []
+    for key, value_signature in signature[len(args) :]:
+        slot = _get_slot(value_signature)
+        if slot is not _UNSUPPORTED:
+            kwarg_slots.append((key, slot))
+    return _CallPlan(generate_input_structure_key(args_tree), arg_slots, kwarg_slots)
+
+
+def _to_oneflow(tensor):
+    if not tensor.is_contiguous():
+        # TODO: https://github.com/siliconflow/sd-team/issues/109
+        tensor = tensor.contiguous()
+    return flow.utils.tensor.from_torch(tensor)
+
+
+def _convert_slot(value, inner):
+    if inner is None:
+        return _to_oneflow(value)
+    if type(value) is dict:
+        value = dict(value)
+        for k in inner:
+            value[k] = _to_oneflow(value[k])
+        return value
+    mapped = list(value)
+    for i in inner:
+        mapped[i] = _to_oneflow(mapped[i])
+    return type(value)(mapped)
+
+
+def process_input_with_call_plan(*args, **kwargs):
+    signature = _call_signature(args, kwargs)
+    if signature is None:
+        return process_input_with_args_tree(*args, **kwargs)
+
+    plan = _CALL_PLAN_CACHE.get(signature, None)
+    if plan is None:
+        plan = _make_call_plan(args, kwargs, signature)
+        _CALL_PLAN_CACHE.put(signature, plan)
+
+    mapped_args = list(args)
+    for i, inner in plan.arg_slots:
+        mapped_args[i] = _convert_slot(args[i], inner)
+    mapped_kwargs = dict(kwargs)
+    for key, inner in plan.kwarg_slots:
+        mapped_kwargs[key] = _convert_slot(kwargs[key], inner)
+    return mapped_args, mapped_kwargs, plan.input_structure_key
 
-        output = func(self, *mapped_args, **mapped_kwargs)
-        return process_output(output)
+
+def process_input_with_args_tree(*args, **kwargs):
+    def input_fn(value):
+        if isinstance(value, torch.Tensor):
+            # TODO: https://github.com/siliconflow/sd-team/issues/109
+            return flow.utils.tensor.from_torch(value.contiguous())
+        else:
+            return value
+
+    args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
+
+    input_structure_key = generate_input_structure_key(args_tree)
+    out = args_tree.map_leaf(input_fn)
+    mapped_args = out[0]
+    mapped_kwargs = out[1]
+    return mapped_args, mapped_kwargs, input_structure_key
+
+
+def process_output(output):
+    if isinstance(output, flow.Tensor):
+        return flow.utils.tensor.to_torch(output)
+    if type(output) in (tuple, list) and all(
+        isinstance(value, flow.Tensor) for value in output
+    ):
+        return type(output)(flow.utils.tensor.to_torch(value) for value in output)
+
+    def output_fn(value):
+        if isinstance(value, flow.Tensor):
+            return flow.utils.tensor.to_torch(value)
+        else:
+            return value
+
+    out_tree = ArgsTree((output, None), False)
+    out = out_tree.map_leaf(output_fn)
+    return out[0]
+
+
+def _clone_inputs(args, kwargs):
+    def clone_fn(value):
+        return value.clone() if isinstance(value, flow.Tensor) else value
+
+    out = ArgsTree((args, kwargs), False).map_leaf(clone_fn)
+    return out[0], out[1]
+
+
+# The key of the background build of a module compiled with dynamic=False
+_STATIC_GRAPH_KEY = "static"
+
+
+def _prepare_async_graph(self, method_name, input_structure_key, args, kwargs):
+    """Switches to the compiled graph of `input_structure_key` if there is one,
+    otherwise schedules a background build of it.
+
+    Returns whether a compiled graph is in place for this call.
+    """
+    current_graph = self._deployable_module_dpl_graph
+    current_key = self._deployable_module_input_structure_key
+    enable_dynamic = self._deployable_module_enable_dynamic
+    if (
+        current_graph is not None
+        and current_graph.is_compiled
+        and (current_key == input_structure_key or not enable_dynamic)
+    ):
+        return True
+
+    compiler = self._deployable_module_async_compiler
+    metrics = self._deployable_module_metrics
+    # Without dynamic graphs, the first graph built serves all input structures
+    build_key = input_structure_key if enable_dynamic else _STATIC_GRAPH_KEY
+    dpl_graph = None
+    if enable_dynamic:
+        dpl_graph = self._deployable_module_graph_cache.get(input_structure_key, None)
+    if dpl_graph is None:
+        dpl_graph = compiler.pop_ready(build_key)
+        if dpl_graph is not None:
+            metrics.count(GRAPH_CACHE_MISSES)
+            metrics.record_compile(input_structure_key, dpl_graph.compile_seconds)
+    if dpl_graph is not None:
+        if current_graph is not None and current_graph.is_compiled:
+            self._deployable_module_graph_cache.put(current_key, current_graph)
+        self._deployable_module_dpl_graph = dpl_graph
+        self._deployable_module_input_structure_key = input_structure_key
+        return True
+
+    # The graph is built from its own copy of the inputs, as the caller may
+    # update them in place while the build is running
+    cloned_args, cloned_kwargs = _clone_inputs(args, kwargs)
+    compiler.submit(
+        build_key,
+        lambda: self._compile_graph(method_name, *cloned_args, **cloned_kwargs),
+    )
+    return False
+
+
+def input_output_processor(func):
+    def wrapper(self: "OneflowDeployableModule", *args, **kwargs):
+        metrics = self._deployable_module_metrics
+        with trace_span(f"{metrics.name}.{func.__name__}", "step"):
+            return _process_call(func, self, metrics, args, kwargs)
 
     return wrapper
+
+
+def _process_call(func, self, metrics, args, kwargs):
+    start_time = time.perf_counter()
+    if has_pending_graph_related_tensors():
+        flush_graph_related_tensors()
+    shape_bucketer = self._deployable_module_shape_bucketer
+    if shape_bucketer is not None:
+        args, kwargs, pad_info = shape_bucketer.pad_inputs(
+            args, kwargs, getattr(self._torch_module, func.__name__, None)
+        )
+    mapped_args, mapped_kwargs, input_structure_key = process_input_with_call_plan(
+        *args, **kwargs
+    )
+    input_time = time.perf_counter()
+    run_eager = False
+    if (
+        self._deployable_module_options.use_graph
+        and self._deployable_module_async_compiler is not None
+    ):
+        run_eager = not _prepare_async_graph(
+            self, func.__name__, input_structure_key, mapped_args, mapped_kwargs
+        )
+    elif (
+        self._deployable_module_options.use_graph
+        and self._deployable_module_enable_dynamic
+        and self._deployable_module_dpl_graph is not None
+        and self._deployable_module_input_structure_key != input_structure_key
+    ):
+        # Retrieve the deployable module graph from cache using the input structure key
+        dpl_graph = self._deployable_module_graph_cache.get(input_structure_key, None)
+        self._deployable_module_graph_cache.put(
+            self._deployable_module_input_structure_key,
+            self._deployable_module_dpl_graph,
+        )
+
+        # If a cached graph is found, update the deployable module graph and input structure key
+        if dpl_graph is not None:
+            self._deployable_module_dpl_graph = dpl_graph
+            self._deployable_module_input_structure_key = input_structure_key
+        else:
+            logger.warning(
+                f"Input structure key {self._deployable_module_input_structure_key} to {input_structure_key} has changed. Resetting the deployable module graph. This may slow down the process."
+            )
+            self._deployable_module_dpl_graph = None
+            self._deployable_module_input_structure_key = None
+            self._load_graph_first_run = True
+
+    lookup_time = time.perf_counter()
+    dpl_graph = self._deployable_module_dpl_graph
+    compiled = dpl_graph is not None and dpl_graph.is_compiled
+    if run_eager:
+        self._deployable_module_run_eager = True
+        try:
+            output = func(self, *mapped_args, **mapped_kwargs)
+        finally:
+            self._deployable_module_run_eager = False
+    else:
+        output = func(self, *mapped_args, **mapped_kwargs)
+    execution_time = time.perf_counter()
+    dpl_graph = self._deployable_module_dpl_graph
+    # A hit is a call run by a graph compiled before it, a miss a compile
+    if self._deployable_module_options.use_graph and not run_eager:
+        if compiled:
+            metrics.count(GRAPH_CACHE_HITS)
+        elif dpl_graph is not None and dpl_graph.is_compiled:
+            # The graph was built by this call, its execution time includes it
+            metrics.count(GRAPH_CACHE_MISSES)
+            metrics.record_compile(input_structure_key, dpl_graph.compile_seconds)
+    output = process_output(output)
+    if shape_bucketer is not None:
+        output = shape_bucketer.crop_outputs(output, pad_info)
+    metrics.record_call(
+        input_time - start_time,
+        lookup_time - input_time,
+        execution_time - lookup_time,
+        time.perf_counter() - execution_time,
+    )
+    return output
@@ -0,0 +1,149 @@
+"""Build graphs on background threads while calls fall back to eager execution."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from onediff.utils import logger
+
+__all__ = ["BackgroundGraphCompiler"]
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+# Background builds are capped per process, as they compete for the same device
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+_IN_FLIGHT = 0
+_MAX_IN_FLIGHT = 1
+
+# Failed builds are retried after a backoff doubling from this delay, up to
+# this number of attempts
+RETRY_DELAY_SECONDS = 10.0
+MAX_ATTEMPTS = 3
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _EXECUTOR, _MAX_IN_FLIGHT
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _MAX_IN_FLIGHT = max_workers
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="onediff_graph_compile"
+            )
+        elif max_workers != _MAX_IN_FLIGHT:
+            logger.warning(
+                f"max_async_compile_workers={max_workers} is ignored, the limit of "
+                f"background graph builds of the process is already {_MAX_IN_FLIGHT}"
+            )
+        return _EXECUTOR
+
+
+class BackgroundGraphCompiler:
+    """Tracks the background graph builds of one deployable module.
+
+    Args:
+        max_workers (int): The maximum number of graphs built at the same time
+            in this process. Misses beyond it are not scheduled, and will be
+            scheduled again on a later call. The first compiler created in a
+            process sets the limit.
+
+    A failed build is retried by a later call after a backoff, up to
+    `MAX_ATTEMPTS` attempts. Past that, calls with its input structure run
+    eagerly.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self._executor = _get_executor(max_workers)
+        self._lock = threading.Lock()
+        self._status: Dict[str, str] = {}
+        self._graphs: Dict[str, object] = {}
+        self._errors: Dict[str, str] = {}
+        # key -> (number of failed attempts, time of the next attempt)
+        self._failures: Dict[str, Tuple[int, float]] = {}
+
+    def submit(self, key: str, build_fn: Callable[[], object]) -> bool:
+        """Schedules `build_fn` to build the graph of `key`.
+
+        Returns False if the graph of `key` is already scheduled or built, if
+        it failed and is not due for a retry, or if the number of builds in
+        flight reached the limit.
+        """
+        global _IN_FLIGHT
+        with self._lock:
+            status = self._status.get(key)
+            if status == FAILED:
+                attempts, retry_time = self._failures[key]
+                if attempts >= MAX_ATTEMPTS or time.time() < retry_time:
+                    return False
+            elif status is not None:
+                return False
+            with _EXECUTOR_LOCK:
+                if _IN_FLIGHT >= _MAX_IN_FLIGHT:
+                    return False
+                _IN_FLIGHT += 1
+            self._status[key] = PENDING
+
+        def run():
+            global _IN_FLIGHT
+            with self._lock:
+                self._status[key] = RUNNING
+            graph, error = None, None
+            try:
+                logger.info(f"Building graph of input structure {key} in background")
+                graph = build_fn()
+            except Exception as e:
+                error = e
+            finally:
+                # Free the slot before the status is seen, so a retry can run
+                with _EXECUTOR_LOCK:
+                    _IN_FLIGHT -= 1
+
+            if error is None:
+                with self._lock:
+                    self._graphs[key] = graph
+                    self._status[key] = READY
+                    self._errors.pop(key, None)
+                    self._failures.pop(key, None)
+                logger.info(f"Graph of input structure {key} is ready")
+                return
+            with self._lock:
+                self._errors[key] = str(error)
+                self._status[key] = FAILED
+                attempts = self._failures.get(key, (0, 0.0))[0] + 1
+                delay = RETRY_DELAY_SECONDS * 2 ** (attempts - 1)
+                self._failures[key] = (attempts, time.time() + delay)
+            if attempts < MAX_ATTEMPTS:
+                logger.error(
+                    f"Failed to build graph of input structure {key}: {error}, "
+                    f"retried by a call after {delay:.0f}s"
+                )
+            else:
+                logger.error(
+                    f"Failed to build graph of input structure {key} {attempts} "
+                    f"times: {error}, calls with it run eagerly from now on"
+                )
+
+        self._executor.submit(run)
+        return True
+
+    def pop_ready(self, key: str):
+        """Returns the built graph of `key` and forgets it, or None if not ready."""
+        with self._lock:
+            if self._status.get(key) != READY:
+                return None
+            del self._status[key]
+            return self._graphs.pop(key)
+
+    def get_status(self) -> Dict[str, Dict]:
+        with self._lock:
+            status = {key: {"status": value} for key, value in self._status.items()}
+            for key, error in self._errors.items():
+                if key in status:
+                    status[key]["error"] = error
+            for key, (attempts, _) in self._failures.items():
+                if key in status:
+                    status[key]["attempts"] = attempts
+            return status
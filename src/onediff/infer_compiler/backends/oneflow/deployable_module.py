@@ -6,22 +6,34 @@ import torch
 import oneflow as flow  # usort: skip
 
 from onediff.utils import logger
-from onediff.utils.chache_utils import LRUCache
 
+from ..call_metrics import CallMetrics, GRAPH_CACHE_EVICTIONS
 from ..deployable_module import DeployableModule
 from ..env_var import OneflowCompileOptions
 from .args_tree_util import input_output_processor
+from .background_compile_utils import BackgroundGraphCompiler
 
 from .dual_module import DualModule, get_mixed_dual_module
+from .graph_cache_manager import get_graph_cache_manager, ModuleGraphCache
+from .graph_header_utils import (
+    GraphIncompatibleError,
+    inspect_graph,
+    make_graph_header,
+    write_graph_header,
+)
 from .graph_management_utils import graph_file_management
+from .graph_memory_utils import get_graph_memory_report
 from .oneflow_exec_mode import oneflow_exec_mode, oneflow_exec_mode_enabled
 from .online_quantization_utils import quantize_and_deploy_wrapper
 from .param_utils import (
     check_device,
+    flush_graph_related_tensors,
     generate_constant_folding_info,
+    get_constant_folding_info,
     parse_device,
     update_graph_with_constant_folding_info,
 )
+from .shape_bucket_utils import ShapeBucketer
 from .transform.builtin_transform import torch2oflow
 
 from .transform.manager import transform_mgr
@@ -81,11 +93,39 @@ class OneflowDeployableModule(DeployableModule):
             options if options is not None else OneflowCompileOptions()
         )
         self._deployable_module_dpl_graph = None
-        self._deployable_module_graph_cache = LRUCache(
-            self._deployable_module_options.max_cached_graph_size
+        self._deployable_module_graph_cache = ModuleGraphCache(
+            type(torch_module).__name__,
+            self._deployable_module_options.max_cached_graph_size,
+            get_graph_cache_manager(
+                self._deployable_module_options.graph_cache_max_bytes
+            ),
+        )
+        self._deployable_module_shape_bucketer = (
+            ShapeBucketer(
+                self._deployable_module_options.shape_buckets,
+                self._deployable_module_options.shape_bucket_batch_inputs,
+            )
+            if self._deployable_module_options.shape_buckets
+            else None
+        )
+        self._deployable_module_async_compiler = (
+            BackgroundGraphCompiler(
+                self._deployable_module_options.max_async_compile_workers
+            )
+            if self._deployable_module_options.async_compile
+            else None
+        )
+        self._deployable_module_run_eager = False
+        self._deployable_module_metrics = CallMetrics(type(torch_module).__name__)
+        # State tensors shared by the graphs loaded for this module
+        self._deployable_module_shared_graph_states = (
+            {} if self._deployable_module_options.share_graph_states else None
         )
         self._is_raw_deployable_module = True
         self._load_graph_first_run = True
+        # (store, cache key, input structure key) of the graph file to save
+        # once the background build of its graph is done
+        self._deployable_module_pending_graph_save = None
         self._deployable_module_input_structure_key = None
 
     @classmethod
@@ -101,7 +141,16 @@ class OneflowDeployableModule(DeployableModule):
         instance._deployable_module_graph_cache = (
             existing_module._deployable_module_graph_cache
         )
+        instance._deployable_module_metrics = existing_module._deployable_module_metrics
+        instance._deployable_module_shared_graph_states = getattr(
+            existing_module,
+            "_deployable_module_shared_graph_states",
+            instance._deployable_module_shared_graph_states,
+        )
         instance._load_graph_first_run = existing_module._load_graph_first_run
+        instance._deployable_module_pending_graph_save = getattr(
+            existing_module, "_deployable_module_pending_graph_save", None
+        )
         instance._deployable_module_input_structure_key = (
             existing_module._deployable_module_input_structure_key
         )
@@ -111,28 +160,50 @@ class OneflowDeployableModule(DeployableModule):
 
         return instance
 
-    def get_graph(self):
-        if self._deployable_module_dpl_graph is not None:
-            return self._deployable_module_dpl_graph
-        self._deployable_module_dpl_graph = get_oneflow_graph(
+    def _new_graph(self):
+        graph = get_oneflow_graph(
             self._deployable_module_model.oneflow_module,
             self._deployable_module_options.max_cached_graph_size,
             self._deployable_module_enable_dynamic,
         )
         # Enable debug mode
         if transform_mgr.debug_mode:
-            self._deployable_module_dpl_graph.debug(0)
+            graph.debug(0)
         if self._deployable_module_options.debug_level > 0:
-            self._deployable_module_dpl_graph.debug(
-                self._deployable_module_options.debug_level
-            )
+            graph.debug(self._deployable_module_options.debug_level)
+        return graph
+
+    def get_graph(self):
+        # Weights changed since the last call are refolded before the graph
+        # is run or saved
+        flush_graph_related_tensors()
+        if self._deployable_module_dpl_graph is not None:
+            return self._deployable_module_dpl_graph
+        self._deployable_module_dpl_graph = self._new_graph()
         return self._deployable_module_dpl_graph
 
+    def _compile_graph(self, method_name, *args, **kwargs):
+        """Builds a new graph for `method_name` on oneflow inputs, leaving the
+        graph in use untouched."""
+        graph = self._new_graph()
+        if method_name == "decode":
+
+            def _build(graph, *args, **kwargs):
+                return graph.model.decode(*args, **kwargs)
+
+            graph.build = types.MethodType(_build, graph)
+        with oneflow_exec_mode():
+            graph(*args, **kwargs)
+        return graph
+
     @handle_deployable_exception
     @graph_file_management
     @input_output_processor
     def apply_model(self, *args, **kwargs):
-        if self._deployable_module_options.use_graph:
+        if (
+            self._deployable_module_options.use_graph
+            and not self._deployable_module_run_eager
+        ):
             dpl_graph = self.get_graph()
             with oneflow_exec_mode():
                 output = dpl_graph(*args, **kwargs)
@@ -148,7 +219,10 @@ class OneflowDeployableModule(DeployableModule):
     @graph_file_management
     @input_output_processor
     def forward(self, *args, **kwargs):
-        if self._deployable_module_options.use_graph:
+        if (
+            self._deployable_module_options.use_graph
+            and not self._deployable_module_run_eager
+        ):
             dpl_graph = self.get_graph()
             with oneflow_exec_mode():
                 output = dpl_graph(*args, **kwargs)
@@ -181,7 +255,10 @@ class OneflowDeployableModule(DeployableModule):
     @graph_file_management
     @input_output_processor
     def decode(self, *args, **kwargs):
-        if self._deployable_module_options.use_graph:
+        if (
+            self._deployable_module_options.use_graph
+            and not self._deployable_module_run_eager
+        ):
 
             def _build(graph, *args, **kwargs):
                 return graph.model.decode(*args, **kwargs)
@@ -201,15 +278,48 @@ class OneflowDeployableModule(DeployableModule):
         return getattr(self._deployable_module_model, name)
 
     def load_graph(self, file_path, device=None, run_warmup=True, *, state_dict=None):
+        result = inspect_graph(file_path, self, check_device=device is None)
+        if not result["compatible"]:
+            raise GraphIncompatibleError(file_path, result["problems"])
+        # Weights stored apart from the graph file are bound to the ones of the
+        # oneflow module, which share memory with the torch module
+        oneflow_module = self._deployable_module_model.oneflow_module
+        resident_weights = dict(oneflow_module.named_parameters())
+        resident_weights.update(oneflow_module.named_buffers())
         self.get_graph().load_graph(
-            file_path, device, run_warmup, state_dict=state_dict
+            file_path,
+            device,
+            run_warmup,
+            state_dict=state_dict,
+            resident_weights=resident_weights,
+            shared_states=self._deployable_module_shared_graph_states,
         )
         generate_constant_folding_info(self)
         update_graph_with_constant_folding_info(self)
+        self.get_graph().graph_weights_stamp = self._weights_stamp()
         self._load_graph_first_run = False
 
+    def _weights_stamp(self):
+        # In place writes such as LoRA fusion or swap_weights bump the versions
+        tensors = list(self._torch_module.parameters())
+        tensors.extend(self._torch_module.buffers())
+        return tuple((tensor.data_ptr(), tensor._version) for tensor in tensors)
+
     def save_graph(self, file_path, *, process_state_dict=lambda x: x):
-        self.get_graph().save_graph(file_path, process_state_dict=process_state_dict)
+        graph = self.get_graph()
+        if (
+            getattr(graph, "graph_file_path", None) is not None
+            and graph.graph_weights_stamp != self._weights_stamp()
+        ):
+            # The weights changed since the graph file was loaded, it is stale
+            graph.graph_file_path = None
+        weight_digests = graph.save_graph(
+            file_path,
+            process_state_dict=process_state_dict,
+            shared_weights=self._deployable_module_options.graph_file_shared_weights,
+        )
+        write_graph_header(file_path, make_graph_header(self))
+        return weight_digests
 
     def extra_repr(self) -> str:
         return self._deployable_module_model.extra_repr()
@@ -230,13 +340,76 @@ class OneflowDeployableModule(DeployableModule):
 
     def _clear_old_graph(self):
         self._load_graph_first_run = True
+        self._deployable_module_pending_graph_save = None
         self._deployable_module_dpl_graph = None
         self._deployable_module_input_structure_key = None
         del self._deployable_module_model.oneflow_module
 
+    def swap_weights(self, weights, *, strict=True, prefix=""):
+        result = super().swap_weights(weights, strict=strict, prefix=prefix)
+        # The parameters of the graphs share storage with the torch module, only
+        # the constant folded conv weights are copies to refresh
+        if get_constant_folding_info(self) is not None:
+            update_graph_with_constant_folding_info(self, only_dirty=True)
+        logger.info(
+            f"Swapped {result['tensors']} weights ({result['bytes']} bytes) in {result['seconds']:.2f}s"
+        )
+        return result
+
+    def get_metrics(self, format="dict"):
+        self._deployable_module_metrics.set_counter(
+            GRAPH_CACHE_EVICTIONS, self._deployable_module_graph_cache.evictions
+        )
+        return super().get_metrics(format)
+
     def get_graph_file(self):
         return self._deployable_module_options.graph_file
 
+    def get_async_compile_status(self):
+        """Returns the status of the graphs built in background.
+
+        The dict is keyed by input structure key, and is None if `async_compile`
+        is not set in the compile options. The status is one of "pending",
+        "running", "ready" and "failed". A graph leaves this dict once it is
+        ready and used by a call.
+        """
+        if self._deployable_module_async_compiler is None:
+            return None
+        return self._deployable_module_async_compiler.get_status()
+
+    def get_graph_cache_stats(self):
+        """Returns the stats of the process-wide graph cache.
+
+        Graphs of the input structures not in use by deployable modules are kept
+        in this cache, see `GraphCacheManager.get_stats`.
+        """
+        return self._deployable_module_graph_cache.manager.get_stats()
+
+    def get_graph_memory_report(self):
+        """Returns the bytes of state tensors held by each graph of this module.
+
+        The dict is keyed by input structure key, with the `total_bytes`,
+        `shared_bytes` and `unique_bytes` of the graph in use and the cached
+        graphs. Shared bytes are held by the module parameters or other graphs.
+        """
+        graphs = dict(self._deployable_module_graph_cache.items())
+        if self._deployable_module_dpl_graph is not None:
+            graphs[
+                self._deployable_module_input_structure_key
+            ] = self._deployable_module_dpl_graph
+        torch_module = self._deployable_module_model._torch_module
+        module_tensors = list(torch_module.parameters()) + list(torch_module.buffers())
+        return get_graph_memory_report(graphs, module_tensors)
+
+    def get_shape_bucket_stats(self):
+        """Returns the hit and miss counters per shape bucket.
+
+        Returns None if `shape_buckets` is not set in the compile options.
+        """
+        if self._deployable_module_shape_bucketer is None:
+            return None
+        return self._deployable_module_shape_bucketer.get_stats()
+
     def apply_online_quant(self, quant_config):
         """
         Applies the provided quantization configuration for online use.
@@ -1,4 +1,6 @@
+import logging
 import os
+import time
 import types
 from itertools import chain
 from typing import Any
@@ -7,9 +9,9 @@ import torch
 import oneflow as flow  # usort: skip
 from oneflow.utils.tensor import to_torch
 
-from onediff.utils import logger
+from onediff.utils import logger, trace_span
 from .oneflow_exec_mode import oneflow_exec_mode, oneflow_exec_mode_enabled
-from .transform.builtin_transform import torch2oflow
+from .transform.builtin_transform import get_conversion_stats, torch2oflow
 
 
 class DualModule(torch.nn.Module):
@@ -27,8 +29,18 @@ class DualModule(torch.nn.Module):
             return self._oneflow_module
 
         logger.debug(f"Convert {type(self._torch_module)} ...")
-        self._oneflow_module = torch2oflow(self._torch_module)
-        logger.debug(f"Convert {type(self._torch_module)} done!")
+        start_time = time.perf_counter()
+        with trace_span("torch2oflow", module=type(self._torch_module).__name__):
+            self._oneflow_module = torch2oflow(self._torch_module)
+        logger.debug(
+            f"Convert {type(self._torch_module)} done in {time.perf_counter() - start_time:.3f}s!"
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            slowest = list(get_conversion_stats().items())[:5]
+            for cls_name, stats in slowest:
+                logger.debug(
+                    f"  {cls_name}: {stats['count']} modules in {stats['seconds']:.3f}s"
+                )
 
         return self._oneflow_module
 
@@ -1,6 +1,18 @@
+import os
+import shutil
+import time
+
 import oneflow as flow  # usort: skip
 
-from onediff.utils import logger
+from onediff.utils import logger, trace_span
+from .graph_memory_utils import get_graph_state_bytes, share_graph_states
+from .graph_weights_utils import (
+    copy_weights,
+    externalize_weights,
+    get_weight_digests,
+    get_weights_dir,
+    resolve_weights,
+)
 from .transform.builtin_transform import reverse_proxy_class
 from .transform.manager import transform_mgr
 from .utils.cost_util import cost_cnt
@@ -18,23 +30,78 @@ class OneflowGraph(flow.nn.Graph):
     def build(self, *args, **kwargs):
         return self.model(*args, **kwargs)
 
+    def __call__(self, *args, **kwargs):
+        if self.is_compiled:
+            return super().__call__(*args, **kwargs)
+        # Record the cost of building the graph, used to weight its eviction
+        # from the graph cache
+        start_time = time.perf_counter()
+        with trace_span("graph_build", model=type(self.model).__name__):
+            output = super().__call__(*args, **kwargs)
+        self.compile_seconds = time.perf_counter() - start_time
+        self.device_bytes = get_graph_state_bytes(self)
+        return output
+
+    @trace_span("graph_load")
     @cost_cnt(transform_mgr.debug_mode)
-    def load_graph(self, file_path, device=None, run_warmup=True, *, state_dict=None):
+    def load_graph(
+        self,
+        file_path,
+        device=None,
+        run_warmup=True,
+        *,
+        state_dict=None,
+        resident_weights=None,
+        shared_states=None,
+    ):
+        start_time = time.perf_counter()
         state_dict = state_dict if state_dict is not None else flow.load(file_path)
-        self.graph_state_dict = state_dict  # used for OneflowGraph.save_graph
+        # The loaded file is copied by OneflowGraph.save_graph, instead of
+        # keeping the whole state dict in host memory
+        self.graph_file_path = file_path
+        self.graph_file_keys = set(state_dict.keys())
+        self.graph_weight_digests = get_weight_digests(state_dict)
+        if len(self.graph_weight_digests) > 0:
+            resolve_weights(state_dict, get_weights_dir(file_path), resident_weights)
 
         if device is not None:
-            state_dict = flow.nn.Graph.runtime_state_dict_to(state_dict, device)
+            # Move one graph at a time, so the host copy of each is released
+            # before the next one is moved
+            for name in list(state_dict.keys()):
+                state_dict[name] = flow.nn.Graph.runtime_state_dict_to(
+                    {name: state_dict[name]}, device
+                )[name]
+        if shared_states is not None:
+            share_graph_states(state_dict, shared_states)
 
         self.load_runtime_state_dict(state_dict, warmup_with_run=run_warmup)
+        self.compile_seconds = time.perf_counter() - start_time
+        self.device_bytes = get_graph_state_bytes(self)
 
+    @trace_span("graph_save")
     @cost_cnt(transform_mgr.debug_mode)
-    def save_graph(self, file_path, *, process_state_dict: lambda x: x):
-        if hasattr(self, "graph_state_dict"):
-            flow.save(self.graph_state_dict, file_path)
-            return
-
+    def save_graph(
+        self, file_path, *, process_state_dict: lambda x: x, shared_weights=False
+    ):
         state_dict = self.runtime_state_dict()
+        graph_file_path = getattr(self, "graph_file_path", None)
+        # The loaded file misses the graphs of the input shapes compiled since
+        if (
+            graph_file_path is not None
+            and os.path.exists(graph_file_path)
+            and set(state_dict.keys()) == self.graph_file_keys
+        ):
+            if os.path.abspath(graph_file_path) != os.path.abspath(file_path):
+                if os.path.isdir(graph_file_path):
+                    shutil.copytree(graph_file_path, file_path, dirs_exist_ok=True)
+                else:
+                    shutil.copyfile(graph_file_path, file_path)
+                copy_weights(
+                    self.graph_weight_digests,
+                    get_weights_dir(graph_file_path),
+                    get_weights_dir(file_path),
+                )
+            return set(self.graph_weight_digests)
 
         import oneflow.framework.args_tree as args_tree
 
@@ -62,4 +129,8 @@ class OneflowGraph(flow.nn.Graph):
         args_tree._is_dataclass = original_is_dataclass
 
         state_dict = process_state_dict(state_dict)
+        if shared_weights:
+            state_dict = externalize_weights(state_dict, get_weights_dir(file_path))
         flow.save(state_dict, file_path)
+        # The digests of the shared weights referenced by the file
+        return get_weight_digests(state_dict)
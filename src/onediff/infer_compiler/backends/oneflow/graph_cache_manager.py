@@ -0,0 +1,209 @@
+"""A process-wide cache of the compiled graphs not in use by deployable modules.
+
+Each deployable module keeps the graphs of its other input structures in a
+`ModuleGraphCache`, a view on the shared `GraphCacheManager`. The manager
+bounds the device memory held by all cached graphs of the process, and evicts
+first the graphs that are cheap to rebuild, rarely used and large.
+"""
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+
+from onediff.utils import logger
+
+__all__ = [
+    "GraphCacheManager",
+    "ModuleGraphCache",
+    "get_graph_cache_manager",
+]
+
+
+class _Entry:
+    __slots__ = ["graph", "owner", "size", "cost", "hits", "last_used"]
+
+    def __init__(self, graph, owner, size, cost):
+        self.graph = graph
+        self.owner = owner
+        self.size = size
+        self.cost = cost
+        self.hits = 0
+        self.last_used = time.time()
+
+    def score(self, now: float) -> float:
+        # Seconds of rebuild saved per MB held, decayed by the time since use
+        size_mb = max(self.size / (1 << 20), 1.0)
+        age = now - self.last_used
+        return self.cost * (self.hits + 1) / size_mb / (1.0 + age / 600.0)
+
+
+class GraphCacheManager:
+    """Cached graphs of all deployable modules, bounded by a byte budget.
+
+    Args:
+        max_bytes (int, optional): Upper bound of the device memory held by
+            cached graphs. None means unbounded.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._entries: Dict[tuple, _Entry] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._owner_evictions: Dict[str, int] = {}
+
+    def get(self, owner: str, key: str):
+        with self._lock:
+            entry = self._entries.get((owner, key))
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            entry.hits += 1
+            entry.last_used = time.time()
+            return entry.graph
+
+    def put(self, owner: str, key: str, graph, capacity: Optional[int] = None):
+        size = getattr(graph, "device_bytes", 0)
+        cost = getattr(graph, "compile_seconds", 0.0)
+        if capacity is not None and capacity <= 0:
+            return
+        with self._lock:
+            old_entry = self._entries.get((owner, key))
+            entry = _Entry(graph, owner, size, cost)
+            if old_entry is not None:
+                entry.hits = old_entry.hits
+            self._entries[(owner, key)] = entry
+            if capacity is not None:
+                owned = [k for k in self._entries if k[0] == owner]
+                while len(owned) > capacity:
+                    owned.remove(self._evict_one(owner, exclude=(owner, key)))
+            if self.max_bytes is not None:
+                while self.total_bytes() > self.max_bytes and len(self._entries) > 1:
+                    self._evict_one(exclude=(owner, key))
+
+    def pop(self, owner: str, key: str):
+        with self._lock:
+            entry = self._entries.pop((owner, key), None)
+            return None if entry is None else entry.graph
+
+    def contains(self, owner: str, key: str) -> bool:
+        return (owner, key) in self._entries
+
+    def count(self, owner: str) -> int:
+        with self._lock:
+            return sum(1 for k in self._entries if k[0] == owner)
+
+    def items(self, owner: str) -> Dict[str, object]:
+        with self._lock:
+            return {k[1]: e.graph for k, e in self._entries.items() if k[0] == owner}
+
+    def drop_owner(self, owner: str) -> None:
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == owner]:
+                del self._entries[k]
+            self._owner_evictions.pop(owner, None)
+
+    def evictions(self, owner: str) -> int:
+        return self._owner_evictions.get(owner, 0)
+
+    def _evict_one(self, owner: Optional[str] = None, exclude=None) -> tuple:
+        now = time.time()
+        candidates = [
+            (entry.score(now), entry.last_used, k)
+            for k, entry in self._entries.items()
+            if k != exclude and (owner is None or k[0] == owner)
+        ]
+        _, _, k = min(candidates)
+        entry = self._entries.pop(k)
+        self._evictions += 1
+        self._owner_evictions[k[0]] = self._owner_evictions.get(k[0], 0) + 1
+        logger.info(
+            f"Evict graph of {k[0]} with input structure {k[1]} ({entry.size} bytes, built in {entry.cost:.1f}s, {entry.hits} hits)"
+        )
+        return k
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def get_stats(self) -> Dict:
+        """Returns the hit, miss and eviction counters, and the size, build
+        cost and hits of each cached graph by owner and input structure key."""
+        with self._lock:
+            owners = {}
+            for (owner, key), entry in self._entries.items():
+                owners.setdefault(owner, {})[key] = {
+                    "bytes": entry.size,
+                    "compile_seconds": entry.cost,
+                    "hits": entry.hits,
+                }
+            return {
+                "max_bytes": self.max_bytes,
+                "total_bytes": self.total_bytes(),
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "graphs": owners,
+            }
+
+
+_GRAPH_CACHE_MANAGER = GraphCacheManager()
+
+
+def get_graph_cache_manager(max_bytes: Optional[int] = None) -> GraphCacheManager:
+    if max_bytes is not None:
+        _GRAPH_CACHE_MANAGER.max_bytes = max_bytes
+    return _GRAPH_CACHE_MANAGER
+
+
+class ModuleGraphCache:
+    """The graphs of one deployable module in the process-wide manager, with
+    the `get`/`put` interface of `LRUCache`.
+
+    Args:
+        owner (str): The name of the module in the stats of the manager.
+        capacity (int): The maximum number of graphs cached for this module.
+        manager (GraphCacheManager, optional): Defaults to the process-wide one.
+    """
+
+    def __init__(
+        self,
+        owner: str,
+        capacity: int = 9,
+        manager: Optional[GraphCacheManager] = None,
+    ):
+        self.owner = f"{owner}@{id(self):x}"
+        self.LEN = capacity
+        self.manager = manager or get_graph_cache_manager()
+        # Release the graphs of the module once it is garbage collected
+        weakref.finalize(self, self.manager.drop_owner, self.owner)
+
+    def get(self, key: str, default=None):
+        graph = self.manager.get(self.owner, key)
+        return default if graph is None else graph
+
+    def put(self, key: str, value) -> None:
+        if value is None:
+            return
+        self.manager.put(self.owner, key, value, capacity=self.LEN)
+
+    def pop(self, key: str, default=None):
+        graph = self.manager.pop(self.owner, key)
+        return default if graph is None else graph
+
+    def items(self):
+        return self.manager.items(self.owner).items()
+
+    def __contains__(self, key: str) -> bool:
+        return self.manager.contains(self.owner, key)
+
+    def __len__(self) -> int:
+        return self.manager.count(self.owner)
+
+    @property
+    def evictions(self) -> int:
+        return self.manager.evictions(self.owner)
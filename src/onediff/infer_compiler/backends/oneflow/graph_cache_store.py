@@ -0,0 +1,272 @@
+"""A content-addressed store for compiled graph files.
+
+Graph files live in a single directory next to a manifest that indexes them by
+a cache key (model hash, input signature, onediff/oneflow versions and device).
+The manifest is read once per process, so lookups are served from memory.
+Access times of lookups are written back to it in batches, at the latest on
+exit, so that eviction follows use across restarts and processes.
+
+Graph files saved with shared weights reference weight files in a directory
+next to them. The manifest records the weights of each entry, weight files
+count towards the size bound, and are removed with the last entry using them.
+"""
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from onediff.utils import logger
+from .graph_header_utils import get_header_path
+from .graph_weights_utils import get_weight_path, remove_weights, WEIGHTS_DIR_NAME
+
+__all__ = ["GraphCacheStore", "get_graph_cache_store", "get_device_signature"]
+
+MANIFEST_FILE_NAME = "onediff_graph_manifest.json"
+MANIFEST_VERSION = 1
+# Access times of lookups are written to the manifest at most this often
+_ACCESS_TIMES_FLUSH_SECONDS = 60
+
+
+def get_device_signature(device=None) -> str:
+    import torch
+
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(str(device))
+    if device.type != "cuda" or not torch.cuda.is_available():
+        return device.type
+    index = device.index if device.index is not None else torch.cuda.current_device()
+    major, minor = torch.cuda.get_device_capability(index)
+    return f"cuda:sm_{major}{minor}"
+
+
+def _path_size(path: str) -> int:
+    if os.path.isdir(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                size += os.path.getsize(os.path.join(root, f))
+        return size
+    return os.path.getsize(path)
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _remove_graph_file(path: str) -> None:
+    _remove_path(path)
+    _remove_path(get_header_path(path))
+
+
+class GraphCacheStore:
+    """Graph files indexed by a manifest, bounded by size with LRU eviction.
+
+    Args:
+        root (str): Directory holding the graph files and the manifest.
+        max_bytes (int, optional): Upper bound of the total size of graph files.
+            The least recently used entries are evicted when it is exceeded.
+            Default is None (unbounded).
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(self.root, MANIFEST_FILE_NAME)
+        self.weights_dir = os.path.join(self.root, WEIGHTS_DIR_NAME)
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict] = self._read_manifest()
+        self._access_times_dirty = False
+        self._last_write_time = time.time()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def make_digest(key: Dict) -> str:
+        key_str = json.dumps(key, sort_keys=True, default=str)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def _read_manifest(self) -> Dict[str, Dict]:
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignore broken graph manifest {self.manifest_path}: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("entries", {})
+
+    def _merge_manifest(self) -> None:
+        # Merge entries saved by other processes sharing the same directory,
+        # and the access times of the entries they used
+        for digest, entry in self._read_manifest().items():
+            own_entry = self._entries.get(digest)
+            if own_entry is not None:
+                own_entry["last_used"] = max(
+                    own_entry["last_used"], entry.get("last_used", 0)
+                )
+            elif os.path.exists(os.path.join(self.root, entry["file"])):
+                self._entries[digest] = entry
+
+    def _write_manifest(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        self._merge_manifest()
+        manifest = {"version": MANIFEST_VERSION, "entries": self._entries}
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".manifest_")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
+        except Exception:
+            _remove_path(tmp_path)
+            raise
+        self._access_times_dirty = False
+        self._last_write_time = time.time()
+
+    def flush(self) -> None:
+        """Writes the access times of the lookups since the last write."""
+        with self._lock:
+            if not self._access_times_dirty:
+                return
+            try:
+                self._write_manifest()
+            except OSError as e:
+                logger.warning(
+                    f"Failed to write graph manifest {self.manifest_path}: {e}"
+                )
+
+    def lookup(self, key: Dict) -> Optional[str]:
+        """Returns the path of the graph file for `key`, or None on a miss."""
+        digest = self.make_digest(key)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            entry["last_used"] = time.time()
+            self._access_times_dirty = True
+            if time.time() - self._last_write_time > _ACCESS_TIMES_FLUSH_SECONDS:
+                self.flush()
+            return os.path.join(self.root, entry["file"])
+
+    def put(self, key: Dict, write_fn: Callable[[str], None], prefix="graph") -> str:
+        """Writes a graph file for `key` atomically and records it in the manifest.
+
+        `write_fn` is called with a temporary path, which is renamed to the final
+        path once the write finished. It may return the digests of the shared
+        weights the file references, which are kept as long as the entry.
+        """
+        digest = self.make_digest(key)
+        file_name = f"{prefix}_{digest[:16]}.graph"
+        file_path = os.path.join(self.root, file_name)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(
+            self.root, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            weight_digests = write_fn(tmp_path) or ()
+            with self._lock:
+                _remove_graph_file(file_path)
+                os.replace(tmp_path, file_path)
+                if os.path.exists(get_header_path(tmp_path)):
+                    os.replace(get_header_path(tmp_path), get_header_path(file_path))
+        finally:
+            _remove_graph_file(tmp_path)
+
+        with self._lock:
+            self._entries[digest] = {
+                "file": file_name,
+                "size": _path_size(file_path),
+                "last_used": time.time(),
+                "key": key,
+                "weights": self._get_weight_sizes(weight_digests),
+            }
+            self._evict()
+            self._write_manifest()
+        return file_path
+
+    def _get_weight_sizes(self, weight_digests: Iterable[str]) -> Dict[str, int]:
+        sizes = {}
+        for digest in weight_digests:
+            path = get_weight_path(self.weights_dir, digest)
+            sizes[digest] = os.path.getsize(path) if os.path.exists(path) else 0
+        return sizes
+
+    def _referenced_weights(self) -> Dict[str, int]:
+        weights = {}
+        for entry in self._entries.values():
+            weights.update(entry.get("weights", {}))
+        return weights
+
+    def _remove_unreferenced_weights(self, weight_digests: Set[str]) -> None:
+        if not weight_digests:
+            return
+        # Entries of other processes may reference the same weights
+        self._merge_manifest()
+        remove_weights(
+            self.weights_dir, weight_digests - set(self._referenced_weights())
+        )
+
+    def remove(self, key: Dict) -> None:
+        digest = self.make_digest(key)
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+            if entry is None:
+                return
+            _remove_graph_file(os.path.join(self.root, entry["file"]))
+            self._remove_unreferenced_weights(set(entry.get("weights", {})))
+            self._write_manifest()
+
+    def total_bytes(self) -> int:
+        """Returns the size of the graph files and of the weights they share."""
+        with self._lock:
+            graph_bytes = sum(entry["size"] for entry in self._entries.values())
+            return graph_bytes + sum(self._referenced_weights().values())
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        # Order by the access times of all processes
+        self._merge_manifest()
+        lru_entries = sorted(self._entries.items(), key=lambda x: x[1]["last_used"])
+        removed_weights = set()
+        # Never evict the most recently written entry
+        for digest, entry in lru_entries[:-1]:
+            if self.total_bytes() <= self.max_bytes:
+                break
+            logger.info(f"Evict graph file {entry['file']} ({entry['size']} bytes)")
+            _remove_graph_file(os.path.join(self.root, entry["file"]))
+            del self._entries[digest]
+            removed_weights.update(entry.get("weights", {}))
+        self._remove_unreferenced_weights(removed_weights)
+
+    def __contains__(self, key: Dict) -> bool:
+        return self.make_digest(key) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_GRAPH_CACHE_STORES: Dict[str, GraphCacheStore] = {}
+_GRAPH_CACHE_STORES_LOCK = threading.Lock()
+
+
+def get_graph_cache_store(root: str, max_bytes: Optional[int] = None):
+    root = os.path.abspath(root)
+    with _GRAPH_CACHE_STORES_LOCK:
+        store = _GRAPH_CACHE_STORES.get(root)
+        if store is None:
+            store = GraphCacheStore(root, max_bytes)
+            _GRAPH_CACHE_STORES[root] = store
+        elif max_bytes is not None:
+            store.max_bytes = max_bytes
+        return store
@@ -0,0 +1,142 @@
+"""A small header stored next to each graph file, to check that a graph file
+is compatible with the current environment and model without loading it.
+
+The header is a JSON file named after the graph file with `HEADER_SUFFIX`, as
+graph files are pickled state dicts that can only be read by a full load.
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from onediff.utils import logger
+
+__all__ = [
+    "HEADER_SUFFIX",
+    "GraphIncompatibleError",
+    "get_header_path",
+    "make_graph_header",
+    "write_graph_header",
+    "read_graph_header",
+    "inspect_graph",
+]
+
+HEADER_SUFFIX = ".header.json"
+HEADER_VERSION = 1
+
+
+class GraphIncompatibleError(RuntimeError):
+    """Raised when a graph file does not match the environment or model."""
+
+    def __init__(self, file_path: str, problems: List[str]):
+        self.file_path = file_path
+        self.problems = problems
+        super().__init__(
+            f"Graph file {file_path} is not compatible: {'; '.join(problems)}"
+        )
+
+
+def get_header_path(file_path: str) -> str:
+    return f"{file_path}{HEADER_SUFFIX}"
+
+
+def _get_environment(device=None) -> Dict[str, str]:
+    import oneflow as flow  # usort: skip
+    from onediff import __version__ as onediff_version
+
+    from .graph_cache_store import get_device_signature
+
+    return {
+        "onediff_version": onediff_version,
+        "oneflow_version": flow.__version__,
+        "device": get_device_signature(device),
+    }
+
+
+def _get_module_device(deployable_module):
+    torch_module = deployable_module._deployable_module_model._torch_module
+    for tensor in torch_module.parameters():
+        return tensor.device
+    return None
+
+
+def make_graph_header(deployable_module) -> Dict:
+    from .utils.hash_utils import generate_model_fingerprint
+
+    torch_module = deployable_module._deployable_module_model._torch_module
+    header = {
+        "header_version": HEADER_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "model_class": type(torch_module).__name__,
+        "model_fingerprint": generate_model_fingerprint(torch_module),
+        "input_structure_key": deployable_module._deployable_module_input_structure_key,
+    }
+    header.update(_get_environment(_get_module_device(deployable_module)))
+    return header
+
+
+def write_graph_header(file_path: str, header: Dict) -> None:
+    with open(get_header_path(file_path), "w") as f:
+        json.dump(header, f, indent=2, sort_keys=True)
+
+
+def read_graph_header(file_path: str) -> Optional[Dict]:
+    """Returns the header of a graph file, or None if it has no valid header."""
+    header_path = get_header_path(file_path)
+    if not os.path.isfile(header_path):
+        return None
+    try:
+        with open(header_path, "r") as f:
+            header = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to read graph header {header_path}: {e}")
+        return None
+    if header.get("header_version") != HEADER_VERSION:
+        return None
+    return header
+
+
+def inspect_graph(file_path: str, deployable_module=None, check_device=True) -> Dict:
+    """Checks a graph file against the current environment without loading it.
+
+    The onediff and oneflow versions and the device capability recorded in the
+    header of the graph file are compared with the current ones, and with the
+    model fingerprint of `deployable_module` if given. `check_device` is off
+    when the graph is explicitly moved to another device on load.
+
+    Returns a dict with the `header` (None for graph files saved without one),
+    whether the file is `compatible` and the list of `problems` found. Graph
+    files without a header are reported compatible, as they can't be checked.
+    """
+    if not os.path.exists(file_path):
+        return {
+            "header": None,
+            "compatible": False,
+            "problems": [f"Graph file {file_path} does not exist"],
+        }
+    header = read_graph_header(file_path)
+    if header is None:
+        return {"header": None, "compatible": True, "problems": []}
+
+    device = None
+    if deployable_module is not None:
+        device = _get_module_device(deployable_module)
+    environment = _get_environment(device)
+    problems = []
+    keys = ["onediff_version", "oneflow_version"]
+    if check_device:
+        keys.append("device")
+    for key in keys:
+        if header.get(key) != environment[key]:
+            problems.append(
+                f"{key} {header.get(key)} of the graph does not match {environment[key]}"
+            )
+    if deployable_module is not None:
+        from .utils.hash_utils import generate_model_fingerprint
+
+        torch_module = deployable_module._deployable_module_model._torch_module
+        if header.get("model_fingerprint") != generate_model_fingerprint(torch_module):
+            problems.append(
+                f"The graph was built for another {header.get('model_class')} architecture"
+            )
+    return {"header": header, "compatible": len(problems) == 0, "problems": problems}
@@ -11,9 +11,8 @@ from oneflow.framework.args_tree import ArgsTree
 
 from onediff.utils import logger
 from ..env_var import OneflowCompileOptions
+from .graph_cache_store import get_device_signature, get_graph_cache_store
 from .transform.builtin_transform import torch2oflow
-from .transform.manager import transform_mgr
-from .utils.cost_util import cost_time
 from .utils.hash_utils import generate_input_structure_key, generate_model_structure_key
 
 
@@ -25,20 +24,70 @@ def _prepare_file_path(file_path):
     return file_path
 
 
-@cost_time(debug=transform_mgr.debug_mode, message="generate graph file name")
-def generate_graph_file_name(file_path, deployable_module, args, kwargs):
-    file_path = _prepare_file_path(file_path)
+def generate_graph_cache_key(file_path, deployable_module, args, kwargs, device=None):
+    from onediff import __version__ as onediff_version
+
     args_tree = ArgsTree((args, kwargs), gen_name=False, tensor_type=torch.Tensor)
-    input_structure_key = generate_input_structure_key(args_tree)
-    model_structure_key = generate_model_structure_key(deployable_module)
-    # Combine cache keys
-    cache_key = f"{input_structure_key}_{model_structure_key}"
-    return f"{file_path}_{cache_key}.graph"
+    return {
+        "name": os.path.basename(_prepare_file_path(file_path)),
+        "model": generate_model_structure_key(deployable_module, length=None),
+        "input": generate_input_structure_key(args_tree, length=None),
+        "onediff_version": onediff_version,
+        "oneflow_version": flow.__version__,
+        "device": get_device_signature(device),
+    }
+
+
+def _save_graph_file(self: "OneflowDeployableModule", store, cache_key):
+    def process_state_dict_before_saving(state_dict: Dict):
+        graph = self.get_graph()
+        if importlib.util.find_spec("register_comfy"):
+            from register_comfy import CrossAttntionStateDictPatch as state_patch
+
+            state_dict = state_patch.process_state_dict_before_saving(
+                state_dict, graph=graph
+            )
+        return state_dict
+
+    graph_file = None
+    try:
+        graph_file = store.put(
+            cache_key,
+            lambda path: self.save_graph(
+                path, process_state_dict=process_state_dict_before_saving
+            ),
+            prefix=cache_key["name"],
+        )
+        logger.info(f"Saved graph file: {graph_file}")
+
+    except Exception as e:
+        logger.error(f"Failed to save graph file: {graph_file}! {e}")
 
 
 def graph_file_management(func):
     @wraps(func)
     def wrapper(self: "OneflowDeployableModule", *args, **kwargs):
+        pending_save = self._deployable_module_pending_graph_save
+        if pending_save is not None:
+            # The graph file was looked up and keyed by the call that started
+            # the background build, it is only saved once the graph of that
+            # call is in use. Without dynamic graphs, there is only one graph.
+            ret = func(self, *args, **kwargs)
+            store, cache_key, input_structure_key = pending_save
+            dpl_graph = self._deployable_module_dpl_graph
+            if (
+                dpl_graph is not None
+                and dpl_graph.is_compiled
+                and (
+                    not self._deployable_module_enable_dynamic
+                    or self._deployable_module_input_structure_key
+                    == input_structure_key
+                )
+            ):
+                self._deployable_module_pending_graph_save = None
+                _save_graph_file(self, store, cache_key)
+            return ret
+
         compile_options = (
             self._deployable_module_options
             if hasattr(self, "_deployable_module_options")
@@ -57,63 +106,53 @@ def graph_file_management(func):
 
         if is_first_load:
             self._load_graph_first_run = False
-            input_structure_key = self._deployable_module_input_structure_key
-            model_structure_key = generate_model_structure_key(deployable_module=self)
             file_path = _prepare_file_path(graph_file)
-            graph_file = (
-                f"{file_path}_{input_structure_key}_{model_structure_key}.graph"
+            store = get_graph_cache_store(
+                os.path.dirname(file_path) or ".",
+                max_bytes=compile_options.graph_file_cache_max_bytes,
+            )
+            cache_key = generate_graph_cache_key(
+                file_path, self, args, kwargs, compile_options.graph_file_device
             )
-
-        def process_state_dict_before_saving(state_dict: Dict):
-            nonlocal self, args, kwargs, graph_file
-            graph = self.get_graph()
-            if importlib.util.find_spec("register_comfy"):
-                from register_comfy import CrossAttntionStateDictPatch as state_patch
-
-                state_dict = state_patch.process_state_dict_before_saving(
-                    state_dict, graph=graph
-                )
-            return state_dict
 
         def handle_graph_loading():
             nonlocal graph_file, compile_options, is_first_load
             if not is_first_load:
                 return
 
-            if not os.path.exists(graph_file):
+            graph_file = store.lookup(cache_key)
+            if graph_file is None:
                 logger.info(
-                    f"Graph file {graph_file} does not exist! Generating graph."
+                    f"Graph cache of {cache_key['name']} does not exist in {store.root}! Generating graph."
                 )
-            else:
+                return
+            try:
                 graph_device = compile_options.graph_file_device
-                state_dict = flow.load(graph_file)
-                self.load_graph(
-                    graph_file, torch2oflow(graph_device), state_dict=state_dict
-                )
-                logger.info(f"Loaded graph file: {graph_file}")
-                is_first_load = False
+                self.load_graph(graph_file, torch2oflow(graph_device))
+            except Exception as e:
+                logger.warning(f"Failed to load graph file: {graph_file}! {e}")
+                store.remove(cache_key)
+                self._deployable_module_dpl_graph = None
+                return
+            logger.info(f"Loaded graph file: {graph_file}")
+            is_first_load = False
 
         def handle_graph_saving():
             nonlocal graph_file, compile_options, is_first_load
             if not is_first_load:
                 return
 
-            parent_dir = os.path.dirname(graph_file)
-            if parent_dir != "":
-                os.makedirs(parent_dir, exist_ok=True)
-
-            # Avoid graph file conflicts
-            if os.path.exists(graph_file):
-                raise FileExistsError(f"File {graph_file} exists!")
-            try:
-
-                self.save_graph(
-                    graph_file, process_state_dict=process_state_dict_before_saving
+            dpl_graph = self._deployable_module_dpl_graph
+            if dpl_graph is None or not dpl_graph.is_compiled:
+                # The graph is still being built in background, save it later
+                self._deployable_module_pending_graph_save = (
+                    store,
+                    cache_key,
+                    self._deployable_module_input_structure_key,
                 )
-                logger.info(f"Saved graph file: {graph_file}")
+                return
 
-            except Exception as e:
-                logger.error(f"Failed to save graph file: {graph_file}! {e}")
+            _save_graph_file(self, store, cache_key)
 
         if self._deployable_module_options.use_graph and is_first_load:
             handle_graph_loading()
@@ -0,0 +1,112 @@
+"""Share the state tensors of the graphs built from one module, and measure
+the memory each graph holds on its own.
+
+The parameters of a module are shared by all its graphs, but each graph also
+holds tensors made at compile time, e.g. the NHWC-transposed conv weights of
+constant folding. Graphs of several input structures hold equal copies of them.
+"""
+import re
+from typing import Dict, Iterable, Tuple
+
+import oneflow as flow  # usort: skip
+
+from onediff.utils import logger
+
+__all__ = ["share_graph_states", "get_graph_memory_report", "get_graph_state_bytes"]
+
+
+def _normalize_state_name(name: str) -> str:
+    # Compile-time states get a numeric suffix that differs between graphs,
+    # e.g. 'variable_transpose_model.conv_in.weight_239'
+    return re.sub(r"_[0-9]+$", "", name)
+
+
+def _state_key(name: str, tensor: flow.Tensor) -> Tuple:
+    return (
+        _normalize_state_name(name),
+        tuple(tensor.shape),
+        str(tensor.dtype),
+        str(tensor.device),
+    )
+
+
+def share_graph_states(state_dict: Dict, shared_states: Dict) -> int:
+    """Replaces the state tensors of `state_dict` with equal tensors of other
+    graphs of the same module, in place.
+
+    `shared_states` maps the states of the graphs loaded before, and is
+    updated with the new ones.
+
+    Returns the number of bytes saved.
+    """
+    saved_bytes = 0
+    for graph_state in state_dict.values():
+        if not isinstance(graph_state, dict) or "states" not in graph_state:
+            continue
+        states = graph_state["states"]
+        for name, tensor in states.items():
+            if not isinstance(tensor, flow.Tensor):
+                continue
+            key = _state_key(name, tensor)
+            shared = shared_states.get(key)
+            if shared is None:
+                shared_states[key] = tensor
+            elif shared is not tensor and flow.equal(shared, tensor):
+                states[name] = shared
+                saved_bytes += tensor.nelement() * tensor.element_size()
+    if saved_bytes > 0:
+        logger.info(f"Shared {saved_bytes} bytes of graph states with other graphs")
+    return saved_bytes
+
+
+def _storage_ptr(tensor) -> int:
+    return flow.utils.tensor.to_torch(tensor).data_ptr()
+
+
+def get_graph_state_bytes(graph) -> int:
+    """Returns the bytes of the state tensors of `graph` apart from the
+    parameters and buffers of its module, i.e. the memory its eviction frees.
+    """
+    module = graph.model.to(flow.nn.Module)
+    module_tensors = list(module.parameters()) + list(module.buffers())
+    module_ptrs = {_storage_ptr(tensor) for tensor in module_tensors}
+    sizes = {}
+    for tensor in graph._c_nn_graph.get_runtime_var_states()[1]:
+        ptr = _storage_ptr(tensor)
+        if ptr not in module_ptrs:
+            sizes[ptr] = tensor.nelement() * tensor.element_size()
+    return sum(sizes.values())
+
+
+def get_graph_memory_report(graphs: Dict[str, object], module_tensors: Iterable):
+    """Returns the bytes of state tensors held by each graph.
+
+    For each graph, `total_bytes` counts all its state tensors, `shared_bytes`
+    the ones shared with the module or other graphs, and `unique_bytes` the
+    ones only this graph holds. The module parameters and buffers are given by
+    `module_tensors` as torch tensors.
+    """
+    module_ptrs = {tensor.data_ptr() for tensor in module_tensors}
+    graph_ptrs = {}
+    for key, graph in graphs.items():
+        if graph is None or not graph.is_compiled:
+            continue
+        ptrs = {}
+        for tensor in graph._c_nn_graph.get_runtime_var_states()[1]:
+            ptrs[_storage_ptr(tensor)] = tensor.nelement() * tensor.element_size()
+        graph_ptrs[key] = ptrs
+
+    report = {}
+    for key, ptrs in graph_ptrs.items():
+        other_ptrs = set(module_ptrs)
+        for other_key, other in graph_ptrs.items():
+            if other_key != key:
+                other_ptrs.update(other.keys())
+        total = sum(ptrs.values())
+        unique = sum(size for ptr, size in ptrs.items() if ptr not in other_ptrs)
+        report[key] = {
+            "total_bytes": total,
+            "shared_bytes": total - unique,
+            "unique_bytes": unique,
+        }
+    return report
@@ -0,0 +1,176 @@
+"""Store the weights of graph files apart from the compiled plans.
+
+The tensors in the "states" of each graph are written once per content digest
+into a weights directory shared by all graph files, and the graph file keeps a
+reference to them. On load, references to weights already resident in the
+module are bound to those instead of being read from disk.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, Optional, Set
+
+import torch
+import oneflow as flow  # usort: skip
+
+from onediff.utils import logger
+
+__all__ = [
+    "WEIGHTS_DIR_NAME",
+    "get_weights_dir",
+    "externalize_weights",
+    "resolve_weights",
+    "get_weight_digests",
+    "copy_weights",
+    "get_weight_path",
+    "remove_weights",
+]
+
+WEIGHTS_DIR_NAME = "onediff_graph_weights"
+_WEIGHT_REF_KEY = "__onediff_weight_ref__"
+
+
+def get_weights_dir(graph_file: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(graph_file)), WEIGHTS_DIR_NAME)
+
+
+def _is_weight_ref(value) -> bool:
+    return isinstance(value, dict) and _WEIGHT_REF_KEY in value
+
+
+def _tensor_digest(tensor: flow.Tensor) -> str:
+    # Hash the raw bytes, as numpy has no bfloat16
+    data = flow.utils.tensor.to_torch(tensor.detach().cpu().contiguous())
+    hasher = hashlib.sha256()
+    hasher.update(f"{tensor.dtype}_{tuple(tensor.shape)}".encode("utf-8"))
+    hasher.update(data.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def get_weight_path(weights_dir: str, digest: str) -> str:
+    return os.path.join(weights_dir, f"{digest}.weight")
+
+
+def remove_weights(weights_dir: str, digests: Iterable[str]) -> None:
+    for digest in digests:
+        path = get_weight_path(weights_dir, digest)
+        if os.path.exists(path):
+            logger.debug(f"Remove unreferenced graph weight {path}")
+            os.remove(path)
+
+
+def _write_weight(weights_dir: str, digest: str, tensor: flow.Tensor) -> int:
+    path = get_weight_path(weights_dir, digest)
+    if os.path.exists(path):
+        return 0
+    tmp_dir = tempfile.mkdtemp(dir=weights_dir, prefix=".tmp_")
+    try:
+        tmp_path = os.path.join(tmp_dir, "weight")
+        flow.save(tensor.detach().cpu(), tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return tensor.nelement() * tensor.element_size()
+
+
+def externalize_weights(state_dict: Dict, weights_dir: str) -> Dict:
+    """Writes the states of each graph into `weights_dir` by content digest.
+
+    Returns a copy of `state_dict` with the states replaced by references.
+    Tensors with the same content are written once, also across calls.
+    """
+    os.makedirs(weights_dir, exist_ok=True)
+    written_bytes = 0
+    out = {}
+    for graph_name, graph_state in state_dict.items():
+        if not isinstance(graph_state, dict) or "states" not in graph_state:
+            out[graph_name] = graph_state
+            continue
+        states = {}
+        for name, tensor in graph_state["states"].items():
+            if not isinstance(tensor, flow.Tensor):
+                states[name] = tensor
+                continue
+            digest = _tensor_digest(tensor)
+            written_bytes += _write_weight(weights_dir, digest, tensor)
+            states[name] = {
+                _WEIGHT_REF_KEY: digest,
+                "shape": tuple(tensor.shape),
+                "dtype": str(tensor.dtype),
+                "device": str(tensor.device),
+            }
+        out[graph_name] = dict(graph_state, states=states)
+    logger.debug(f"Wrote {written_bytes} bytes of new weights to {weights_dir}")
+    return out
+
+
+def _resident_name(state_name: str) -> str:
+    # Graph states are named after the graph attribute holding the model
+    return (
+        state_name[len("model.") :] if state_name.startswith("model.") else state_name
+    )
+
+
+def resolve_weights(
+    state_dict: Dict,
+    weights_dir: str,
+    resident: Optional[Dict[str, flow.Tensor]] = None,
+) -> Dict:
+    """Replaces the weight references in `state_dict` with tensors, in place.
+
+    A reference is bound to the tensor of the same name, shape and dtype in
+    `resident` if there is one, otherwise it is read from `weights_dir`.
+    """
+    resident = resident or {}
+    loaded = {}
+    bound = 0
+    for graph_state in state_dict.values():
+        if not isinstance(graph_state, dict) or "states" not in graph_state:
+            continue
+        states = graph_state["states"]
+        for name, value in states.items():
+            if not _is_weight_ref(value):
+                continue
+            tensor = resident.get(_resident_name(name))
+            if (
+                tensor is not None
+                and tuple(tensor.shape) == tuple(value["shape"])
+                and str(tensor.dtype) == value["dtype"]
+            ):
+                states[name] = tensor
+                bound += 1
+                continue
+            digest = value[_WEIGHT_REF_KEY]
+            if digest not in loaded:
+                path = get_weight_path(weights_dir, digest)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Graph weight {path} does not exist")
+                loaded[digest] = flow.load(path).to(value["device"])
+            states[name] = loaded[digest]
+    logger.debug(
+        f"Bound {bound} resident weights, read {len(loaded)} weights from {weights_dir}"
+    )
+    return state_dict
+
+
+def get_weight_digests(state_dict: Dict) -> Set[str]:
+    digests = set()
+    for graph_state in state_dict.values():
+        if not isinstance(graph_state, dict) or "states" not in graph_state:
+            continue
+        for value in graph_state["states"].values():
+            if _is_weight_ref(value):
+                digests.add(value[_WEIGHT_REF_KEY])
+    return digests
+
+
+def copy_weights(digests: Iterable[str], src_dir: str, dst_dir: str) -> None:
+    """Copies the weights of `digests` from `src_dir` to `dst_dir`."""
+    if os.path.abspath(src_dir) == os.path.abspath(dst_dir):
+        return
+    os.makedirs(dst_dir, exist_ok=True)
+    for digest in digests:
+        dst = get_weight_path(dst_dir, digest)
+        if not os.path.exists(dst):
+            shutil.copyfile(get_weight_path(src_dir, digest), dst)
@@ -13,6 +13,7 @@ from oneflow.mock_torch.mock_importer import _importer
 
 from onediff.utils import logger
 from .import_module_utils import import_module_from_path
+from .mock_cache import get_mock_cache, get_package_version
 from .patch_for_compiler import *
 
 __all__ = ["DynamicMockModule"]
@@ -78,7 +79,9 @@ def getattr_from_module_name(module, module_name: str):
     return sub_module
 
 
-def _update_module(full_names, main_pkg_enable_context):
+def _find_module_updates(full_names, main_pkg_enable_context):
+    """Returns the `[module_key, module_path]` of the attributes that differ
+    between the mocked and the original modules."""
     with main_pkg_enable_context():
         original_results = inspect_modules_and_attributes(full_names)
 
@@ -86,6 +89,7 @@ def _update_module(full_names, main_pkg_enable_context):
 
     torch_path = os.path.dirname(torch.__file__)
 
+    updates = []
     for module_key, (module_path, module_code) in updated_results.items():
         org_module_path, org_module_code = original_results.get(
             module_key, (module_path, module_code)
@@ -95,25 +99,46 @@ def _update_module(full_names, main_pkg_enable_context):
             # Skip torch module Because torch module is already mocked by oneflow
             if torch_path in module_path:
                 continue
+            updates.append([module_key, module_path])
+    return updates
+
+
+def _apply_module_updates(updates, main_pkg_enable_context):
+    for module_key, module_path in updates:
+        # Update module inplace
+        module_name, attr_name = module_key.split(";")
+        # sample_module = importlib.import_module(module_name).__dict__[attr_name]
+        good_module = _get_module(module_name)
+        sample_module = getattr(good_module, attr_name)
+        package_space = inspect.getmodule(sample_module).__name__
+        with main_pkg_enable_context():
+            module = _get_module(module_name)
+            if package_space == "__main__":
+                other = import_module_from_path(module_path)
+            else:
+                other = importlib.import_module(package_space)
+
+            value = getattr_from_module_name(other, module_name=str(sample_module))
+            if value is None:
+                continue
 
-            # Update module inplace
-            module_name, attr_name = module_key.split(";")
-            # sample_module = importlib.import_module(module_name).__dict__[attr_name]
-            good_module = _get_module(module_name)
-            sample_module = getattr(good_module, attr_name)
-            package_space = inspect.getmodule(sample_module).__name__
-            with main_pkg_enable_context():
-                module = _get_module(module_name)
-                if package_space == "__main__":
-                    other = import_module_from_path(module_path)
-                else:
-                    other = importlib.import_module(package_space)
+            setattr(module, attr_name, value)
 
-                value = getattr_from_module_name(other, module_name=str(sample_module))
-                if value is None:
-                    continue
 
-                setattr(module, attr_name, value)
+def _update_module(full_names, main_pkg_enable_context, main_pkg=None):
+    # Inspecting all attributes of the modules twice is the slow part, its
+    # result only depends on the version of the package
+    mock_cache = get_mock_cache() if main_pkg is not None else None
+    version = get_package_version(main_pkg) if mock_cache is not None else None
+    if version is None:
+        updates = _find_module_updates(full_names, main_pkg_enable_context)
+    else:
+        key = ";".join(full_names[:1] + sorted(full_names[1:]))
+        updates = mock_cache.get_module_updates(key, version)
+        if updates is None:
+            updates = _find_module_updates(full_names, main_pkg_enable_context)
+            mock_cache.set_module_updates(key, version, updates)
+    _apply_module_updates(updates, main_pkg_enable_context)
 
 
 class DynamicMockModule(ModuleType):
@@ -188,7 +213,9 @@ class DynamicMockModule(ModuleType):
         try:
             # Update obj_entity inplace
             if not _importer.enable:
-                _update_module([fullname] + org_delete_list, self._main_pkg_enable)
+                _update_module(
+                    [fullname] + org_delete_list, self._main_pkg_enable, self._pkg_name
+                )
         except Exception as e:
             logger.debug(f"Failed to update obj_entity in place. Exception: {e}")
 
@@ -11,18 +11,32 @@ from typing import Optional, Union
 from onediff.utils import logger
 from .dyn_mock_mod import DynamicMockModule
 from .format_utils import MockEntityNameFormatter
+from .mock_cache import get_mock_cache, get_package_version
 
 __all__ = ["LazyMocker", "is_need_mock"]
 
-# Cache all imported modules (maxsize=None: no limit)
-@lru_cache(maxsize=None)
-def has_torch_dependency(main_pkg: str):
+
+def _requires_torch(main_pkg: str) -> bool:
     try:
         pkgs = requires(main_pkg)
     except Exception as e:
         # packages may lack metadata
         return False
-    return any(pkg.split(" ")[0] == "torch" for pkg in pkgs)
+    return pkgs is not None and any(pkg.split(" ")[0] == "torch" for pkg in pkgs)
+
+
+# Cache all imported modules (maxsize=None: no limit)
+@lru_cache(maxsize=None)
+def has_torch_dependency(main_pkg: str):
+    mock_cache = get_mock_cache()
+    version = get_package_version(main_pkg) if mock_cache is not None else None
+    if version is None:
+        return _requires_torch(main_pkg)
+    verdict = mock_cache.get_torch_dependency(main_pkg, version)
+    if verdict is None:
+        verdict = _requires_torch(main_pkg)
+        mock_cache.set_torch_dependency(main_pkg, version, verdict)
+    return verdict
 
 
 def is_need_mock(cls) -> bool:
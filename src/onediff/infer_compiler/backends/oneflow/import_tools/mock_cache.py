@@ -0,0 +1,154 @@
+"""An on-disk cache of the results of mocking packages, shared by processes.
+
+Mocking a package for oneflow inspects its metadata and its modules, with
+results that only change with the versions of the packages involved. The
+cache stores:
+
+- whether a package depends on torch, by package and version;
+- the attributes of mocked modules that need updating in place, by module
+  and version of the package they belong to.
+
+The classes themselves are created by importing the packages under the mock,
+in every process. The cache file is named after the python, torch, oneflow
+and onediff versions, so any upgrade starts a new one. Set
+`ONEDIFF_MOCK_CACHE=0` to disable it and `ONEDIFF_MOCK_CACHE_DIR` to move it.
+"""
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional
+
+from onediff.utils import logger, parse_boolean_from_env
+
+__all__ = ["MockCache", "get_mock_cache", "get_package_version"]
+
+MOCK_CACHE_VERSION = 1
+
+
+def get_package_version(package: str) -> Optional[str]:
+    module = sys.modules.get(package)
+    version = getattr(module, "__version__", None)
+    if isinstance(version, str):
+        return version
+    try:
+        from importlib.metadata import version as metadata_version
+
+        return metadata_version(package)
+    except Exception:
+        return None
+
+
+class MockCache:
+    """The cache entries of one environment, stored in a JSON file.
+
+    Entries added are written by `save`, merged with the ones other processes
+    wrote in the meantime.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = False
+
+    def _load(self) -> Dict[str, Dict]:
+        entries = {"torch_dependency": {}, "module_updates": {}}
+        if not os.path.isfile(self.file_path):
+            return entries
+        try:
+            with open(self.file_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring mock cache {self.file_path}: {e}")
+            return entries
+        if data.get("cache_version") != MOCK_CACHE_VERSION:
+            return entries
+        for name in entries:
+            entries[name].update(data.get(name, {}))
+        return entries
+
+    def _get(self, name: str, key: str, version: str):
+        entry = self._entries[name].get(key)
+        if entry is None or entry["version"] != version:
+            return None
+        return entry["value"]
+
+    def _set(self, name: str, key: str, version: str, value) -> None:
+        with self._lock:
+            self._entries[name][key] = {"version": version, "value": value}
+            self._dirty = True
+
+    def get_torch_dependency(self, package: str, version: str) -> Optional[bool]:
+        return self._get("torch_dependency", package, version)
+
+    def set_torch_dependency(self, package: str, version: str, value: bool) -> None:
+        self._set("torch_dependency", package, version, value)
+
+    def get_module_updates(self, key: str, version: str) -> Optional[List[List[str]]]:
+        return self._get("module_updates", key, version)
+
+    def set_module_updates(
+        self, key: str, version: str, updates: List[List[str]]
+    ) -> None:
+        self._set("module_updates", key, version, updates)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = self._load()
+            for name, values in self._entries.items():
+                entries[name].update(values)
+            data = {"cache_version": MOCK_CACHE_VERSION, **entries}
+            tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f, indent=1, sort_keys=True)
+                os.replace(tmp_path, self.file_path)
+            except OSError as e:
+                logger.warning(f"Failed to save mock cache {self.file_path}: {e}")
+                return
+            self._entries = entries
+            self._dirty = False
+
+
+def _get_environment_key() -> str:
+    import oneflow as flow  # usort: skip
+    import torch
+
+    from onediff import __version__ as onediff_version
+
+    environment = [
+        sys.version.split(" ")[0],
+        torch.__version__,
+        flow.__version__,
+        onediff_version,
+    ]
+    return hashlib.sha1("|".join(environment).encode()).hexdigest()[:16]
+
+
+_MOCK_CACHE = None
+_MOCK_CACHE_LOCK = threading.Lock()
+
+
+def get_mock_cache() -> Optional[MockCache]:
+    """Returns the mock cache of this environment, or None if disabled."""
+    global _MOCK_CACHE
+    if not parse_boolean_from_env("ONEDIFF_MOCK_CACHE", True):
+        return None
+    with _MOCK_CACHE_LOCK:
+        if _MOCK_CACHE is None:
+            cache_dir = os.getenv(
+                "ONEDIFF_MOCK_CACHE_DIR",
+                os.path.join(os.path.expanduser("~"), ".cache", "onediff", "mock"),
+            )
+            file_path = os.path.join(
+                cache_dir, f"mock_cache_{_get_environment_key()}.json"
+            )
+            _MOCK_CACHE = MockCache(file_path)
+            atexit.register(_MOCK_CACHE.save)
+        return _MOCK_CACHE
@@ -18,7 +18,22 @@ def compile(torch_module: torch.nn.Module, *, options=None):
         - 'debug' which config the nn.Graph debug level, default -1(no debug info), max 3(max debug info).
         - 'size' which config the cache size when cache is enabled. Note that after onediff v0.12, cache is default disabled.
         - 'graph_file' (None) generates a compilation cache file. If the file exists, loading occurs; if not, the compilation result is saved after the first run.
+                     Graph files are kept in the directory of 'graph_file' and indexed by a manifest keyed by model, input structure, versions and device.
         - 'graph_file_device' (None) sets the device for the graph file, default None.  If set, the compilation result will be converted to the specified device.
+        - 'shape_buckets' (None) a list of (height, width, batch) buckets of the latent input. If set, inputs are padded to the nearest bucket
+                     and outputs are cropped back, which caps the number of distinct shapes a graph is built for.
+                     Zero padding is seen by attention and GroupNorm, so results differ slightly from an unpadded run.
+        - 'shape_bucket_batch_inputs' (None) the names of the arguments padded on the batch when 'shape_buckets' is set,
+                     defaults to the ones of diffusers UNets, ControlNets and VAEs.
+        - 'graph_file_cache_max_bytes' (None) bounds the total size of graph files in the directory of 'graph_file', least recently used files are evicted first.
+        - 'graph_cache_max_bytes' (None) bounds the device memory held by the graphs cached by all deployable modules of the process.
+                     Graphs that are cheap to rebuild, rarely used and large are evicted first. See `get_graph_cache_stats()`.
+        - 'graph_file_shared_weights' (False) stores the weights of graph files by content digest in a directory next to them, shared by all graph files,
+                     and binds them to the weights of the module on load.
+        - 'share_graph_states' (False) makes the graphs loaded for one module share equal state tensors, such as constant folded conv weights,
+                     instead of holding a copy each. See `get_graph_memory_report()` for the memory each graph holds on its own.
+        - 'async_compile' (False) builds the graph of a new input structure on a background thread, and runs the calls eagerly until it is ready.
+        - 'max_async_compile_workers' (1) the maximum number of graphs built in background at the same time in the process.
     """
     from ..env_var import (
         OneflowCompileOptions,
@@ -32,10 +47,8 @@ def compile(torch_module: torch.nn.Module, *, options=None):
         init_state_update_attr,
         state_update_hook,
     )
-    from .transform.custom_transform import set_default_registry
 
     set_oneflow_default_env_vars()
-    set_default_registry()
 
     options = options if options is not None else OneflowCompileOptions()
     set_oneflow_env_vars(options)
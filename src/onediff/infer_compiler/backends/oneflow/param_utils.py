@@ -1,11 +1,15 @@
+import collections
 import re
+import threading
+import time
 import types
+from contextlib import nullcontext
 
 import torch
 import oneflow as flow  # usort: skip
 from typing import Any, Dict, List, Union
 
-from onediff.utils import logger
+from onediff.utils import logger, trace_span
 
 
 def parse_device(args: List[Any], kwargs: Dict[str, Any]):
@@ -37,6 +41,7 @@ def check_device(current_device, target_device) -> bool:
 STATE_UPDATED_ATTR = "_onediff_state_updated"
 CONSTANT_FOLDING_INFO_ATTR = "_onediff_constant_folding_info"
 GRAPH_RELATED_TENSOR_ATTR = "_onediff_graph_related_tensor"
+FOLDED_WEIGHT_STAMP_ATTR = "_onediff_folded_weight_stamp"
 
 
 def init_state_update_attr(module: torch.nn.Module):
@@ -79,6 +84,7 @@ def set_constant_folded_conv_attr(
         object.__setattr__(submodule, GRAPH_RELATED_TENSOR_ATTR, weight_tensor)
 
 
+@trace_span("constant_folding_generate")
 def generate_constant_folding_info(
     deployable_module, torch_module: torch.nn.Module = None
 ) -> Dict[str, flow.Tensor]:
@@ -105,11 +111,16 @@ def generate_constant_folding_info(
     if graph is None:
         raise RuntimeError(f"The graph of deployable_module is not built yet")
 
-    result = {
-        convert_var_name(k): v
-        for k, v in zip(*graph._c_nn_graph.get_runtime_var_states())
-        if k.startswith("variable_transpose_") and v.ndim == 4
-    }
+    result = {}
+    for k, v in zip(*graph._c_nn_graph.get_runtime_var_states()):
+        if not k.startswith("variable_transpose_") or v.ndim != 4:
+            continue
+        name = convert_var_name(k)
+        # Only conv weights are refreshed, other 4-D variables such as the
+        # buffers of LoRA side branches are not parameters of a Conv2d
+        if not name.endswith(".weight"):
+            continue
+        result[name] = v
 
     setattr(deployable_module, CONSTANT_FOLDING_INFO_ATTR, result)
 
@@ -131,9 +142,98 @@ def generate_constant_folding_info(
         module.weight.copy_ = types.MethodType(make_custom_copy_(module), module.weight)
 
 
+# Counters of the refreshes of constant folded conv weights
+_CONSTANT_FOLDING_STATS = {
+    "refreshes": 0,
+    "refolded": 0,
+    "skipped": 0,
+    "batches": 0,
+    "seconds": 0.0,
+}
+# Bound the extra memory taken by the stacked weights of one batch
+_REFOLD_BATCH_BYTES = 256 << 20
+# Conv2d modules with a changed weight, refolded by flush_graph_related_tensors
+_PENDING_REFOLDS: Dict[int, torch.nn.Conv2d] = {}
+_PENDING_REFOLDS_LOCK = threading.Lock()
+_REFOLD_STREAMS = {}
+
+
+def get_constant_folding_stats() -> Dict[str, Union[int, float]]:
+    """Returns the counters of the refreshes of constant folded conv weights.
+
+    `refolded` and `skipped` count the weights refolded and the weights left
+    untouched as unchanged, `batches` the grouped permute/copy launches, and
+    `seconds` the time spent.
+    """
+    return dict(_CONSTANT_FOLDING_STATS)
+
+
+def reset_constant_folding_stats() -> None:
+    for k in _CONSTANT_FOLDING_STATS:
+        _CONSTANT_FOLDING_STATS[k] = 0 if k != "seconds" else 0.0
+
+
+def _weight_stamp(weight: torch.Tensor):
+    # `.data` writes bypass the version counter, they are tracked by
+    # update_graph_related_tensor instead
+    return (weight.data_ptr(), weight._version)
+
+
+def _get_refold_stream(device: torch.device):
+    if device.type != "cuda":
+        return None
+    stream = _REFOLD_STREAMS.get(device)
+    if stream is None:
+        stream = torch.cuda.Stream(device=device)
+        _REFOLD_STREAMS[device] = stream
+    return stream
+
+
+def _refold_batch(
+    weights: List[torch.Tensor], targets: List[flow.Tensor], stream
+) -> None:
+    with torch.cuda.stream(stream) if stream is not None else nullcontext():
+        permuted = torch.stack(weights).permute(0, 1, 3, 4, 2).contiguous()
+    if stream is not None:
+        # oneflow streams do not wait for torch streams
+        stream.synchronize()
+    # The copies are issued by oneflow, so they are ordered with the graph runs
+    # reading the targets
+    for target, src in zip(targets, permuted.unbind(0)):
+        target.copy_(flow.utils.tensor.from_torch(src))
+
+
+def _refold(weights: List[torch.Tensor], targets: List[flow.Tensor]) -> None:
+    """Permutes `weights` to NHWC into `targets`, grouped by shape and dtype."""
+    groups = collections.defaultdict(list)
+    for weight, target in zip(weights, targets):
+        groups[(tuple(weight.shape), weight.dtype, weight.device)].append(
+            (weight.detach(), target)
+        )
+
+    for (shape, dtype, device), pairs in groups.items():
+        stream = _get_refold_stream(device)
+        weight_bytes = pairs[0][0].nelement() * pairs[0][0].element_size()
+        batch_size = max(_REFOLD_BATCH_BYTES // max(weight_bytes, 1), 1)
+        if stream is not None:
+            stream.wait_stream(torch.cuda.current_stream(device))
+        for i in range(0, len(pairs), batch_size):
+            batch = pairs[i : i + batch_size]
+            _refold_batch([w for w, _ in batch], [t for _, t in batch], stream)
+            _CONSTANT_FOLDING_STATS["batches"] += 1
+
+
+@trace_span("constant_folding_update")
 def update_graph_with_constant_folding_info(
-    module: torch.nn.Module, info: Dict[str, flow.Tensor] = None
+    module: torch.nn.Module, info: Dict[str, flow.Tensor] = None, only_dirty=False
 ) -> None:
+    """Refreshes the constant folded conv weights of the graph from the torch
+    module.
+
+    With `only_dirty`, weights unchanged since the last refresh are skipped.
+    Changes made through `.data` are not seen by this check, and must be
+    reported with `update_graph_related_tensor`.
+    """
     from onediff.infer_compiler import DeployableModule
 
     if isinstance(module, DeployableModule):
@@ -143,25 +243,71 @@ def update_graph_with_constant_folding_info(
     if info is None:
         return
 
+    flush_graph_related_tensors()
+    start_time = time.perf_counter()
+    weights, targets = [], []
     for k in info:
         orig_tensor = module.get_parameter(k)
         target_tensor = info.get(k, None)
         if target_tensor is None:
             raise RuntimeError(f"Can't find tensor named {k} in graph")
-        target_tensor.copy_(
-            flow.utils.tensor.from_torch(orig_tensor.permute(0, 2, 3, 1))
-        )
+        submodule = module.get_submodule(removesuffix(k, ".weight"))
+        stamp = _weight_stamp(orig_tensor)
+        if only_dirty and getattr(submodule, FOLDED_WEIGHT_STAMP_ATTR, None) == stamp:
+            _CONSTANT_FOLDING_STATS["skipped"] += 1
+            continue
+        weights.append(orig_tensor)
+        targets.append(target_tensor)
+        object.__setattr__(submodule, FOLDED_WEIGHT_STAMP_ATTR, stamp)
+
+    _refold(weights, targets)
+    _CONSTANT_FOLDING_STATS["refreshes"] += 1
+    _CONSTANT_FOLDING_STATS["refolded"] += len(weights)
+    _CONSTANT_FOLDING_STATS["seconds"] += time.perf_counter() - start_time
 
 
 def update_graph_related_tensor(module: torch.nn.Conv2d) -> None:
+    """Marks the weight of `module` as changed.
+
+    The constant folded weight of the graph is refolded, batched with the
+    other changed weights, before the next call of a deployable module or by
+    `flush_graph_related_tensors`.
+    """
     if not isinstance(module, torch.nn.Conv2d):
         return
-    target_tensor = getattr(module, GRAPH_RELATED_TENSOR_ATTR, None)
-    if target_tensor is None:
+    if getattr(module, GRAPH_RELATED_TENSOR_ATTR, None) is None:
         return
-    target_tensor.copy_(
-        flow.utils.tensor.from_torch(module.weight.data.permute(0, 2, 3, 1))
-    )
+    with _PENDING_REFOLDS_LOCK:
+        _PENDING_REFOLDS[id(module)] = module
+
+
+def has_pending_graph_related_tensors() -> bool:
+    return len(_PENDING_REFOLDS) > 0
+
+
+@trace_span("constant_folding_refold")
+def flush_graph_related_tensors() -> None:
+    """Refolds the weights marked by `update_graph_related_tensor`."""
+    with _PENDING_REFOLDS_LOCK:
+        if len(_PENDING_REFOLDS) == 0:
+            return
+        modules = list(_PENDING_REFOLDS.values())
+        _PENDING_REFOLDS.clear()
+
+    start_time = time.perf_counter()
+    weights, targets = [], []
+    for module in modules:
+        target_tensor = getattr(module, GRAPH_RELATED_TENSOR_ATTR, None)
+        if target_tensor is None:
+            continue
+        weights.append(module.weight)
+        targets.append(target_tensor)
+        object.__setattr__(
+            module, FOLDED_WEIGHT_STAMP_ATTR, _weight_stamp(module.weight)
+        )
+    _refold(weights, targets)
+    _CONSTANT_FOLDING_STATS["refolded"] += len(weights)
+    _CONSTANT_FOLDING_STATS["seconds"] += time.perf_counter() - start_time
 
 
 def get_constant_folding_info(module) -> Union[Dict[str, flow.Tensor], None]:
@@ -202,7 +348,9 @@ def forward_pre_check_and_update_state_hook(module, args):
         return
 
     logger.info(f"state_dict updated, modify the related weight in graph")
-    update_graph_with_constant_folding_info(module, constant_folding_info)
+    update_graph_with_constant_folding_info(
+        module, constant_folding_info, only_dirty=True
+    )
     setattr(module._torch_module, STATE_UPDATED_ATTR, False)
 
 
@@ -0,0 +1,253 @@
+"""Pad inputs to a fixed set of shapes so that graphs are only built for those shapes.
+
+The first 4D (or higher) tensor found in the inputs is taken as the latent, and
+its (height, width, batch) is rounded up to the smallest declared bucket that
+can hold it.
+
+- Spatial: 4D (or higher) tensors whose size is the latent's scaled up or down
+  by a power of two, like the 8x `controlnet_cond` of a ControlNet or the
+  downsampled `down_block_additional_residuals` of a UNet, are zero-padded on
+  the bottom and right to the bucket scaled the same way. Outputs scaled that
+  way, like the 8x images of a VAE decoder, are cropped back.
+- Batch: only the tensors of the declared batch inputs, `batch_inputs`, are
+  padded by repeating their last sample. Outputs with the bucket's batch size
+  are cropped back.
+
+Padding is not free of side effects: attention and GroupNorm see the zero
+padded region, so results inside the cropped region differ slightly from an
+unpadded run.
+"""
+import inspect
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from oneflow.framework.args_tree import ArgsTree
+
+from onediff.utils import logger
+
+__all__ = ["ShapeBucketer"]
+
+Bucket = Tuple[int, int, int]
+
+# The inputs of diffusers UNets, ControlNets and VAEs whose first dim is the batch
+DEFAULT_BATCH_INPUTS = (
+    "sample",
+    "timestep",
+    "encoder_hidden_states",
+    "class_labels",
+    "timestep_cond",
+    "attention_mask",
+    "encoder_attention_mask",
+    "added_cond_kwargs",
+    "controlnet_cond",
+    "down_block_additional_residuals",
+    "mid_block_additional_residual",
+    "down_intrablock_additional_residuals",
+    "z",
+)
+
+# Spatial sizes are matched to the latent's scaled by these factors
+_SCALES = tuple(2**i for i in range(7))
+
+
+class _PadInfo:
+    __slots__ = ["height", "width", "batch", "bucket"]
+
+    def __init__(self, height: int, width: int, batch: int, bucket: Bucket):
+        self.height = height
+        self.width = width
+        self.batch = batch
+        self.bucket = bucket
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def _scale_size(size: Tuple[int, int], height: int, width: int, bucket: Bucket):
+    """Returns the size of the bucket scaled as `size` is from (height, width).
+
+    Downsampling rounds up, as strided convolutions with padding do. Returns
+    None if `size` is not a power of two scale of (height, width).
+    """
+    for scale in _SCALES:
+        if size == (height * scale, width * scale):
+            return bucket[0] * scale, bucket[1] * scale
+        if size == (_ceil_div(height, scale), _ceil_div(width, scale)):
+            return _ceil_div(bucket[0], scale), _ceil_div(bucket[1], scale)
+    return None
+
+
+def _map_tensors(value, fn):
+    def leaf_fn(leaf):
+        return fn(leaf) if isinstance(leaf, torch.Tensor) else leaf
+
+    return ArgsTree((value, None), False, tensor_type=torch.Tensor).map_leaf(leaf_fn)[0]
+
+
+def _find_latent(args, kwargs) -> Optional[torch.Tensor]:
+    args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
+    for node in args_tree.iter_nodes():
+        if isinstance(node, torch.Tensor) and node.ndim >= 4:
+            return node
+    return None
+
+
+class ShapeBucketer:
+    """Maps input shapes to a declared set of (height, width, batch) buckets.
+
+    Args:
+        buckets (Iterable[Tuple[int, int, int]]): The (height, width, batch)
+            buckets, in the units of the latent tensor (e.g. 128x128 for a
+            1024x1024 SDXL image).
+        batch_inputs (Iterable[str], optional): The names of the arguments
+            whose tensors have the batch as first dim. Defaults to the ones
+            of diffusers UNets, ControlNets and VAEs.
+    """
+
+    def __init__(
+        self, buckets: Iterable[Bucket], batch_inputs: Optional[Iterable[str]] = None
+    ):
+        buckets = [tuple(int(x) for x in bucket) for bucket in buckets]
+        for bucket in buckets:
+            if len(bucket) != 3:
+                raise ValueError(
+                    f"Shape bucket must be (height, width, batch), got {bucket}"
+                )
+        # Smallest buckets first, so the first fitting one wastes the least compute
+        self.buckets = sorted(set(buckets), key=lambda b: (b[0] * b[1] * b[2], b))
+        self._stats: Dict[Any, Dict[str, int]] = OrderedDict(
+            (bucket, {"hits": 0, "misses": 0}) for bucket in self.buckets
+        )
+        self._stats["unbucketed"] = {"hits": 0, "misses": 0}
+        self._seen = set()
+        self.batch_inputs = frozenset(
+            DEFAULT_BATCH_INPUTS if batch_inputs is None else batch_inputs
+        )
+        self._signatures: Dict[Any, Optional[inspect.Signature]] = {}
+
+    def find_bucket(self, height: int, width: int, batch: int) -> Optional[Bucket]:
+        for bucket in self.buckets:
+            if bucket[0] >= height and bucket[1] >= width and bucket[2] >= batch:
+                return bucket
+        return None
+
+    def _record(self, stats_key, shape_key) -> None:
+        if shape_key in self._seen:
+            self._stats[stats_key]["hits"] += 1
+        else:
+            self._seen.add(shape_key)
+            self._stats[stats_key]["misses"] += 1
+
+    def _get_signature(self, fn: Callable) -> Optional[inspect.Signature]:
+        key = getattr(fn, "__func__", fn)
+        if key not in self._signatures:
+            try:
+                self._signatures[key] = inspect.signature(fn)
+            except (TypeError, ValueError):
+                self._signatures[key] = None
+        return self._signatures[key]
+
+    def pad_inputs(self, args, kwargs, fn: Optional[Callable] = None):
+        """Returns padded `args`, `kwargs` and the info needed by `crop_outputs`.
+
+        `fn` is the function called with `args` and `kwargs`, which names
+        the arguments to match `batch_inputs`. Without it, or if they can't be
+        bound, only the latent is padded on the batch.
+        """
+        latent = _find_latent(args, kwargs)
+        if latent is None:
+            return args, kwargs, None
+
+        batch, height, width = latent.shape[0], latent.shape[-2], latent.shape[-1]
+        bucket = self.find_bucket(height, width, batch)
+        if bucket is None:
+            logger.warning(
+                f"No shape bucket fits (height={height}, width={width}, batch={batch}), run it unpadded."
+            )
+            self._record("unbucketed", (height, width, batch))
+            return args, kwargs, None
+
+        self._record(bucket, bucket)
+        info = _PadInfo(height, width, batch, bucket)
+        if bucket == (height, width, batch):
+            return args, kwargs, info
+
+        def pad_spatial(tensor: torch.Tensor):
+            if tensor.ndim < 4 or (bucket[0], bucket[1]) == (height, width):
+                return tensor
+            size = tuple(tensor.shape[-2:])
+            padded_size = _scale_size(size, height, width, bucket)
+            if padded_size is None or padded_size == size:
+                return tensor
+            return F.pad(
+                tensor, (0, padded_size[1] - size[1], 0, padded_size[0] - size[0])
+            )
+
+        def pad_batch(tensor: torch.Tensor):
+            tensor = pad_spatial(tensor)
+            if tensor.ndim >= 1 and tensor.shape[0] == batch and bucket[2] != batch:
+                repeat = tensor[-1:].expand(bucket[2] - batch, *tensor.shape[1:])
+                tensor = torch.cat([tensor, repeat], dim=0)
+            return tensor
+
+        def pad_other(tensor: torch.Tensor):
+            return pad_batch(tensor) if tensor is latent else pad_spatial(tensor)
+
+        def get_pad_fn(name: str):
+            return pad_batch if name in self.batch_inputs else pad_other
+
+        signature = self._get_signature(fn) if fn is not None else None
+        try:
+            bound = signature.bind(*args, **kwargs) if signature else None
+        except TypeError:
+            bound = None
+        if bound is None:
+            return (
+                _map_tensors(args, pad_other),
+                _map_tensors(kwargs, pad_other),
+                info,
+            )
+
+        for name, arg in bound.arguments.items():
+            if signature.parameters[name].kind == inspect.Parameter.VAR_KEYWORD:
+                bound.arguments[name] = {
+                    key: _map_tensors(value, get_pad_fn(key))
+                    for key, value in arg.items()
+                }
+            else:
+                bound.arguments[name] = _map_tensors(arg, get_pad_fn(name))
+        return bound.args, bound.kwargs, info
+
+    def crop_outputs(self, output, info: Optional[_PadInfo]):
+        if info is None or info.bucket == (info.height, info.width, info.batch):
+            return output
+        bucket = info.bucket
+        # Output sizes are matched against the bucket, and cropped to the
+        # input scaled the same way
+        inverse = (info.height, info.width, info.batch)
+
+        def crop_fn(tensor: torch.Tensor):
+            if tensor.ndim >= 4 and (bucket[0], bucket[1]) != (info.height, info.width):
+                size = tuple(tensor.shape[-2:])
+                cropped_size = _scale_size(size, bucket[0], bucket[1], inverse)
+                if cropped_size is not None:
+                    tensor = tensor[..., : cropped_size[0], : cropped_size[1]]
+            if tensor.ndim >= 1 and tensor.shape[0] == bucket[2] != info.batch:
+                tensor = tensor[: info.batch]
+            return tensor
+
+        return _map_tensors(output, crop_fn)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns the hit and miss counters per bucket.
+
+        A miss is the first call landing in a bucket, which builds or warms up
+        a graph for that shape; subsequent calls count as hits.
+        """
+        return {
+            (key if isinstance(key, str) else "x".join(str(x) for x in key)): dict(v)
+            for key, v in self._stats.items()
+        }
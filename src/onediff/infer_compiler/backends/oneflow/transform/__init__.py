@@ -2,9 +2,11 @@
 from .builtin_transform import (
     default_converter,
     get_attr,
+    get_conversion_stats,
     map_args,
     proxy_class,
     ProxySubmodule,
+    reset_conversion_stats,
     torch2oflow,
 )
 from .custom_transform import register
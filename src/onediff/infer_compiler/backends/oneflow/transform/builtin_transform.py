@@ -2,12 +2,14 @@
 
 import importlib
 import os
+import threading
+import time
 import traceback
 import types
 from collections import OrderedDict
 from collections.abc import Iterable
 from functools import partial, singledispatch
-from typing import Any, Union
+from typing import Any, Dict, Union
 
 import torch
 import oneflow as flow  # usort: skip
@@ -26,6 +28,8 @@ __all__ = [
     "get_attr",
     "torch2oflow",
     "default_converter",
+    "get_conversion_stats",
+    "reset_conversion_stats",
 ]
 
 
@@ -193,54 +197,149 @@ def default_converter(obj, verbose=False, *, proxy_cls=None, bypass_check=False)
         return obj
 
 
-@torch2oflow.register
-def _(mod: torch.nn.Module, verbose=False):
-    proxy_md = ProxySubmodule(mod)
-    new_md_cls = proxy_class(type(mod))
+# Attributes that ProxySubmodule resolves specially, even if set on the instance
+_PROXY_SPECIAL_ATTRS = frozenset(
+    (
+        "forward",
+        "_conv_forward",
+        "get_attention_scores",
+        "use_fused_matmul_bias",
+        "generator",
+        "channel_pos",
+    )
+)
+_LEAF_TYPES = frozenset((int, float, str, bool, type(None)))
 
-    def init(self):
-        nonlocal proxy_md
 
-        flow.nn.Module.__init__(self)
+class _ConversionPlan:
+    """The oneflow subclass made for a torch module class, shared by all its
+    instances, with the conversion stats of the class."""
+
+    __slots__ = ["of_mod_cls", "count", "seconds"]
+
+    def __init__(self, of_mod_cls):
+        self.of_mod_cls = of_mod_cls
+        self.count = 0
+        self.seconds = 0.0
+
+
+_CONVERSION_PLANS: Dict[type, _ConversionPlan] = {}
+# Seconds spent converting the children of the modules being converted
+_CONVERSION_STACK = threading.local()
+
+
+def _get_conversion_stack():
+    stack = getattr(_CONVERSION_STACK, "children_seconds", None)
+    if stack is None:
+        stack = _CONVERSION_STACK.children_seconds = []
+    return stack
+
+
+def get_conversion_stats() -> Dict[str, Dict[str, Union[int, float]]]:
+    """Returns the number of modules converted by torch class, and the seconds
+    spent on them excluding their submodules, slowest first."""
+    stats = {
+        f"{cls.__module__}.{cls.__qualname__}": {
+            "count": plan.count,
+            "seconds": plan.seconds,
+        }
+        for cls, plan in _CONVERSION_PLANS.items()
+        if plan.count > 0
+    }
+    return dict(sorted(stats.items(), key=lambda item: -item[1]["seconds"]))
+
+
+def reset_conversion_stats() -> None:
+    for plan in _CONVERSION_PLANS.values():
+        plan.count = 0
+        plan.seconds = 0.0
 
-        self._parameters = OrderedDict()
-        self._buffers = OrderedDict()
-        self._modules = OrderedDict()
-        for n, p in list(proxy_md.named_parameters("", False)):
-            self._parameters[n] = torch2oflow(p)
-        for n, b in list(proxy_md.named_buffers("", False)):
-            self._buffers[n] = flow.utils.tensor.from_torch(b.data)
-        for n, m in proxy_md._modules.items():
-            self._modules[n] = torch2oflow(m)
-
-        for k, _ in proxy_md.__dict__.items():
-            if k not in self.__dict__:
-                attr = getattr(proxy_md, k)
-                try:
-                    self.__dict__[k] = torch2oflow(attr)
-                except Exception as e:
-                    logger.error(f"convert {type(attr)} failed: {e}")
-                    raise NotImplementedError(f"Unsupported type: {type(attr)}")
+
+def _make_of_mod_cls(new_md_cls):
+    def init(self, proxy_md):
+        flow.nn.Module.__init__(self)
+        self.__dict__["_oflow_proxy_md"] = proxy_md
 
     def proxy_getattr(self, attr):
-        nonlocal proxy_md
+        if attr in self._modules:
+            return self._modules[attr]
+        if attr in self._parameters:
+            return self._parameters[attr]
+        elif attr in self._buffers:
+            return self._buffers[attr]
+        else:
+            return getattr(self.__dict__["_oflow_proxy_md"], attr)
+
+    return type(
+        str(new_md_cls), (new_md_cls,), {"__init__": init, "__getattr__": proxy_getattr}
+    )
+
 
+def _get_conversion_plan(cls) -> _ConversionPlan:
+    plan = _CONVERSION_PLANS.get(cls)
+    if plan is None:
+        plan = _ConversionPlan(_make_of_mod_cls(proxy_class(cls)))
+        _CONVERSION_PLANS[cls] = plan
+    return plan
+
+
+def _convert_module_attrs(of_mod, mod, proxy_md):
+    of_mod._parameters = OrderedDict()
+    of_mod._buffers = OrderedDict()
+    of_mod._modules = OrderedDict()
+    # Own parameters and buffers are read directly, without the generators and
+    # dispatch overhead of named_parameters and torch2oflow
+    convert_parameter = torch2oflow.dispatch(torch.nn.parameter.Parameter)
+    seen = set()
+    for n, p in mod._parameters.items():
+        if p is not None and id(p) not in seen:
+            seen.add(id(p))
+            of_mod._parameters[n] = convert_parameter(p)
+    for n, b in mod._buffers.items():
+        if b is not None and id(b) not in seen:
+            seen.add(id(b))
+            of_mod._buffers[n] = flow.utils.tensor.from_torch(b.data)
+    for n, m in mod._modules.items():
+        of_mod._modules[n] = torch2oflow(m)
+
+    of_dict = of_mod.__dict__
+    for k, value in mod.__dict__.items():
+        if k in of_dict:
+            continue
+        if type(value) in _LEAF_TYPES and k not in _PROXY_SPECIAL_ATTRS:
+            of_dict[k] = value
+            continue
+        attr = getattr(proxy_md, k)
         try:
-            return super().__getattribute__(attr)
+            of_dict[k] = torch2oflow(attr)
         except Exception as e:
-            if attr in self._modules:
-                return self._modules[attr]
-            if attr in self._parameters:
-                return self._parameters[attr]
-            elif attr in self._buffers:
-                return self._buffers[attr]
-            else:
-                return getattr(proxy_md, attr)
+            logger.error(f"convert {type(attr)} failed: {e}")
+            raise NotImplementedError(f"Unsupported type: {type(attr)}")
 
-    of_mod_cls = type(
-        str(new_md_cls), (new_md_cls,), {"__init__": init, "__getattr__": proxy_getattr}
-    )
-    of_mod = of_mod_cls()
+
+@torch2oflow.register
+def _(mod: torch.nn.Module, verbose=False):
+    stack = _get_conversion_stack()
+    if len(stack) == 0:
+        # The oneflow ports of the registry are loaded by the first conversion
+        # of a module, whether it comes from compile() or a direct call
+        from .custom_transform import set_default_registry
+
+        set_default_registry()
+    start_time = time.perf_counter()
+    stack.append(0.0)
+    try:
+        plan = _get_conversion_plan(type(mod))
+        proxy_md = ProxySubmodule(mod)
+        of_mod = plan.of_mod_cls(proxy_md)
+        _convert_module_attrs(of_mod, mod, proxy_md)
+    finally:
+        seconds = time.perf_counter() - start_time
+        children_seconds = stack.pop()
+        if len(stack) > 0:
+            stack[-1] += seconds
+    plan.count += 1
+    plan.seconds += seconds - children_seconds
 
     if of_mod.training:
         of_mod.training = False
@@ -6,7 +6,7 @@ import warnings
 from pathlib import Path
 from typing import Dict, List, Union
 
-from onediff.utils import logger
+from onediff.utils import logger, trace_span
 from ..import_tools.importer import LazyMocker
 
 __all__ = ["transform_mgr"]
@@ -27,6 +27,7 @@ class TransformManager:
         self._setup_logger()
         self.mocker = LazyMocker(prefix="", suffix="", tmp_dir=None)
         self.loaded_modules = set()
+        self._mock_prepared = False
 
     def _setup_logger(self):
         name = "ONEDIFF"
@@ -56,8 +57,35 @@ class TransformManager:
         debug_message += f"\n{class_proxy_dict}\n"
         self.logger.debug(debug_message)
 
+    def _prepare_mock(self):
+        """Sets up the process for mocking packages, once before the first one.
+
+        Done on first use instead of on import, as it changes the warning
+        filters of the process and imports pydantic.
+        """
+        if self._mock_prepared:
+            return
+        self._mock_prepared = True
+        if not self.debug_mode:
+            warnings.simplefilter("ignore", category=UserWarning)
+            warnings.simplefilter("ignore", category=FutureWarning)
+
+        if importlib.util.find_spec("pydantic") is not None:
+            import pydantic
+
+            if pydantic.VERSION < "2.5.2":
+                logger.warning(
+                    f"Pydantic version {pydantic.VERSION} is too low, please upgrade to 2.5.2 or higher."
+                )
+                from oneflow.mock_torch.mock_utils import MockEnableDisableMixin
+
+                MockEnableDisableMixin.hazard_list.append(
+                    "huggingface_hub.inference._text_generation"
+                )
+
     def _transform_entity(self, entity):
         # TODO: Optimize _transform_entity for faster SDXL conversion (1.47s)
+        self._prepare_mock()
         result = self.mocker.mock_entity(entity)
         if result is None:
             RuntimeError(f"Failed to transform entity: {entity}")
@@ -76,12 +104,13 @@ class TransformManager:
             return self._torch_to_oflow_cls_map[mock_full_cls_name]
 
         # transform
-        if cls.__module__.startswith("torch."):
-            mod_name = cls.__module__.replace("torch.", "oneflow.")
-            mod = importlib.import_module(mod_name)
-            mock_cls = getattr(mod, cls.__name__)
-        else:
-            mock_cls = self._transform_entity(mock_full_cls_name)
+        with trace_span("transform_cls", cls=full_cls_name):
+            if cls.__module__.startswith("torch."):
+                mod_name = cls.__module__.replace("torch.", "oneflow.")
+                mod = importlib.import_module(mod_name)
+                mock_cls = getattr(mod, cls.__name__)
+            else:
+                mock_cls = self._transform_entity(mock_full_cls_name)
 
         self._torch_to_oflow_cls_map[mock_full_cls_name] = mock_cls
         self._oflow_to_torch_cls_map[mock_full_cls_name] = cls
@@ -111,21 +140,3 @@ class TransformManager:
 
 debug_mode = os.getenv("ONEDIFF_DEBUG", "0") == "1"
 transform_mgr = TransformManager(debug_mode=debug_mode, tmp_dir=None)
-
-if not transform_mgr.debug_mode:
-    warnings.simplefilter("ignore", category=UserWarning)
-    warnings.simplefilter("ignore", category=FutureWarning)
-
-
-if importlib.util.find_spec("pydantic") is not None:
-    import pydantic
-
-    if pydantic.VERSION < "2.5.2":
-        logger.warning(
-            f"Pydantic version {pydantic.VERSION} is too low, please upgrade to 2.5.2 or higher."
-        )
-        from oneflow.mock_torch.mock_utils import MockEnableDisableMixin
-
-        MockEnableDisableMixin.hazard_list.append(
-            "huggingface_hub.inference._text_generation"
-        )
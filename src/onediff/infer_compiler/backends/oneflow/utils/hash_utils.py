@@ -1,20 +1,59 @@
 import hashlib
+import weakref
 
+import torch
 from oneflow.framework.args_tree import ArgsTree
 
+# module -> (class and tensor stamp, child digests, digest)
+_MODULE_FINGERPRINT_MEMO = weakref.WeakKeyDictionary()
+
 
 def extract_node_name(v):
     return type(v).__name__
 
 
-def generate_input_structure_key(args_tree: ArgsTree):
+def generate_input_structure_key(args_tree: ArgsTree, length=6):
     out_str = "_".join(
         (extract_node_name(node) for node in args_tree.iter_nodes() if node is not None)
     )
-    return hashlib.sha256(out_str.encode("utf-8")).hexdigest()[:6]
+    return hashlib.sha256(out_str.encode("utf-8")).hexdigest()[:length]
+
+
+def _module_stamp(module: torch.nn.Module):
+    cls = type(module)
+    tensors = []
+    for tensor_dict in (module._parameters, module._buffers):
+        for name, tensor in tensor_dict.items():
+            if tensor is None:
+                tensors.append((name, None, None))
+            else:
+                tensors.append((name, tuple(tensor.shape), str(tensor.dtype)))
+    # Hyperparameters such as conv strides or norm eps, as printed by repr
+    return (f"{cls.__module__}.{cls.__qualname__}", module.extra_repr(), tuple(tensors))
+
+
+def generate_model_fingerprint(module: torch.nn.Module) -> str:
+    """Returns a sha256 digest of the structure of a torch module.
+
+    The digest covers the class names and `extra_repr` of all submodules and
+    the names, shapes and dtypes of their parameters and buffers, so it tells
+    apart variants (e.g. fp16 and int8) that share a repr. Digests are memoized per submodule
+    and only recomputed for subtrees whose structure changed.
+    """
+    stamp = _module_stamp(module)
+    children = tuple(
+        (name, None if child is None else generate_model_fingerprint(child))
+        for name, child in module._modules.items()
+    )
+    memo = _MODULE_FINGERPRINT_MEMO.get(module)
+    if memo is not None and memo[0] == stamp and memo[1] == children:
+        return memo[2]
+
+    digest = hashlib.sha256(repr((stamp, children)).encode("utf-8")).hexdigest()
+    _MODULE_FINGERPRINT_MEMO[module] = (stamp, children, digest)
+    return digest
 
 
-def generate_model_structure_key(deployable_module):
-    model = deployable_module._deployable_module_model.oneflow_module
-    model_hash = hashlib.sha256(f"{model}".encode("utf-8")).hexdigest()
-    return model_hash[:8]
+def generate_model_structure_key(deployable_module, length=8):
+    torch_module = deployable_module._deployable_module_model._torch_module
+    return generate_model_fingerprint(torch_module)[:length]
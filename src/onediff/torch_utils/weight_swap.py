@@ -0,0 +1,147 @@
+import os
+import time
+from typing import Dict, Iterator, Tuple, Union
+
+import torch
+import torch.nn as nn
+
+__all__ = ["swap_module_weights"]
+
+# dtype names of the safetensors format
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+class _StateDictSource:
+    def __init__(self, state_dict: Dict[str, torch.Tensor]):
+        self.state_dict = state_dict
+
+    def specs(self) -> Iterator[Tuple[str, Tuple[int, ...], torch.dtype]]:
+        for name, tensor in self.state_dict.items():
+            yield name, tuple(tensor.shape), tensor.dtype
+
+    def get(self, name: str, device) -> torch.Tensor:
+        return self.state_dict[name]
+
+
+class _SafetensorsSource:
+    """Reads the tensors of a safetensors file one at a time."""
+
+    def __init__(self, path: str, device):
+        from safetensors import safe_open
+
+        self.file = safe_open(path, framework="pt", device=str(device))
+
+    def specs(self) -> Iterator[Tuple[str, Tuple[int, ...], torch.dtype]]:
+        for name in self.file.keys():
+            tensor_slice = self.file.get_slice(name)
+            dtype = _SAFETENSORS_DTYPES.get(tensor_slice.get_dtype())
+            yield name, tuple(tensor_slice.get_shape()), dtype
+
+    def get(self, name: str, device) -> torch.Tensor:
+        return self.file.get_tensor(name)
+
+
+def _check_dtype(name, src_dtype, dst_dtype):
+    if src_dtype == dst_dtype:
+        return None
+    if (
+        src_dtype is not None
+        and src_dtype.is_floating_point
+        and dst_dtype.is_floating_point
+    ):
+        # Floating point checkpoints are cast, e.g. fp32 files into fp16 modules
+        return None
+    return f"{name}: dtype {src_dtype} does not match {dst_dtype}"
+
+
+def swap_module_weights(
+    module: nn.Module,
+    weights: Union[str, os.PathLike, Dict[str, torch.Tensor]],
+    *,
+    strict: bool = True,
+    prefix: str = "",
+) -> Dict[str, Union[int, float]]:
+    """Copies new weights into the parameters and buffers of `module` in place.
+
+    The storage of the tensors is kept, so everything sharing it (e.g. compiled
+    graphs) sees the new weights. All names, shapes and dtypes are validated
+    before any tensor is copied, and a safetensors file is read one tensor at
+    a time straight to the device of the module.
+
+    Args:
+        module (nn.Module): The module to update.
+        weights: A state dict, or the path of a safetensors file.
+        strict (bool): Whether the names of `weights` must match the module
+            exactly. Otherwise missing and unexpected names are ignored.
+        prefix (str): A prefix of the names of `weights` to strip, e.g.
+            "model.diffusion_model." for the UNet of a full checkpoint.
+            Names without it are ignored.
+
+    Returns:
+        A dict with the number of `tensors` and `bytes` copied, and `seconds`.
+    """
+    start_time = time.perf_counter()
+    targets = module.state_dict(keep_vars=True)
+    device = next(iter(targets.values())).device if len(targets) > 0 else "cpu"
+    if isinstance(weights, (str, os.PathLike)):
+        source = _SafetensorsSource(os.fspath(weights), device)
+    else:
+        source = _StateDictSource(weights)
+
+    names = {}
+    problems = []
+    for name, shape, dtype in source.specs():
+        if not name.startswith(prefix):
+            continue
+        target_name = name[len(prefix) :]
+        target = targets.get(target_name)
+        if target is None:
+            if strict:
+                problems.append(f"{target_name}: unexpected")
+            continue
+        if shape != tuple(target.shape):
+            problems.append(
+                f"{target_name}: shape {shape} does not match {tuple(target.shape)}"
+            )
+            continue
+        problem = _check_dtype(target_name, dtype, target.dtype)
+        if problem is not None:
+            problems.append(problem)
+            continue
+        names[name] = target_name
+    if strict:
+        missing = targets.keys() - set(names.values())
+        problems.extend(f"{name}: missing" for name in sorted(missing))
+    if len(problems) > 0:
+        raise ValueError(
+            f"Can't swap the weights of {type(module).__name__}:\n  "
+            + "\n  ".join(problems)
+        )
+
+    copied_bytes = 0
+    with torch.no_grad():
+        for name, target_name in names.items():
+            target = targets[target_name]
+            src = source.get(name, device)
+            # Bypass the patched copy_ of constant folded weights, the caller
+            # refreshes them once all tensors are copied
+            torch.Tensor.copy_(target, src, non_blocking=True)
+            copied_bytes += target.nelement() * target.element_size()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return {
+        "tensors": len(names),
+        "bytes": copied_bytes,
+        "seconds": time.perf_counter() - start_time,
+    }
@@ -5,3 +5,4 @@ from .env_var import (
     set_integer_env_var,
 )
 from .log_utils import logger
+from .trace_utils import start_tracing, stop_tracing, trace_span
@@ -2,6 +2,7 @@ import importlib
 import os
 import platform
 import traceback
+from functools import lru_cache
 from inspect import ismodule
 from types import ModuleType
 
@@ -23,25 +24,26 @@ def check_module_availability(module_name):
     return True
 
 
-_oneflow_available = check_module_availability("oneflow")
-_onediff_quant_available = check_module_availability("onediff_quant")
-_nexfort_available = check_module_availability("nexfort")
-
-if system != "Linux":
-    print(f"Warning: OneFlow is only supported on Linux. Current system: {system}")
-    _oneflow_available = False
+# The checks import the packages, so they run on first use instead of when
+# this module is imported
 
 
+@lru_cache(maxsize=None)
 def is_oneflow_available():
-    return _oneflow_available
+    if system != "Linux":
+        print(f"Warning: OneFlow is only supported on Linux. Current system: {system}")
+        return False
+    return check_module_availability("oneflow")
 
 
+@lru_cache(maxsize=None)
 def is_onediff_quant_available():
-    return _onediff_quant_available
+    return check_module_availability("onediff_quant")
 
 
+@lru_cache(maxsize=None)
 def is_nexfort_available():
-    return _nexfort_available
+    return check_module_availability("nexfort")
 
 
 class DynamicModuleLoader(ModuleType):
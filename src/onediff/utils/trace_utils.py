@@ -0,0 +1,147 @@
+"""Nested spans of the compile and run lifecycle, written as a Chrome trace.
+
+Spans are recorded between `start_tracing` and `stop_tracing`, or for the
+whole process when the `ONEDIFF_TRACE_FILE` environment variable is set. The
+trace file opens in chrome://tracing or https://ui.perfetto.dev. While a
+`torch.profiler` session is active, spans are also emitted as
+`record_function` ranges, so they show up in its traces.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+from typing import Dict, List, Optional
+
+from .log_utils import logger
+
+__all__ = [
+    "trace_span",
+    "start_tracing",
+    "stop_tracing",
+    "is_tracing",
+    "save_trace",
+]
+
+_TRACE_EVENTS: Optional[List[Dict]] = None
+_TRACE_LOCK = threading.Lock()
+
+
+def is_tracing() -> bool:
+    return _TRACE_EVENTS is not None
+
+
+def _torch_profiler_enabled() -> bool:
+    # Don't import torch only to find out that it isn't profiling
+    torch = sys.modules.get("torch")
+    return torch is not None and torch.autograd._profiler_enabled()
+
+
+def start_tracing() -> None:
+    """Starts recording spans, dropping the ones recorded before."""
+    global _TRACE_EVENTS
+    with _TRACE_LOCK:
+        _TRACE_EVENTS = []
+
+
+def stop_tracing(file_path: Optional[str] = None) -> List[Dict]:
+    """Stops recording spans, and writes them to `file_path` if given.
+
+    Returns the recorded Chrome trace events.
+    """
+    global _TRACE_EVENTS
+    with _TRACE_LOCK:
+        events, _TRACE_EVENTS = _TRACE_EVENTS or [], None
+    if file_path is not None:
+        save_trace(events, file_path)
+    return events
+
+
+def save_trace(events: List[Dict], file_path: str) -> None:
+    pid = os.getpid()
+    thread_names = {t.ident: t.name for t in threading.enumerate()}
+    metadata = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": tid,
+            "args": {"name": thread_names.get(tid, str(tid))},
+        }
+        for tid in sorted({event["tid"] for event in events})
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+    logger.info(f"Saved {len(events)} trace events to {file_path}")
+
+
+class trace_span:
+    """Records a span of the lifecycle, as a context manager or a decorator.
+
+    Spans cost a flag check when neither tracing nor torch.profiler is on.
+
+    Args:
+        name (str): The name of the span.
+        category (str): The category of the span in the trace.
+        **args: Extra values shown with the span in the trace.
+    """
+
+    __slots__ = ["name", "category", "args", "start_us", "record_function"]
+
+    def __init__(self, name: str, category: str = "onediff", **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_us = None
+        self.record_function = None
+
+    def __enter__(self):
+        if _torch_profiler_enabled():
+            import torch
+
+            self.record_function = torch.autograd.profiler.record_function(self.name)
+            self.record_function.__enter__()
+        if _TRACE_EVENTS is not None:
+            self.start_us = time.perf_counter_ns() // 1000
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.start_us is not None:
+            end_us = time.perf_counter_ns() // 1000
+            event = {
+                "name": self.name,
+                "cat": self.category,
+                "ph": "X",
+                "ts": self.start_us,
+                "dur": end_us - self.start_us,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            }
+            if self.args:
+                event["args"] = {k: str(v) for k, v in self.args.items()}
+            events = _TRACE_EVENTS
+            if events is not None:
+                events.append(event)
+            self.start_us = None
+        if self.record_function is not None:
+            self.record_function.__exit__(exc_type, exc_val, exc_tb)
+            self.record_function = None
+
+    def __call__(self, func):
+        name, category, args = self.name, self.category, self.args
+
+        @wraps(func)
+        def traced(*func_args, **func_kwargs):
+            with trace_span(name, category, **args):
+                return func(*func_args, **func_kwargs)
+
+        return traced
+
+
+_TRACE_FILE = os.environ.get("ONEDIFF_TRACE_FILE")
+if _TRACE_FILE:
+    start_tracing()
+    atexit.register(lambda: stop_tracing(_TRACE_FILE))
@@ -0,0 +1,102 @@
+import time
+import unittest
+from unittest import mock
+
+from onediff.infer_compiler.backends.call_metrics import CallMetrics
+from onediff.infer_compiler.backends.oneflow import (
+    args_tree_util,
+    background_compile_utils,
+)
+from onediff.infer_compiler.backends.oneflow.background_compile_utils import (
+    BackgroundGraphCompiler,
+)
+
+
+def _wait(compiler, key):
+    while compiler.get_status()[key]["status"] in ("pending", "running"):
+        time.sleep(0.01)
+
+
+class TestBackgroundGraphCompiler(unittest.TestCase):
+    @mock.patch.object(background_compile_utils, "RETRY_DELAY_SECONDS", 0.0)
+    def test_failed_build_is_retried(self):
+        compiler = BackgroundGraphCompiler()
+        attempts = []
+
+        def build_fn():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise RuntimeError("out of memory")
+            return "graph"
+
+        self.assertTrue(compiler.submit("key", build_fn))
+        _wait(compiler, "key")
+        self.assertEqual(compiler.get_status()["key"]["status"], "failed")
+
+        self.assertTrue(compiler.submit("key", build_fn))
+        _wait(compiler, "key")
+        self.assertEqual(compiler.pop_ready("key"), "graph")
+
+    @mock.patch.object(background_compile_utils, "RETRY_DELAY_SECONDS", 0.0)
+    def test_retries_are_capped(self):
+        compiler = BackgroundGraphCompiler()
+
+        def build_fn():
+            raise RuntimeError("unsupported op")
+
+        for _ in range(background_compile_utils.MAX_ATTEMPTS):
+            self.assertTrue(compiler.submit("key", build_fn))
+            _wait(compiler, "key")
+        self.assertFalse(compiler.submit("key", build_fn))
+        status = compiler.get_status()["key"]
+        self.assertEqual(status["attempts"], background_compile_utils.MAX_ATTEMPTS)
+
+
+class FakeGraph:
+    is_compiled = True
+    compile_seconds = 1.0
+
+
+class FakeStaticModule:
+    """The attributes read by _prepare_async_graph, for dynamic=False."""
+
+    def __init__(self):
+        self._deployable_module_dpl_graph = None
+        self._deployable_module_input_structure_key = None
+        self._deployable_module_enable_dynamic = False
+        self._deployable_module_async_compiler = BackgroundGraphCompiler()
+        self._deployable_module_graph_cache = {}
+        self._deployable_module_metrics = CallMetrics("UNet")
+        self.builds = []
+
+    def _compile_graph(self, method_name, *args, **kwargs):
+        self.builds.append(method_name)
+        return FakeGraph()
+
+
+class TestPrepareAsyncGraph(unittest.TestCase):
+    def test_static_module_builds_one_graph(self):
+        module = FakeStaticModule()
+        compiler = module._deployable_module_async_compiler
+        self.assertFalse(
+            args_tree_util._prepare_async_graph(module, "forward", "a", (), {})
+        )
+        self.assertFalse(
+            args_tree_util._prepare_async_graph(module, "forward", "b", (), {})
+        )
+        _wait(compiler, args_tree_util._STATIC_GRAPH_KEY)
+
+        self.assertTrue(
+            args_tree_util._prepare_async_graph(module, "forward", "b", (), {})
+        )
+        # The graph serves other input structures without another build
+        self.assertTrue(
+            args_tree_util._prepare_async_graph(module, "forward", "c", (), {})
+        )
+        self.assertEqual(module.builds, ["forward"])
+        counters = module._deployable_module_metrics.as_dict()["counters"]
+        self.assertEqual(counters["graph_cache_misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from onediff.infer_compiler.backends.call_metrics import CallMetrics
+
+
+class TestCallMetrics(unittest.TestCase):
+    def test_phases_and_counters(self):
+        metrics = CallMetrics("UNet")
+        metrics.record_call(0.001, 0.0005, 0.02, 0.002)
+        metrics.record_call(0.003, 0.0005, 0.04, 0.002)
+        metrics.count("graph_cache_hits")
+        metrics.count("graph_cache_misses", 2)
+        metrics.record_compile("(2,4,64,64)", 30.0)
+
+        result = metrics.as_dict()
+        execution = result["phases"]["execution"]
+        self.assertEqual(execution["count"], 2)
+        self.assertAlmostEqual(execution["seconds"], 0.06)
+        self.assertAlmostEqual(execution["mean_seconds"], 0.03)
+        self.assertAlmostEqual(execution["max_seconds"], 0.04)
+        self.assertAlmostEqual(result["phases"]["total"]["seconds"], 0.069)
+        self.assertEqual(result["counters"]["graph_cache_hits"], 1)
+        self.assertEqual(result["counters"]["graph_cache_misses"], 2)
+        self.assertEqual(result["compiles"]["(2,4,64,64)"]["seconds"], 30.0)
+
+        metrics.reset()
+        self.assertEqual(metrics.as_dict()["phases"]["total"]["count"], 0)
+
+    def test_prometheus_text(self):
+        metrics = CallMetrics("VAE")
+        metrics.record_call(0.0, 0.0, 0.5, 0.0)
+        metrics.set_counter("graph_cache_evictions", 3)
+        text = metrics.to_prometheus()
+        self.assertIn(
+            'onediff_call_phase_seconds_count{module="VAE",phase="execution"} 1', text
+        )
+        self.assertIn('onediff_graph_cache_evictions_total{module="VAE"} 3', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from onediff.infer_compiler.backends.oneflow.graph_cache_manager import (
+    GraphCacheManager,
+    ModuleGraphCache,
+)
+
+
+class FakeGraph:
+    def __init__(self, device_bytes, compile_seconds):
+        self.device_bytes = device_bytes
+        self.compile_seconds = compile_seconds
+
+
+class TestGraphCacheManager(unittest.TestCase):
+    def test_byte_budget_across_modules(self):
+        manager = GraphCacheManager(max_bytes=300 << 20)
+        unet_cache = ModuleGraphCache("UNet", 9, manager)
+        vae_cache = ModuleGraphCache("VAE", 9, manager)
+
+        unet_cache.put("a", FakeGraph(100 << 20, 60.0))
+        vae_cache.put("a", FakeGraph(100 << 20, 5.0))
+        unet_cache.put("b", FakeGraph(100 << 20, 60.0))
+        unet_cache.put("c", FakeGraph(100 << 20, 60.0))
+
+        # The VAE graph is the cheapest to rebuild
+        self.assertNotIn("a", vae_cache)
+        self.assertEqual(len(unet_cache), 3)
+        stats = manager.get_stats()
+        self.assertEqual(stats["total_bytes"], 300 << 20)
+        self.assertEqual(stats["evictions"], 1)
+
+    def test_hits_protect_from_eviction(self):
+        manager = GraphCacheManager()
+        cache = ModuleGraphCache("UNet", 2, manager)
+        cache.put("a", FakeGraph(100 << 20, 10.0))
+        cache.put("b", FakeGraph(100 << 20, 10.0))
+        for _ in range(5):
+            self.assertIsNotNone(cache.get("a"))
+        cache.put("c", FakeGraph(100 << 20, 10.0))
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(manager.get_stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
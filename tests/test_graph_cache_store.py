@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+from onediff.infer_compiler.backends.oneflow.graph_cache_store import GraphCacheStore
+
+
+def _write_bytes(num_bytes):
+    def write_fn(path):
+        with open(path, "wb") as f:
+            f.write(b"0" * num_bytes)
+
+    return write_fn
+
+
+class TestGraphCacheStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+
+    def test_put_and_lookup(self):
+        store = GraphCacheStore(self.root)
+        key = {"name": "unet", "model": "abc", "input": "def"}
+        self.assertIsNone(store.lookup(key))
+
+        file_path = store.put(key, _write_bytes(16), prefix="unet")
+        self.assertEqual(store.lookup(key), file_path)
+        self.assertTrue(os.path.isfile(file_path))
+        self.assertEqual(store.total_bytes(), 16)
+
+        # A new store reads the index from the manifest
+        self.assertEqual(GraphCacheStore(self.root).lookup(key), file_path)
+
+    def test_lru_eviction(self):
+        store = GraphCacheStore(self.root, max_bytes=32)
+        keys = [{"input": str(i)} for i in range(3)]
+        paths = [store.put(key, _write_bytes(16)) for key in keys[:2]]
+        store.lookup(keys[0])
+        store.put(keys[2], _write_bytes(16))
+
+        self.assertIsNotNone(store.lookup(keys[0]))
+        self.assertIsNone(store.lookup(keys[1]))
+        self.assertFalse(os.path.exists(paths[1]))
+        self.assertLessEqual(store.total_bytes(), 32)
+
+    def test_access_times_are_persisted(self):
+        store = GraphCacheStore(self.root, max_bytes=32)
+        keys = [{"input": str(i)} for i in range(3)]
+        for key in keys[:2]:
+            store.put(key, _write_bytes(16))
+        store.lookup(keys[0])
+        store.flush()
+
+        # After a restart, the lookup of keys[0] still counts
+        store = GraphCacheStore(self.root, max_bytes=32)
+        store.put(keys[2], _write_bytes(16))
+        self.assertIsNotNone(store.lookup(keys[0]))
+        self.assertIsNone(store.lookup(keys[1]))
+
+    def test_evicted_weights_are_removed(self):
+        store = GraphCacheStore(self.root, max_bytes=64)
+        os.makedirs(store.weights_dir)
+
+        def write_with_weights(*digests):
+            def write_fn(path):
+                _write_bytes(16)(path)
+                for digest in digests:
+                    with open(
+                        os.path.join(store.weights_dir, f"{digest}.weight"), "wb"
+                    ) as f:
+                        f.write(b"0" * 8)
+                return set(digests)
+
+            return write_fn
+
+        store.put({"input": "0"}, write_with_weights("shared", "a"))
+        store.put({"input": "1"}, write_with_weights("shared", "b"))
+        self.assertEqual(store.total_bytes(), 16 * 2 + 8 * 3)
+        store.put({"input": "2"}, write_with_weights("c"))
+
+        self.assertIsNone(store.lookup({"input": "0"}))
+        self.assertEqual(
+            sorted(os.listdir(store.weights_dir)),
+            ["b.weight", "c.weight", "shared.weight"],
+        )
+        self.assertLessEqual(store.total_bytes(), 64)
+
+    def test_failed_write_leaves_no_entry(self):
+        store = GraphCacheStore(self.root)
+
+        def broken_write(path):
+            with open(path, "wb") as f:
+                f.write(b"0")
+            raise RuntimeError("write failed")
+
+        with self.assertRaises(RuntimeError):
+            store.put({"input": "x"}, broken_write)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(os.listdir(self.root), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
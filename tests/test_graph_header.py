@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from onediff.infer_compiler.backends.oneflow.graph_header_utils import (
+    inspect_graph,
+    read_graph_header,
+    write_graph_header,
+)
+
+
+class TestGraphHeader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.graph_file = os.path.join(self.tmp_dir.name, "unet.graph")
+        with open(self.graph_file, "wb") as f:
+            f.write(b"graph")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_graph_without_header(self):
+        result = inspect_graph(self.graph_file)
+        self.assertIsNone(result["header"])
+        self.assertTrue(result["compatible"])
+
+    def test_version_mismatch(self):
+        header = {
+            "header_version": 1,
+            "onediff_version": "0.0.0",
+            "oneflow_version": "0.0.0",
+            "device": "cuda:sm_00",
+        }
+        write_graph_header(self.graph_file, header)
+        self.assertEqual(read_graph_header(self.graph_file), header)
+
+        result = inspect_graph(self.graph_file)
+        self.assertFalse(result["compatible"])
+        self.assertEqual(len(result["problems"]), 3)
+        result = inspect_graph(self.graph_file, check_device=False)
+        self.assertEqual(len(result["problems"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
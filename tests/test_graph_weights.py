@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+import oneflow as flow  # usort: skip
+from onediff.infer_compiler.backends.oneflow.graph_weights_utils import (
+    externalize_weights,
+    get_weight_digests,
+    resolve_weights,
+)
+
+
+class TestGraphWeights(unittest.TestCase):
+    def setUp(self) -> None:
+        self.weight = flow.randn(4, 4)
+        self.state_dict = {
+            "graph_0": {"states": {"model.linear.weight": self.weight}},
+            "graph_1": {"states": {"model.linear.weight": self.weight.clone()}},
+        }
+
+    def test_weights_are_deduplicated(self):
+        with tempfile.TemporaryDirectory() as weights_dir:
+            out = externalize_weights(self.state_dict, weights_dir)
+            self.assertEqual(len(get_weight_digests(out)), 1)
+            self.assertEqual(len(os.listdir(weights_dir)), 1)
+
+            resolved = resolve_weights(out, weights_dir)
+            for graph_state in resolved.values():
+                tensor = graph_state["states"]["model.linear.weight"]
+                self.assertTrue(flow.equal(tensor, self.weight))
+
+    def test_resident_weights_are_bound(self):
+        with tempfile.TemporaryDirectory() as weights_dir:
+            out = externalize_weights(self.state_dict, weights_dir)
+            resident = flow.zeros(4, 4)
+            resolved = resolve_weights(out, weights_dir, {"linear.weight": resident})
+            tensor = resolved["graph_0"]["states"]["model.linear.weight"]
+            self.assertIs(tensor, resident)
+
+    def test_bfloat16_weights(self):
+        weight = flow.randn(4, 4).to(flow.bfloat16)
+        state_dict = {"graph_0": {"states": {"model.linear.weight": weight}}}
+        with tempfile.TemporaryDirectory() as weights_dir:
+            out = externalize_weights(state_dict, weights_dir)
+            resolved = resolve_weights(out, weights_dir)
+            tensor = resolved["graph_0"]["states"]["model.linear.weight"]
+            self.assertEqual(tensor.dtype, flow.bfloat16)
+            self.assertTrue(flow.equal(tensor, weight))
+
+
+if __name__ == "__main__":
+    unittest.main()
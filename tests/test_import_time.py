@@ -0,0 +1,33 @@
+import subprocess
+import sys
+import unittest
+
+IMPORT_SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+import onediff
+from onediff.infer_compiler import OneflowCompileOptions
+seconds = time.perf_counter() - start
+heavy = [m for m in ("torch", "oneflow", "nexfort", "diffusers") if m in sys.modules]
+print(seconds, ",".join(heavy))
+"""
+
+# Generous, a cold import only pays for logging and the option types
+MAX_IMPORT_SECONDS = 0.5
+
+
+class TestImportTime(unittest.TestCase):
+    def test_import_is_lazy(self):
+        output = subprocess.check_output(
+            [sys.executable, "-c", IMPORT_SCRIPT], text=True
+        ).split()
+        seconds = float(output[0])
+        heavy_modules = output[1] if len(output) > 1 else ""
+        self.assertEqual(heavy_modules, "")
+        self.assertLess(seconds, MAX_IMPORT_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
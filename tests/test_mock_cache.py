@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+from onediff.infer_compiler.backends.oneflow.import_tools.mock_cache import MockCache
+
+
+class TestMockCache(unittest.TestCase):
+    def test_entries_persist_by_version(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "mock", "mock_cache.json")
+            cache = MockCache(file_path)
+            cache.set_torch_dependency("diffusers", "0.27.2", True)
+            cache.set_module_updates(
+                "diffusers.models", "0.27.2", [["diffusers.models;Attention", "a.py"]]
+            )
+            cache.save()
+
+            # Another process adds its entries without dropping the first ones
+            other = MockCache(file_path)
+            other.set_torch_dependency("comfy", "0.0.1", False)
+            other.save()
+
+            cache = MockCache(file_path)
+            self.assertTrue(cache.get_torch_dependency("diffusers", "0.27.2"))
+            self.assertFalse(cache.get_torch_dependency("comfy", "0.0.1"))
+            self.assertIsNone(cache.get_torch_dependency("diffusers", "0.28.0"))
+            self.assertEqual(
+                cache.get_module_updates("diffusers.models", "0.27.2"),
+                [["diffusers.models;Attention", "a.py"]],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import torch
+from onediff.infer_compiler.backends.oneflow.utils.hash_utils import (
+    generate_model_fingerprint,
+)
+
+
+class SubModule(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(4, 8, 3)
+        self.norm = torch.nn.GroupNorm(2, 8)
+
+
+class MainModule(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.sub_module = SubModule()
+        self.linear = torch.nn.Linear(8, 4)
+
+
+class TestModelFingerprint(unittest.TestCase):
+    def test_same_structure(self):
+        self.assertEqual(
+            generate_model_fingerprint(MainModule()),
+            generate_model_fingerprint(MainModule()),
+        )
+
+    def test_dtype_changes_fingerprint(self):
+        model = MainModule()
+        fp32_fingerprint = generate_model_fingerprint(model)
+        model.half()
+        self.assertNotEqual(fp32_fingerprint, generate_model_fingerprint(model))
+
+    def test_submodule_changes_fingerprint(self):
+        model = MainModule()
+        fingerprint = generate_model_fingerprint(model)
+        model.sub_module.conv = torch.nn.Conv2d(4, 8, 1)
+        self.assertNotEqual(fingerprint, generate_model_fingerprint(model))
+
+    def test_hyperparameters_change_fingerprint(self):
+        model = MainModule()
+        fingerprint = generate_model_fingerprint(model)
+        model.sub_module.conv = torch.nn.Conv2d(4, 8, 3, padding=1)
+        self.assertNotEqual(fingerprint, generate_model_fingerprint(model))
+
+        model = MainModule()
+        model.sub_module.norm = torch.nn.GroupNorm(2, 8, eps=1e-6)
+        self.assertNotEqual(fingerprint, generate_model_fingerprint(model))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+import torch
+from onediff.infer_compiler.backends.oneflow.shape_bucket_utils import ShapeBucketer
+
+
+def unet_forward(sample, timestep, encoder_hidden_states, **kwargs):
+    pass
+
+
+def vae_decode(z, return_dict=True):
+    pass
+
+
+class TestShapeBucketer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.bucketer = ShapeBucketer([(128, 128, 2), (96, 96, 2), (64, 64, 1)])
+
+    def test_find_bucket(self):
+        self.assertEqual(self.bucketer.find_bucket(64, 64, 1), (64, 64, 1))
+        self.assertEqual(self.bucketer.find_bucket(72, 64, 1), (96, 96, 2))
+        self.assertEqual(self.bucketer.find_bucket(100, 96, 2), (128, 128, 2))
+        self.assertIsNone(self.bucketer.find_bucket(136, 128, 1))
+
+    def test_pad_and_crop(self):
+        sample = torch.randn(1, 4, 72, 80)
+        timestep = torch.tensor([10])
+        hidden_states = torch.randn(1, 77, 32)
+
+        args, kwargs, info = self.bucketer.pad_inputs(
+            (sample, timestep), {"encoder_hidden_states": hidden_states}, unet_forward
+        )
+        self.assertEqual(tuple(args[0].shape), (2, 4, 96, 96))
+        self.assertEqual(tuple(args[1].shape), (2,))
+        self.assertEqual(tuple(kwargs["encoder_hidden_states"].shape), (2, 77, 32))
+        self.assertTrue(torch.equal(args[0][:1, :, :72, :80], sample))
+
+        output = self.bucketer.crop_outputs((args[0] * 2,), info)
+        self.assertTrue(torch.equal(output[0], sample * 2))
+
+    def test_pad_scaled_inputs(self):
+        sample = torch.randn(1, 4, 72, 80)
+        controlnet_cond = torch.randn(1, 3, 576, 640)
+        residuals = (torch.randn(1, 32, 72, 80), torch.randn(1, 64, 36, 40))
+        # Not a batch input, its first dim is not padded
+        cross_attention_bias = torch.randn(1, 8)
+
+        args, kwargs, info = self.bucketer.pad_inputs(
+            (sample, torch.tensor([10])),
+            {
+                "encoder_hidden_states": torch.randn(1, 77, 32),
+                "controlnet_cond": controlnet_cond,
+                "down_block_additional_residuals": residuals,
+                "cross_attention_bias": cross_attention_bias,
+            },
+            unet_forward,
+        )
+        self.assertEqual(tuple(kwargs["controlnet_cond"].shape), (2, 3, 768, 768))
+        self.assertEqual(
+            [tuple(t.shape) for t in kwargs["down_block_additional_residuals"]],
+            [(2, 32, 96, 96), (2, 64, 48, 48)],
+        )
+        self.assertTrue(
+            torch.equal(kwargs["cross_attention_bias"], cross_attention_bias)
+        )
+
+    def test_crop_scaled_outputs(self):
+        z = torch.randn(1, 4, 72, 80)
+        args, kwargs, info = self.bucketer.pad_inputs((z,), {}, vae_decode)
+        self.assertEqual(tuple(args[0].shape), (2, 4, 96, 96))
+
+        image = torch.randn(2, 3, 768, 768)
+        output = self.bucketer.crop_outputs((image,), info)
+        self.assertTrue(torch.equal(output[0], image[:1, :, :576, :640]))
+
+    def test_stats(self):
+        for _ in range(3):
+            self.bucketer.pad_inputs((torch.randn(1, 4, 64, 64),), {})
+        self.bucketer.pad_inputs((torch.randn(1, 4, 256, 256),), {})
+
+        stats = self.bucketer.get_stats()
+        self.assertEqual(stats["64x64x1"], {"hits": 2, "misses": 1})
+        self.assertEqual(stats["unbucketed"], {"hits": 0, "misses": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
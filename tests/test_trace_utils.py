@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+import unittest
+
+from onediff.utils.trace_utils import start_tracing, stop_tracing, trace_span
+
+
+class TestTraceUtils(unittest.TestCase):
+    def test_nested_spans_to_chrome_trace(self):
+        @trace_span("graph_build")
+        def build():
+            with trace_span("transform_cls", cls="Attention"):
+                pass
+
+        build()  # Not tracing, nothing is recorded
+        start_tracing()
+        with trace_span("UNet.forward", "step"):
+            build()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "trace.json")
+            events = stop_tracing(file_path)
+            with open(file_path) as f:
+                trace = json.load(f)
+
+        self.assertEqual(
+            [e["name"] for e in events],
+            ["transform_cls", "graph_build", "UNet.forward"],
+        )
+        inner, middle, outer = events
+        self.assertEqual(inner["args"], {"cls": "Attention"})
+        self.assertEqual(outer["cat"], "step")
+        self.assertLessEqual(outer["ts"], middle["ts"])
+        self.assertLessEqual(middle["ts"] + middle["dur"], outer["ts"] + outer["dur"])
+        names = [e["name"] for e in trace["traceEvents"]]
+        self.assertIn("thread_name", names)
+        self.assertIn("UNet.forward", names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from onediff.torch_utils.weight_swap import swap_module_weights
+
+
+class TestWeightSwap(unittest.TestCase):
+    def setUp(self) -> None:
+        self.module = torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Linear(4, 2))
+        self.new_state_dict = {
+            k: torch.randn_like(v) for k, v in self.module.state_dict().items()
+        }
+
+    def test_swap_state_dict(self):
+        data_ptr = self.module[0].weight.data_ptr()
+        result = swap_module_weights(self.module, self.new_state_dict)
+        self.assertEqual(result["tensors"], 4)
+        self.assertEqual(self.module[0].weight.data_ptr(), data_ptr)
+        for k, v in self.module.state_dict().items():
+            self.assertTrue(torch.equal(v, self.new_state_dict[k]))
+
+    def test_validate_before_copy(self):
+        self.new_state_dict["1.weight"] = torch.randn(2, 3)
+        old_weight = self.module[0].weight.detach().clone()
+        with self.assertRaises(ValueError):
+            swap_module_weights(self.module, self.new_state_dict)
+        self.assertTrue(torch.equal(self.module[0].weight, old_weight))
+
+    def test_swap_safetensors(self):
+        from safetensors.torch import save_file
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "model.safetensors")
+            save_file({f"model.{k}": v for k, v in self.new_state_dict.items()}, path)
+            swap_module_weights(self.module, path, prefix="model.")
+        for k, v in self.module.state_dict().items():
+            self.assertTrue(torch.equal(v, self.new_state_dict[k]))
+
+
+if __name__ == "__main__":
+    unittest.main()